@@ -2,11 +2,24 @@
 from naoqi import ALProxy
 import socket
 import time
-import struct
-import cv2
-import numpy as np
 import threading
-import sys
+
+from camera_source import CAPTURE_PROFILES, NaoqiCameraSource
+from change_detector import ChangeDetector
+from clock_sync import ClockSync
+from emotion_aggregator import EmotionAggregator
+from emotion_channel import EmotionChannel
+from emotion_registry import code_table, name
+from face_roi import create_roi_tracker
+from frame_encoders import create_encoder
+from frame_transport import (DatagramSender, NonBlockingFrameSender, ReconnectingTransport,
+                             connect_tcp)
+from label_protocol import emotion_key, parse_message
+from latency_histogram import LatencyTracker
+from quality_controller import AdaptiveQualityController
+from session_recorder import SessionRecorder
+from speech_worker import AsyncSpeech, EmotionState, ready_to_speak
+from video_pipeline import VideoPipeline
 
 # === Pepper Configuration ===
 PEPPER_IP = "192.168.0.102"
@@ -16,15 +29,58 @@ PEPPER_PORT = 9559
 LAPTOP_IP = "10.9.73.57"
 LAPTOP_PORT = 5000          # Laptop's image receiver port
 PEPPER_RECEIVE_PORT= 6000  # Port to receive classified emotion back
+video_transport = "tcp"  # "udp" avoids head-of-line blocking on lossy WiFi (laptop_receiver.py --udp)
 
 # === Pepper Camera Setup ===
-resolution = 2  # 640x480
-color_space = 13  # kBGRColorSpace
+capture_profile = "viewer"  # "viewer": 640x480 BGR, "classifier": 320x240 luminance only
+resolution, color_space = CAPTURE_PROFILES[capture_profile]
 fps = 10
 
+# === Adaptive Stream Quality ===
+adaptive_quality = False  # trade JPEG quality and resolution for bandwidth when the WiFi lags
+target_bandwidth = 400 * 1024  # bytes/s we allow the video stream on the lab WiFi
+latency_budget = 0.1  # seconds one frame may spend being sent
+
+# === Stream Encoding ===
+stream_encoder = "jpeg"  # jpeg, png, webp, zlib or gray; compare with bench_encoders.py
+
+# === Face ROI Mode ===
+face_roi_mode = False  # send only a padded face crop (extended frame header)
+face_detector = "haar"  # "haar" (OpenCV on the robot) or "naoqi" (ALFaceDetection)
+
+# === Static Scene Suppression ===
+suppress_static = False  # skip frames that barely differ from the last one sent
+static_threshold = 4.0  # mean absolute pixel difference on a 0-255 scale
+keyframe_interval = 2.0  # seconds; a frame is always sent at least this often
+
+# === Session Recording ===
+record_session = False  # record frames, emotions and speech for later replay
+session_dir = "sessions"
+
+# === Emotion Smoothing ===
+emotion_smoothing = None  # "ema", "majority", "dwell" or None for raw labels; see bench_aggregator.py
+
+# === Emotion Admission ===
+label_rate = 20.0  # labels/s admitted per classifier host, None for no limit
+label_burst = 20  # labels a host may send at once after a quiet spell
+max_pending_labels = 64  # labels handled per poll at most; older ones are shed
+
+# === Latency Tracing ===
+trace_latency = False  # histogram capture-to-speech latency; dump with kill -USR1 <pid>
+
 camera_name = "pepperStream"
-capture_id = None
-sock = None
+camera = None
+transport = None
+pipeline = None
+roi_tracker = None
+recorder = SessionRecorder(session_dir) if record_session else None
+clock = ClockSync() if trace_latency else None
+latency = LatencyTracker(clock=clock) if trace_latency else None
+if latency:
+    latency.install_signal()
+emotions = EmotionState()  # latest label, handed from the emotion channel to the storyteller
+speaker = AsyncSpeech()
+aggregator = EmotionAggregator(emotion_smoothing) if emotion_smoothing else None
 
 # === Initialize TTS and AnimatedSpeech services ===
 try:
@@ -41,27 +97,24 @@ except Exception as e:
     animated_speech = None
 
 # === Emotion-based Speech Tagging ===
+# Indexed by emotion code; emotions without an entry use neutral's
+SPEECH_TAGS = code_table({
+    "happy":     {"vct":150, "rspd":100, "vol":80, "pau":100},
+    "sad":       {"vct":80,  "rspd":70,  "vol":65,  "pau":1000},
+    "angry":     {"vct":60,  "rspd":100, "vol":100, "pau":100},
+    "surprise":  {"vct":130, "rspd":100, "vol":88, "pau":300},
+    "fear":      {"vct":90,  "rspd":80,  "vol":72,  "pau":700},
+    "confused":  {"vct":100, "rspd":90,  "vol":72,  "pau":500},
+    "neutral":   {"vct":100, "rspd":100, "vol":80, "pau":100},
+    "disgust":   {"vct":70,  "rspd":90,  "vol":80, "pau":400}
+})
+
+
 def get_speech_tags(emotion):
-    settings = {
-        "happy":     {"vct":150, "rspd":100, "vol":80, "pau":100},
-        "sad":       {"vct":80,  "rspd":70,  "vol":65,  "pau":1000},
-        "angry":     {"vct":60,  "rspd":100, "vol":100, "pau":100},
-        "surprise":  {"vct":130, "rspd":100, "vol":88, "pau":300},
-        "fear":      {"vct":90,  "rspd":80,  "vol":72,  "pau":700},
-        "confused":  {"vct":100, "rspd":90,  "vol":72,  "pau":500},
-        "neutral":   {"vct":100, "rspd":100, "vol":80, "pau":100},
-        "disgust":   {"vct":70,  "rspd":90,  "vol":80, "pau":400}
-    }
-    return settings.get(emotion.lower(), {"vct":100, "rspd":100, "vol":80, "pau":100})
+    return SPEECH_TAGS[emotion]
 
 # === Emotion Receiving Function with Speech and Animation ===
 def emotion_receiver():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind(('', PEPPER_RECEIVE_PORT))
-    server_socket.listen(5)
-    print("[Emotion Receiver] Listening on port", PEPPER_RECEIVE_PORT)
-
     # Map emotion to fixed speech phrases
     emotion_to_phrase = [
     {
@@ -215,91 +268,118 @@ def emotion_receiver():
         "confused": "But sometimes, I still think of that man in the rain—and how we all carry something we can’t quite name."
     },
 ]
+    emotion_to_phrase = [code_table(block) for block in emotion_to_phrase]  # index by code
 
     sentence_index = 0
     last_spoken_time = 0
     min_delay_between_sentences = 3.0
-    last_emotion = None
-    same_emotion_count = 0
 
     try:
-        while True:
-            conn, addr = server_socket.accept()
+        for label in emotions.labels():
             try:
-                data = conn.recv(1024)
-                if data:
+                emotion = label.emotion
+                if aggregator:
+                    emotion = aggregator.emotion()  # smoothed emotion as of now
+                current_time = time.time()
+
+                # New emotion, or the same one 5 times in a row (EmotionState
+                # keeps the count across coalesced labels). The aggregator
+                # already debounces the emotion, so with it on only the
+                # minimum delay gates speech.
+                should_speak = ready_to_speak(label, current_time, last_spoken_time,
+                                              min_delay_between_sentences,
+                                              repeats=None if aggregator else 5)
+
+                if should_speak and tts and sentence_index < len(emotion_to_phrase):
+                    tags = get_speech_tags(emotion)
+                    sentence_block = emotion_to_phrase[sentence_index]
+                    phrase = sentence_block[emotion]
+
+                    speech = (
+                        "\\vct={vct}\\"
+                        "\\rspd={rspd}\\"
+                        "\\vol={vol}\\"
+                        "\\pau={pau}\\"
+                        "{text}"
+                    ).format(
+                        vct=tags["vct"],
+                        rspd=tags["rspd"],
+                        vol=tags["vol"],
+                        pau=tags["pau"],
+                        text=phrase
+                    )
+
                     try:
-                        emotion = data.decode('utf-8').strip().lower()
-                    except:
-                        emotion = data.strip().lower()
-
-                    print("[Emotion Receiver] Received emotion:", emotion)
-                    current_time = time.time()
-
-                    if emotion == last_emotion:
-                        same_emotion_count += 1
-                    else:
-                        same_emotion_count = 1
-                        last_emotion = emotion
-
-                    should_speak = False
-                    if same_emotion_count >= 5 and current_time - last_spoken_time >= min_delay_between_sentences:
-                        should_speak = True
-                    elif same_emotion_count == 1 and current_time - last_spoken_time >= min_delay_between_sentences:
-                        should_speak = True
-
-                    if should_speak and tts and sentence_index < len(emotion_to_phrase):
-                        tags = get_speech_tags(emotion)
-                        sentence_block = emotion_to_phrase[sentence_index]
-                        phrase = sentence_block.get(emotion, sentence_block.get("neutral", ""))
-
-                        speech = (
-                            "\\vct={vct}\\"
-                            "\\rspd={rspd}\\"
-                            "\\vol={vol}\\"
-                            "\\pau={pau}\\"
-                            "{text}"
-                        ).format(
-                            vct=tags["vct"],
-                            rspd=tags["rspd"],
-                            vol=tags["vol"],
-                            pau=tags["pau"],
-                            text=phrase
-                        )
-
-                        try:
-                            if animated_speech:
-                                # Speak with animation
-                                animated_speech.say(speech, "animations/Stand/Gestures/Hey_1")
-                            else:
-                                # fallback plain speech
-                                tts.say(speech)
-
-                            last_spoken_time = current_time
-                            sentence_index += 1
-                            same_emotion_count = 0  # reset after speaking
-
-                            if sentence_index >= len(emotion_to_phrase):
-                                print("[Emotion Receiver] End of story reached.")
-                        except Exception as e:
-                            print("[Emotion Receiver] TTS say error:", e)
-                    else:
-                        print("[Emotion Receiver] Waiting for new emotion or enough repetition...")
+                        if latency:
+                            latency.speech_started(label.trace)
+                        if animated_speech:
+                            # Speak with animation
+                            speaker.say(label, animated_speech, speech, "animations/Stand/Gestures/Hey_1")
+                        else:
+                            # fallback plain speech
+                            speaker.say(label, tts, speech)
+
+                        last_spoken_time = current_time
+                        if recorder:
+                            recorder.record_speech(sentence_index, name(emotion), phrase)
+                        sentence_index += 1
+                        emotions.reset_run()  # reset after speaking
+
+                        if sentence_index >= len(emotion_to_phrase):
+                            print("[Emotion Receiver] End of story reached.")
+                    except Exception as e:
+                        print("[Emotion Receiver] TTS say error:", e)
+                else:
+                    print("[Emotion Receiver] Waiting for new emotion or enough repetition...")
+            except Exception as e:
+                print("[Emotion Receiver] Error handling emotion:", e)
+    except Exception as e:
+        print("[Emotion Receiver] Error:", e)
+
 
+# === Emotion Channel: only updates the shared emotion state ===
+def label_listener():
+    channel = EmotionChannel(PEPPER_RECEIVE_PORT, rate=label_rate, burst=label_burst,
+                             key=emotion_key, max_pending=max_pending_labels)
+    print("[Emotion Receiver] Listening on port", PEPPER_RECEIVE_PORT)
+    try:
+        for lines in channel.messages():
+            try:
+                if clock:
+                    lines = [line for line in lines if not clock.handle_line(line)]
+                if not lines:
+                    continue
+                messages = [parse_message(line) for line in lines]  # text or binary
+                message = messages[-1]
+                emotion = message.code
+                trace = None
+                if latency:
+                    trace = latency.label_received(message.seq, message.capture_ts,
+                                                   message.classified_ts)
+
+                print("[Emotion Receiver] Received emotion:", message.name)
+                if recorder:
+                    for line in lines:  # as received, with seq, timestamps and scores
+                        recorder.record_emotion(line)
+                if aggregator:
+                    for each in messages:  # every classification counts, not just the newest
+                        emotion = aggregator.update(each.code, each.scores)
+                emotions.update(emotion, trace)
             except Exception as e:
-                print("[Emotion Receiver] Error during connection:", e)
-            finally:
-                conn.close()
+                print("[Emotion Receiver] Error handling message:", e)
     except Exception as e:
         print("[Emotion Receiver] Error:", e)
     finally:
-        server_socket.close()
+        channel.close()
 
 
-# === Start Emotion Receiver Thread ===
+# === Start Emotion Receiver Threads ===
 emotion_thread = threading.Thread(target=emotion_receiver)
 emotion_thread.setDaemon(True)
 emotion_thread.start()
+listener_thread = threading.Thread(target=label_listener)
+listener_thread.setDaemon(True)
+listener_thread.start()
 
 # === Start Video Streaming to Laptop ===
 try:
@@ -317,36 +397,33 @@ try:
     motion.setAngles(["HeadYaw", "HeadPitch"], [0.0, 0.0], 0.2)  # Head forward
 
     video_proxy = ALProxy("ALVideoDevice", PEPPER_IP, PEPPER_PORT)
-    capture_id = video_proxy.subscribeCamera(camera_name, 0, resolution, color_space, fps)
-
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.connect((LAPTOP_IP, LAPTOP_PORT))
-    print("[Video Sender] Connected to laptop at", LAPTOP_IP, LAPTOP_PORT)
-
-    while True:
-        image = video_proxy.getImageRemote(capture_id)
-        if image is None:
-            print("[Video Sender] No image received")
-            time.sleep(0.1)
-            continue
-
-        width = image[0]
-        height = image[1]
-        array = image[6]
-
-        np_arr = np.frombuffer(array, np.uint8)
-        img = np_arr.reshape((height, width, 3))
-
-        result, jpg = cv2.imencode('.jpg', img)
-        if not result:
-            print("[Video Sender] Failed to encode frame")
-            continue
-
-        jpg_bytes = jpg.tobytes()
-        sock.sendall(struct.pack(">I", len(jpg_bytes)))
-        sock.sendall(jpg_bytes)
-
-        time.sleep(1.0 / fps)
+    camera = NaoqiCameraSource(video_proxy, camera_name, resolution, color_space, fps)
+    camera.start()
+
+    # Connect to laptop; the link heals itself while the camera stays subscribed
+    def connect_laptop():
+        if video_transport == "udp":
+            return DatagramSender(socket.socket(socket.AF_INET, socket.SOCK_DGRAM),
+                                  (LAPTOP_IP, LAPTOP_PORT))
+        # Non-blocking: drops stale frames instead of stalling
+        return NonBlockingFrameSender(connect_tcp((LAPTOP_IP, LAPTOP_PORT)))
+
+    transport = ReconnectingTransport(connect_laptop, "laptop at %s:%d" % (LAPTOP_IP, LAPTOP_PORT))
+
+    quality = None
+    if adaptive_quality:
+        quality = AdaptiveQualityController(resolution, target_bandwidth, latency_budget)
+    if face_roi_mode:
+        roi_tracker = create_roi_tracker(face_detector, PEPPER_IP, PEPPER_PORT, camera_name)
+    change_detector = None
+    if suppress_static:
+        change_detector = ChangeDetector(static_threshold, keyframe_interval)
+    pipeline = VideoPipeline(camera, transport, fps=fps,
+                             quality_controller=quality, roi_tracker=roi_tracker,
+                             change_detector=change_detector, recorder=recorder,
+                             latency_tracker=latency, clock_sync=clock,
+                             encoder=create_encoder(stream_encoder))
+    pipeline.run_forever()
 
 except KeyboardInterrupt:
     print("Interrupted by user, exiting...")
@@ -354,10 +431,19 @@ except Exception as e:
     print("[Main] Error:", e)
 
 finally:
-    if capture_id:
-        try:
-            video_proxy.unsubscribe(capture_id)
-        except Exception as e:
-            print("Warning: could not unsubscribe cleanly:", e)
-    if sock:
-        sock.close()
\ No newline at end of file
+    if pipeline:
+        pipeline.stop()
+    if camera:
+        camera.stop()
+    if roi_tracker:
+        roi_tracker.close()
+    if transport:
+        transport.close()
+    if recorder:
+        recorder.close()
+    speaker.cancel()
+    print("[Speech] " + speaker.describe(emotions))
+    if aggregator:
+        print("[Emotion] " + aggregator.describe())
+    if latency:
+        latency.dump()
\ No newline at end of file
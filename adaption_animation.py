@@ -5,6 +5,20 @@ import threading
 import random
 import traceback
 
+from emotion_registry import NEUTRAL, code, code_table, name
+
+# ExpressionProperties order of ALFaceCharacteristics, as emotion codes
+FACE_EMOTIONS = [code(emotion) for emotion in ("neutral", "happy", "surprised", "angry", "sad")]
+
+# (pitchShift, speed) per emotion code
+VOICE_PARAMETERS = code_table({
+    "neutral": (1.0, 1.0),
+    "happy": (1.5, 1.2),
+    "angry": (0.7, 0.5),
+    "sad": (1.0, 0.5),
+    "surprise": (1.0, 1.5),
+})
+
 class PepperDynamicPitchSpeaker(object):
     def __init__(self, robot_ip, port=9559):
         self.robot_ip = robot_ip
@@ -24,13 +38,13 @@ class PepperDynamicPitchSpeaker(object):
         self.emotion_update_interval = 5.0
         self.lock = threading.Lock()
 
-        # Animations from Code 1 ONLY
-        self.animations = {
+        # Animations from Code 1 ONLY, indexed by emotion code
+        self.animations = code_table({
             "happy": ["^start(animations/Stand/Gestures/Hey_1)"],
             "sad": ["^start(animations/Stand/Gestures/Frustration_1)"],
             "angry": ["^start(animations/Stand/Gestures/Angry_1)"],
-            "surprised": ["^start(animations/Stand/Gestures/Surprised_1)"],
-        }
+            "surprise": ["^start(animations/Stand/Gestures/Surprised_1)"],
+        }, default=[])
 
     def connect_and_init_services(self):
         try:
@@ -113,10 +127,10 @@ class PepperDynamicPitchSpeaker(object):
                 ids = self.memory.getData("PeoplePerception/PeopleList")
                 if not ids:
                     with self.lock:
-                        self.current_emotion = "neutral"
+                        self.current_emotion = NEUTRAL
                 elif len(ids) > 1:
                     with self.lock:
-                        self.current_emotion = "neutral"
+                        self.current_emotion = NEUTRAL
                 else:
                     person_id = ids[0]
                     now = time.time()
@@ -126,12 +140,11 @@ class PepperDynamicPitchSpeaker(object):
                         props = self.memory.getData(
                             "PeoplePerception/Person/%s/ExpressionProperties" % str(person_id)
                         )
-                        emotions = ["neutral", "happy", "surprised", "angry", "sad"]
-                        if not props or len(props) != len(emotions):
+                        if not props or len(props) != len(FACE_EMOTIONS):
                             props = [1.0, 0.0, 0.0, 0.0, 0.0]
 
-                        emotion_scores = dict(zip(emotions, props))
-                        detected_emotion = max(emotion_scores, key=emotion_scores.get)
+                        best = max(range(len(props)), key=props.__getitem__)
+                        detected_emotion = FACE_EMOTIONS[best]
 
                         with self.lock:
                             if self.current_emotion != detected_emotion:
@@ -157,22 +170,9 @@ class PepperDynamicPitchSpeaker(object):
             with self.lock:
                 emotion = self.current_emotion
             if emotion is None:
-                emotion = "neutral"  # replace None with neutral here too
-
-            pitch = 1.0
-            speed = 1.0
-            if emotion == "happy":
-                pitch = 1.5
-                speed = 1.2
-            elif emotion == "angry":
-                pitch = 0.7
-                speed = 0.5
-            elif emotion == "sad":
-                speed = 0.5
-                pitch = 1.0
-            elif emotion == "surprised":
-                speed = 1.5
-                pitch = 1.0
+                emotion = NEUTRAL  # replace None with neutral here too
+
+            pitch, speed = VOICE_PARAMETERS[emotion]
 
             try:
                 self.tts.setParameter("pitchShift", pitch)
@@ -183,10 +183,10 @@ class PepperDynamicPitchSpeaker(object):
                 traceback.print_exc()
 
             animation = ""
-            if emotion in self.animations:
+            if self.animations[emotion]:
                 animation = random.choice(self.animations[emotion])
             animated_sentence = "%s %s" % (animation, sentence.strip())
-            print("Saying with emotion '%s': %s" % (emotion, animated_sentence))
+            print("Saying with emotion '%s': %s" % (name(emotion), animated_sentence))
             try:
                 self.animated_speech.say(animated_sentence)
             except Exception as e:
@@ -5,10 +5,21 @@ import time
 import traceback
 import qi
 
+from emotion_registry import EMOTIONS, NEUTRAL, code, code_table, name
+
 PEPPER_IP = "192.168.0.101"
 PEPPER_PORT = 9559
 EMOTION_PORT = 6001
 
+# (pitchShift, voice tag) per emotion code
+SPEECH_PARAMETERS = code_table({
+    "neutral": (1.0, "\\RST\\"),
+    "happy": (1.5, "\\VCT=120\\"),
+    "angry": (0.5, "\\VCT=80\\"),
+    "sad": (0.75, "\\VCT=100\\"),
+    "surprise": (1.1, "\\VCT=110\\"),
+})
+
 class PepperDynamicPitchSpeaker(object):
     def __init__(self, robot_ip, port=9559):
         self.robot_ip = robot_ip
@@ -20,38 +31,29 @@ class PepperDynamicPitchSpeaker(object):
         self.animated_speech = self.session.service("ALAnimatedSpeech")
         self.awareness = self.session.service("ALBasicAwareness")
 
-        self.current_emotion = "neutral"
+        self.current_emotion = NEUTRAL
         self.running = True
         self.lock = threading.Lock()
-        self.animation_index = {
-            "happy": 0, "sad": 0, "angry": 0, "surprised": 0, "neutral": 0
-        }
+        self.animation_index = [0] * len(EMOTIONS)
 
-        self.animations = {
+        # Indexed by emotion code
+        self.animations = code_table({
             "happy": ["^run(animations/Stand/Gestures/Happy_1)"],
             "sad": ["^run(animations/Stand/Gestures/SlowBowWithArms_1)"],
             "angry": ["^run(animations/Stand/Gestures/GoToStance_Enumeration_Center)"],
-            "surprised": ["^run(animations/Stand/Gestures/LittleArmsBump_1)"]
-        }
+            "surprise": ["^run(animations/Stand/Gestures/LittleArmsBump_1)"]
+        }, default=[])
 
     def get_next_animation(self, emotion):
-        if emotion in self.animations:
-            index = self.animation_index[emotion] % len(self.animations[emotion])
+        animations = self.animations[emotion]
+        if animations:
+            index = self.animation_index[emotion] % len(animations)
             self.animation_index[emotion] += 1
-            return self.animations[emotion][index]
+            return animations[index]
         return ""
 
     def prepare_speech_parameters(self, emotion):
-        pitch, vct = 1.0, "\\RST\\"
-        if emotion == "happy":
-            pitch, vct = 1.5, "\\VCT=120\\"
-        elif emotion == "angry":
-            pitch, vct = 0.5, "\\VCT=80\\"
-        elif emotion == "sad":
-            pitch, vct = 0.75, "\\VCT=100\\"
-        elif emotion == "surprised":
-            pitch, vct = 1.1, "\\VCT=110\\"
-        return pitch, vct
+        return SPEECH_PARAMETERS[emotion]
 
     def speak_with_emotion(self, text):
         self.lock.acquire()
@@ -95,10 +97,8 @@ def emotion_server(speaker, host='', port=6001):
         try:
             data = conn.recv(1024)
             if data:
-                emotion = data.strip()
-                if isinstance(emotion, bytes):
-                    emotion = emotion.decode('utf-8')
-                print("[DEBUG] Received emotion: {}".format(emotion))
+                emotion = code(data)
+                print("[DEBUG] Received emotion: {}".format(name(emotion)))
                 speaker.lock.acquire()
                 speaker.current_emotion = emotion
                 speaker.lock.release()
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Benchmark and sanity check for emotion_aggregator.py.
+#
+# Feeds each aggregation mode a synthetic label stream: the true emotion
+# changes every --segment updates and every label is replaced by a random
+# wrong one with probability --noise. For every mode, and for the old
+# "same label --debounce times in a row" rule, this reports the update
+# rate, how many times the output switched (the truth switches
+# updates/segment times), and the mean delay in updates between a true
+# change and the output following it. Window sizes can be varied to
+# show that the update cost does not grow with the window.
+#
+#   python bench_aggregator.py --updates 200000 --noise 0.2
+#   python bench_aggregator.py --window 600 --scores
+import argparse
+import time
+
+import numpy as np
+
+from emotion_aggregator import MODES, EmotionAggregator
+from emotion_registry import EMOTIONS
+
+
+def make_stream(args):
+    rng = np.random.RandomState(args.seed)
+    n = len(EMOTIONS)
+    truth = np.repeat(rng.randint(n, size=args.updates // args.segment + 1),
+                      args.segment)[:args.updates]
+    noisy = np.where(rng.random_sample(args.updates) < args.noise,
+                     rng.randint(n, size=args.updates), truth)
+    scores = None
+    if args.scores:
+        scores = rng.dirichlet(np.ones(n), size=args.updates) * 0.5
+        scores[np.arange(args.updates), noisy] += 0.5
+    return truth, noisy, scores
+
+
+class Debounce(object):
+    """The adaptive scripts' old rule: switch after `count` identical labels in a row."""
+
+    def __init__(self, count=5):
+        self.count = count
+        self.last = None
+        self.run = 0
+        self.current = None
+
+    def update(self, emotion=None, scores=None, now=None):
+        if emotion == self.last:
+            self.run += 1
+        else:
+            self.last = emotion
+            self.run = 1
+        if self.current is None or self.run >= self.count:
+            self.current = emotion
+        return self.current
+
+
+def score(outputs, truth):
+    """Return (output switches, mean updates from a true change until followed)."""
+    switches = int((outputs[1:] != outputs[:-1]).sum())
+    lags = []
+    changes = np.flatnonzero(truth[1:] != truth[:-1]) + 1
+    for start, end in zip(changes, list(changes[1:]) + [len(truth)]):
+        hit = np.flatnonzero(outputs[start:end] == truth[start])
+        if len(hit):
+            lags.append(hit[0])
+    return switches, float(np.mean(lags)) if lags else float("nan")
+
+
+def run(aggregator, noisy, scores, period):
+    outputs = np.zeros(len(noisy), np.intp)
+    codes = [int(code) for code in noisy]
+    started = time.time()
+    for i, code in enumerate(codes):
+        outputs[i] = aggregator.update(code, scores[i] if scores is not None else None,
+                                       now=i * period)
+    return time.time() - started, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emotion aggregator benchmark")
+    parser.add_argument("--updates", type=int, default=100000)
+    parser.add_argument("--segment", type=int, default=50, help="updates per true emotion")
+    parser.add_argument("--noise", type=float, default=0.15, help="fraction of wrong labels")
+    parser.add_argument("--scores", action="store_true", help="send score vectors, not labels")
+    parser.add_argument("--window", type=int, default=15)
+    parser.add_argument("--fps", type=float, default=10.0, help="label rate, for dwell mode")
+    parser.add_argument("--debounce", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    truth, noisy, scores = make_stream(args)
+    true_switches = int((truth[1:] != truth[:-1]).sum())
+    print("[Bench] %d updates, %d true switches, %.0f%% noise, window %d, %s" % (
+        args.updates, true_switches, 100.0 * args.noise, args.window,
+        "scores" if args.scores else "labels"))
+    print("[Bench] %-10s %12s %10s %10s %10s" % ("mode", "updates/s", "us/update",
+                                                  "switches", "lag"))
+    candidates = [("debounce", Debounce(args.debounce))]
+    candidates += [(mode, EmotionAggregator(mode, window=args.window)) for mode in MODES]
+    for name, aggregator in candidates:
+        elapsed, outputs = run(aggregator, noisy, scores, 1.0 / args.fps)
+        switches, lag = score(outputs, truth)
+        print("[Bench] %-10s %12.0f %10.2f %10d %10.1f" % (
+            name, args.updates / elapsed, 1e6 * elapsed / args.updates, switches, lag))
+
+
+if __name__ == "__main__":
+    main()
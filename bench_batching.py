@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# Benchmark per-frame against micro-batched classification on the CPU.
+#
+# Uses a stand-in model with the shape of a small FER-style network
+# (48x48 grayscale input, one hidden layer, one output per emotion) so the
+# numbers reflect the cost of running numpy inference one frame at a time
+# versus on stacked batches. Several simulated streams submit frames
+# concurrently, as robots do to laptop_receiver.py. Like the receiver,
+# each stream has one frame in flight by default; --in-flight raises that
+# to see what deeper per-stream queues would give.
+#
+# Batching only pays off once enough frames are waiting to fill a batch:
+# a batched matrix product has a fixed cost of a few milliseconds, so
+# with streams x in-flight below about 20 the per-frame path is faster.
+#
+#   python3 bench_batching.py --streams 4
+#   python3 bench_batching.py --streams 32 --batch-size 32
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from camera_source import SyntheticCameraSource
+from emotion_registry import EMOTIONS
+from micro_batcher import MicroBatcher
+
+INPUT_SIZE = 48
+
+
+class LinearEmotionClassifier(object):
+    """Random-weight stand-in model; only its cost matters here."""
+
+    def __init__(self, hidden=1024, seed=0):
+        rng = np.random.RandomState(seed)
+        self.w1 = rng.standard_normal((INPUT_SIZE * INPUT_SIZE, hidden)).astype(np.float32) * 0.01
+        self.w2 = rng.standard_normal((hidden, len(EMOTIONS))).astype(np.float32) * 0.01
+
+    def preprocess(self, image):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(image, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_AREA)
+        return small.reshape(-1).astype(np.float32) / 255.0
+
+    def infer(self, inputs):
+        hidden = np.maximum(inputs.dot(self.w1), 0.0)
+        return hidden.dot(self.w2).argmax(axis=-1)
+
+    def classify(self, image):
+        return EMOTIONS[int(self.infer(self.preprocess(image)[None, :])[0])]
+
+    def classify_batch(self, images):
+        inputs = np.stack([self.preprocess(image) for image in images])
+        return [EMOTIONS[int(i)] for i in self.infer(inputs)]
+
+
+async def produce(classify, images, frames, latencies):
+    for i in range(frames):
+        started = time.monotonic()
+        await classify(images[i % len(images)])
+        latencies.append(time.monotonic() - started)
+
+
+async def run(classifier, images, streams, frames, batch_size, batch_wait, workers):
+    """streams is the number of concurrent producers (streams x frames in flight)."""
+    pool = ThreadPoolExecutor(workers)
+    loop = asyncio.get_event_loop()
+    batcher = None
+    if batch_size > 1:
+        batcher = MicroBatcher(classifier, pool, batch_size, batch_wait, workers)
+        batcher.start()
+        classify = batcher.submit
+    else:
+        async def classify(image):
+            return await loop.run_in_executor(pool, classifier.classify, image)
+
+    latencies = []
+    started = time.monotonic()
+    await asyncio.gather(*[produce(classify, images, frames, latencies) for _ in range(streams)])
+    elapsed = time.monotonic() - started
+    if batcher is not None:
+        batcher.stop()
+    pool.shutdown()
+    return elapsed, latencies, batcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched vs per-frame classification")
+    parser.add_argument("--streams", type=int, default=4, help="concurrent robot streams")
+    parser.add_argument("--in-flight", type=int, default=1,
+                        help="frames each stream keeps outstanding (the receiver keeps 1)")
+    parser.add_argument("--frames", type=int, default=300, help="frames per stream")
+    parser.add_argument("--resolution", type=int, default=1, help="ALVideoDevice resolution")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batch-wait", type=float, default=0.002)
+    parser.add_argument("--workers", type=int, default=4,
+                        help="classifier threads, also concurrent batches (as the receiver)")
+    args = parser.parse_args()
+
+    source = SyntheticCameraSource(args.resolution)
+    images = []
+    for _ in range(8):
+        image = source.get_image()
+        images.append(np.frombuffer(image[6], np.uint8).reshape(image[1], image[0], image[2]))
+    classifier = LinearEmotionClassifier()
+
+    producers = args.streams * args.in_flight
+    frames = max(1, args.frames // args.in_flight)
+    total = producers * frames
+    for name, batch_size in (("per-frame", 1), ("batched", args.batch_size)):
+        elapsed, latencies, batcher = asyncio.run(run(
+            classifier, images, producers, frames, batch_size,
+            args.batch_wait, args.workers))
+        latencies.sort()
+        print("[Bench] %-9s %5d frames in %.2f s: %7.1f fps, latency p50 %.1f ms p99 %.1f ms" % (
+            name, total, elapsed, total / elapsed, 1000.0 * latencies[len(latencies) // 2],
+            1000.0 * latencies[int(len(latencies) * 0.99)]))
+        if batcher is not None:
+            print("[Bench]           %s" % batcher.stats.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Compare the frame encoder backends on the same frames.
+#
+# For every encoder in frame_encoders.py this reports the encode time per
+# frame (the robot's CPU cost), the payload size (the WiFi cost, also as
+# KB/s at --fps) and the decode time of the complete frame on the
+# receiving side. Frames come from the synthetic source, a video file or
+# a recorded session, at 640x480 BGR unless --resolution or --profile say
+# otherwise.
+#
+#   python bench_encoders.py --frames 200
+#   python bench_encoders.py --source session --session sessions/20250101-120000
+import argparse
+
+import numpy as np
+
+from camera_source import CAPTURE_PROFILES, ReplayCameraSource, SyntheticCameraSource
+from frame_encoders import ENCODERS, create_encoder
+from frame_header import decode_frame, pack_header
+from stream_clock import monotonic
+
+
+def load_frames(args):
+    if args.source == "session":
+        from session_recorder import SessionReader
+        records = SessionReader(args.session).frames()[:args.frames]
+        return [record.image() for record in records]
+
+    color_space = CAPTURE_PROFILES["viewer"][1]
+    if args.profile:
+        args.resolution, color_space = CAPTURE_PROFILES[args.profile]
+    if args.source == "replay":
+        source = ReplayCameraSource(args.video, realtime=False, resolution=args.resolution,
+                                    color_space=color_space)
+    else:
+        source = SyntheticCameraSource(args.resolution, color_space=color_space)
+    source.start()
+    frames = []
+    try:
+        for _ in range(args.frames):
+            image = source.get_image()
+            if image is None:
+                break
+            shape = (image[1], image[0], image[2]) if image[2] > 1 else (image[1], image[0])
+            frames.append(np.frombuffer(image[6], np.uint8).reshape(shape))
+    finally:
+        source.stop()
+    return frames
+
+
+def build_encoder(name, args):
+    if name in ("jpeg", "webp"):
+        return create_encoder(name, quality=args.quality)
+    if name == "gray":
+        return create_encoder(name, scale=args.gray_scale)
+    return create_encoder(name)
+
+
+def bench(encoder, frames):
+    """Return (encode seconds, payload bytes, decode seconds), each per frame."""
+    encode_time = decode_time = 0.0
+    total_bytes = 0
+    for seq, image in enumerate(frames):
+        started = monotonic()
+        payload, fields = encoder.encode(image)
+        encode_time += monotonic() - started
+
+        height, width = image.shape[:2]
+        data = pack_header(seq, width, height, **fields) + payload.tobytes()
+        total_bytes += len(payload)
+        started = monotonic()
+        decode_frame(data)
+        decode_time += monotonic() - started
+    n = float(len(frames))
+    return encode_time / n, total_bytes / n, decode_time / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Frame encoder comparison")
+    parser.add_argument("--source", choices=["synthetic", "replay", "session"],
+                        default="synthetic")
+    parser.add_argument("--video", help="video file for --source replay")
+    parser.add_argument("--session", help="session directory for --source session")
+    parser.add_argument("--resolution", type=int, default=2, help="ALVideoDevice resolution")
+    parser.add_argument("--profile", choices=sorted(CAPTURE_PROFILES),
+                        help="capture profile, overrides --resolution")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--fps", type=float, default=10.0, help="for the bandwidth column")
+    parser.add_argument("--encoders", default=",".join(sorted(ENCODERS)),
+                        help="comma-separated list of encoders")
+    parser.add_argument("--quality", type=int, default=80, help="JPEG/WebP quality")
+    parser.add_argument("--gray-scale", type=int, default=2, help="shrink factor for gray")
+    args = parser.parse_args()
+    if args.source == "replay" and not args.video:
+        parser.error("--source replay needs --video")
+    if args.source == "session" and not args.session:
+        parser.error("--source session needs --session")
+
+    frames = load_frames(args)
+    if not frames:
+        parser.error("no frames to encode")
+    height, width = frames[0].shape[:2]
+    print("[Bench] %d frames of %dx%dx%d, %.0f KB raw each" % (
+        len(frames), width, height, frames[0].size // (width * height),
+        frames[0].nbytes / 1024.0))
+    print("[Bench] %-6s %10s %10s %10s %10s" % (
+        "codec", "encode ms", "KB/frame", "KB/s", "decode ms"))
+    for name in args.encoders.split(","):
+        encoder = build_encoder(name.strip(), args)
+        encode_time, size, decode_time = bench(encoder, frames)
+        print("[Bench] %-6s %10.2f %10.1f %10.0f %10.2f" % (
+            encoder.name, 1000.0 * encode_time, size / 1024.0, size * args.fps / 1024.0,
+            1000.0 * decode_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+# Load test for the robot's emotion receive path, without a robot.
+#
+# Runs what the robot scripts run on PEPPER_RECEIVE_PORT: EmotionChannel
+# with admission control, parse_message(), the optional emotion
+# aggregator, EmotionState and a storyteller loop that decides with the
+# scripts' own ready_to_speak(): --policy adaptive as in the adaptive
+# scripts, --policy fixed as in Final_Emotion_Receiver.py and
+# Experiment_CodeNeutral.py. The story never runs out of sentences.
+# Speech goes to a fake ALTextToSpeech whose say() takes --speech
+# seconds. Load clients send labels at --rate per client, either over
+# one persistent connection each or with a new connection per label like
+# the old laptop scripts (--oneshot), as text lines or binary emotion
+# messages (--binary). With --smoothing, the aggregator sees every label
+# and --policy adaptive drops its repeat count, as in the adaptive scripts.
+#
+# Labels follow a simple model of a participant: an emotion is held for
+# an exponentially distributed time (mean --dwell seconds), drawn with
+# neutral and happy the most common, and each label is replaced by a
+# random one with probability --noise, like a misclassified frame.
+#
+# Every label carries its send time, so the storyteller can measure how
+# old a label is when it reaches a decision. Reported are the offered
+# and sustained label rates, refused and timed-out connections, the
+# channel's accepted/merged/shed counts and label-to-decision p50/p99.
+#
+#   python bench_receiver.py --clients 4 --rate 200 --duration 20
+#   python bench_receiver.py --oneshot --rate 100 --backlog 5
+#   python bench_receiver.py --binary --speech 2.0 --smoothing majority
+#
+# With --target the labels go to a running robot script instead, and
+# only the sender side is reported.
+import argparse
+import errno
+import random
+import socket
+import threading
+import time
+
+from emotion_aggregator import MODES, EmotionAggregator
+from emotion_channel import EmotionChannel
+from emotion_registry import EMOTIONS, code
+from label_protocol import emotion_key, format_label, pack_emotion, parse_message
+from speech_worker import AsyncSpeech, EmotionState, ready_to_speak
+
+# ready_to_speak() repeats argument of each script family
+POLICIES = {"adaptive": 5, "fixed": None}
+
+# How often each emotion is drawn when the participant's emotion changes
+EMOTION_WEIGHTS = {
+    "neutral": 0.45,
+    "happy": 0.2,
+    "surprise": 0.1,
+    "sad": 0.08,
+    "confused": 0.05,
+    "angry": 0.05,
+    "fear": 0.04,
+    "disgust": 0.03,
+}
+
+
+class FakeTextToSpeech(object):
+    """Stands in for ALTextToSpeech as AsyncSpeech uses it: post.say(), wait(), stop()."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.post = self
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.next_task = 0
+        self.said = 0
+        self.stopped = 0
+
+    def say(self, *args):
+        """Start a sentence and return its task id, like ALTextToSpeech.post.say()."""
+        with self.lock:
+            self.next_task += 1
+            self.tasks[self.next_task] = threading.Event()
+            self.said += 1
+            return self.next_task
+
+    def wait(self, task, timeout=0):
+        with self.lock:
+            done = self.tasks[task]
+        done.wait(self.duration)
+        with self.lock:
+            del self.tasks[task]
+
+    def stop(self, task):
+        with self.lock:
+            done = self.tasks.get(task)
+        if done is not None:
+            self.stopped += 1
+            done.set()
+
+
+class LabelStream(object):
+    """Emotion codes of a participant who holds each emotion for a while."""
+
+    def __init__(self, rng, dwell=4.0, noise=0.15):
+        self.rng = rng
+        self.dwell = dwell
+        self.noise = noise
+        self.codes = [code(emotion) for emotion in EMOTION_WEIGHTS]
+        self.weights = list(EMOTION_WEIGHTS.values())
+        self.current = None
+        self.switch_at = 0.0
+
+    def draw(self):
+        point = self.rng.random() * sum(self.weights)
+        for emotion, weight in zip(self.codes, self.weights):
+            point -= weight
+            if point < 0:
+                return emotion
+        return self.codes[-1]
+
+    def next(self, now):
+        if now >= self.switch_at:
+            self.current = self.draw()
+            self.switch_at = now + self.rng.expovariate(1.0 / self.dwell)
+        if self.rng.random() < self.noise:
+            return self.rng.randrange(len(EMOTIONS))
+        return self.current
+
+
+class LoadClient(object):
+    """Sends labels to the receive port at a fixed rate from its own thread."""
+
+    def __init__(self, address, rate, labels, oneshot=False, binary=False):
+        self.address = address
+        self.rate = rate
+        self.labels = labels
+        self.oneshot = oneshot
+        self.binary = binary
+        self.sock = None
+        self.running = True
+        self.sent = 0
+        self.refused = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def message(self, seq):
+        now = time.time()
+        emotion = self.labels.next(now)
+        if self.binary:
+            return pack_emotion(emotion, 1.0, seq, now)
+        return format_label(seq, EMOTIONS[emotion], now, now)
+
+    def send(self, message):
+        try:
+            if self.sock is None:
+                self.sock = socket.create_connection(self.address, timeout=1.0)
+            self.sock.sendall(message)
+            self.sent += 1
+        except socket.timeout:
+            self.timeouts += 1
+        except socket.error as e:
+            if e.errno == errno.ECONNREFUSED:
+                self.refused += 1
+            else:
+                self.errors += 1
+            self.close()
+            return
+        if self.oneshot:
+            self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def run(self):
+        seq = 0
+        next_send = time.time()
+        while self.running:
+            self.send(self.message(seq))
+            seq += 1
+            next_send += 1.0 / self.rate
+            delay = next_send - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_send = time.time()  # fell behind: carry on from now, no burst
+        self.close()
+
+
+class Receiver(object):
+    """The robot scripts' emotion channel, listener and storyteller on a local port."""
+
+    def __init__(self, args):
+        self.channel = EmotionChannel(0, host="127.0.0.1", backlog=args.backlog,
+                                      report_interval=0, rate=args.admit_rate,
+                                      burst=args.admit_burst, key=emotion_key,
+                                      max_pending=args.max_pending)
+        self.address = ("127.0.0.1", self.channel.port)
+        self.tts = FakeTextToSpeech(args.speech)
+        self.min_delay = args.min_delay
+        self.aggregator = EmotionAggregator(args.smoothing) if args.smoothing else None
+        self.repeats = None if self.aggregator else POLICIES[args.policy]
+        self.emotions = EmotionState()
+        self.speaker = AsyncSpeech()
+        self.received = 0
+        self.batches = 0
+        self.decisions = []  # seconds from label send to speak-or-wait decision
+
+    def listen(self):
+        for lines in self.channel.messages(0.1):
+            messages = [parse_message(line) for line in lines]
+            message = messages[-1]
+            emotion = message.code
+            if self.aggregator:
+                for each in messages:
+                    emotion = self.aggregator.update(each.code, each.scores)
+            self.received += len(lines)
+            self.batches += 1
+            self.emotions.update(emotion, message.classified_ts)
+
+    def tell(self):
+        last_spoken_time = 0
+        for label in self.emotions.labels():
+            current_time = time.time()
+            self.decisions.append(current_time - label.trace)
+            if ready_to_speak(label, current_time, last_spoken_time, self.min_delay,
+                              self.repeats):
+                self.speaker.say(label, self.tts, "sentence")
+                last_spoken_time = current_time
+                if self.repeats is not None:
+                    self.emotions.reset_run()
+
+    def start(self):
+        threads = [threading.Thread(target=self.listen), threading.Thread(target=self.tell)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        return threads
+
+    def stop(self):
+        self.channel.close()
+        self.speaker.cancel()
+        self.emotions.close()
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emotion receiver load test")
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=30.0, help="labels/s per client")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--oneshot", action="store_true",
+                        help="new connection per label, like the old laptop scripts")
+    parser.add_argument("--binary", action="store_true", help="send binary emotion messages")
+    parser.add_argument("--dwell", type=float, default=4.0, help="mean seconds an emotion is held")
+    parser.add_argument("--noise", type=float, default=0.15, help="fraction of random labels")
+    parser.add_argument("--speech", type=float, default=1.5, help="seconds per fake sentence")
+    parser.add_argument("--min-delay", type=float, default=3.0, help="seconds between sentences")
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="adaptive",
+                        help="speak decision of the adaptive or the fixed-story scripts")
+    parser.add_argument("--smoothing", choices=MODES, help="emotion aggregator mode")
+    parser.add_argument("--backlog", type=int, default=16, help="listen backlog")
+    parser.add_argument("--admit-rate", type=float, default=20.0,
+                        help="labels/s admitted per client host, 0 for no limit")
+    parser.add_argument("--admit-burst", type=int, default=20)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--target", help="host:port of a running robot script instead")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    receiver = None
+    if args.target:
+        host, port = args.target.rsplit(":", 1)
+        address = (host, int(port))
+    else:
+        receiver = Receiver(args)
+        receiver.start()
+        address = receiver.address
+
+    rng = random.Random(args.seed)
+    clients = [LoadClient(address, args.rate,
+                          LabelStream(random.Random(rng.random()), args.dwell, args.noise),
+                          args.oneshot, args.binary)
+               for _ in range(args.clients)]
+    threads = [threading.Thread(target=client.run) for client in clients]
+    print("[Bench] %d %s clients at %.0f labels/s each for %.0f s -> %s:%d" % (
+        args.clients, "one-shot" if args.oneshot else "persistent", args.rate,
+        args.duration, address[0], address[1]))
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    for client in clients:
+        client.running = False
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+
+    sent = sum(client.sent for client in clients)
+    print("[Bench] sent %d labels (%.0f/s), refused %d, timed out %d, other errors %d" % (
+        sent, sent / elapsed, sum(client.refused for client in clients),
+        sum(client.timeouts for client in clients), sum(client.errors for client in clients)))
+    if receiver is None:
+        return
+
+    time.sleep(0.2)  # let the listener drain what is still in flight
+    receiver.channel.report(elapsed)
+    decisions = receiver.decisions
+    print("[Bench] received %d labels in %d reads (%.0f labels/s sustained), "
+          "%d decisions, %d spoken" % (
+              receiver.received, receiver.batches, receiver.received / elapsed,
+              len(decisions), receiver.speaker.spoken))
+    print("[Bench] label->decision p50 %.1f ms p99 %.1f ms max %.1f ms" % (
+        1000.0 * percentile(decisions, 0.5), 1000.0 * percentile(decisions, 0.99),
+        1000.0 * max(decisions) if decisions else float("nan")))
+    print("[Bench] speech: %s" % receiver.speaker.describe(receiver.emotions))
+    receiver.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Benchmark the video sender pipeline without a robot.
+#
+# Runs VideoPipeline against a synthetic or replayed camera source and
+# streams into a local TCP sink that reads the frames like the laptop
+# receiver would. Example:
+#
+#   python bench_sender.py --source synthetic --fps 30 --duration 20
+#   python bench_sender.py --source replay --video session.mp4 --max-speed
+#   python bench_sender.py --source session --session sessions/20250101-120000 --speed 0
+#
+# --source session replays the frames of a session recorded by
+# session_recorder.py (record_session in the robot scripts) at --speed
+# times the recorded rate, 0 for as fast as possible, looping until
+# --duration is up.
+# With --target the frames go to a running receiver instead (for example
+# laptop_receiver.py); start several senders to load it with many streams.
+# --transport udp sends datagrams instead, and --loss makes the local sink
+# drop that fraction of them to exercise reassembly. --sink-rate throttles
+# the local TCP sink to mimic a slow link; compare the blocking sender with
+# --nonblocking there. With --reconnect the sender survives a receiver
+# restart: stop and start laptop_receiver.py while a --target run goes on.
+import argparse
+import random
+import socket
+import struct
+import threading
+import time
+
+from camera_source import CAPTURE_PROFILES, ReplayCameraSource, SyntheticCameraSource
+from frame_encoders import ENCODERS, create_encoder
+from frame_transport import (DatagramSender, FrameReassembler, FrameSender,
+                             NonBlockingFrameSender, ReconnectingTransport, connect_tcp)
+from quality_controller import AdaptiveQualityController
+from session_recorder import RecordingCameraSource, SessionReader
+from stream_clock import monotonic
+from video_pipeline import VideoPipeline
+
+
+class FrameSink(object):
+    """Local receiver that reads length-prefixed frames and counts them."""
+
+    def __init__(self, rate=None):
+        self.rate = rate  # bytes per second, None for as fast as possible
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.address = self.server.getsockname()
+        self.frames = 0
+        self.bytes = 0
+
+    def recv_exact(self, conn, size):
+        chunks = []
+        while size:
+            chunk = conn.recv(min(size, 1 << 20 if self.rate is None else 16 * 1024))
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+            if self.rate:
+                time.sleep(len(chunk) / self.rate)
+        return b"".join(chunks)
+
+    def run(self):
+        conn, _ = self.server.accept()
+        try:
+            while True:
+                prefix = self.recv_exact(conn, 4)
+                if prefix is None:
+                    break
+                size = struct.unpack(">I", prefix)[0]
+                if self.recv_exact(conn, size) is None:
+                    break
+                self.frames += 1
+                self.bytes += size
+        finally:
+            conn.close()
+            self.server.close()
+
+
+class DatagramSink(object):
+    """Local UDP receiver that reassembles frames, losing some datagrams on purpose."""
+
+    def __init__(self, loss=0.0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.5)
+        self.address = self.sock.getsockname()
+        self.loss = loss
+        self.reassembler = FrameReassembler()
+        self.running = True
+        self.frames = 0
+        self.bytes = 0
+
+    def run(self):
+        try:
+            while self.running:
+                try:
+                    data = self.sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if self.loss and random.random() < self.loss:
+                    continue
+                frame = self.reassembler.add(data)
+                if frame is not None:
+                    self.frames += 1
+                    self.bytes += len(frame)
+        finally:
+            self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Video sender throughput benchmark")
+    parser.add_argument("--source", choices=["synthetic", "replay", "session"],
+                        default="synthetic")
+    parser.add_argument("--video", help="video file for --source replay")
+    parser.add_argument("--session", help="recorded session directory for --source session")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="--source session replay speed factor, 0 for as fast as possible")
+    parser.add_argument("--max-speed", action="store_true",
+                        help="replay as fast as possible instead of at recorded speed")
+    parser.add_argument("--resolution", type=int, default=2, help="ALVideoDevice resolution")
+    parser.add_argument("--profile", choices=sorted(CAPTURE_PROFILES),
+                        help="capture profile, overrides --resolution")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="enable the adaptive quality controller")
+    parser.add_argument("--encoder", choices=sorted(ENCODERS), default="jpeg")
+    parser.add_argument("--target", help="host:port of a running receiver instead of the local sink")
+    parser.add_argument("--transport", choices=["tcp", "udp"], default="tcp")
+    parser.add_argument("--loss", type=float, default=0.0,
+                        help="fraction of datagrams the local UDP sink drops")
+    parser.add_argument("--sink-rate", type=float,
+                        help="KB/s the local TCP sink reads at, to mimic a slow link")
+    parser.add_argument("--nonblocking", action="store_true",
+                        help="use NonBlockingFrameSender for TCP")
+    parser.add_argument("--reconnect", action="store_true",
+                        help="reconnect with backoff when the receiver goes away")
+    args = parser.parse_args()
+
+    color_space = CAPTURE_PROFILES["viewer"][1]
+    if args.profile:
+        args.resolution, color_space = CAPTURE_PROFILES[args.profile]
+    if args.source == "replay":
+        if not args.video:
+            parser.error("--source replay needs --video")
+        source = ReplayCameraSource(args.video, realtime=not args.max_speed,
+                                    resolution=args.resolution, color_space=color_space)
+    elif args.source == "session":
+        if not args.session:
+            parser.error("--source session needs --session")
+        source = RecordingCameraSource(SessionReader(args.session), speed=args.speed, loop=True)
+        if not source.frames:
+            parser.error("%s has no recorded frames" % args.session)
+    else:
+        source = SyntheticCameraSource(args.resolution, color_space=color_space)
+
+    sink = None
+    if args.target:
+        host, _, port = args.target.rpartition(":")
+        address = (host, int(port))
+    else:
+        if args.transport == "udp":
+            sink = DatagramSink(args.loss)
+        else:
+            sink = FrameSink(1024.0 * args.sink_rate if args.sink_rate else None)
+        sink_thread = threading.Thread(target=sink.run)
+        sink_thread.daemon = True
+        sink_thread.start()
+        address = sink.address
+    def connect():
+        if args.transport == "udp":
+            return DatagramSender(socket.socket(socket.AF_INET, socket.SOCK_DGRAM), address)
+        sock = connect_tcp(address)
+        return NonBlockingFrameSender(sock) if args.nonblocking else FrameSender(sock)
+
+    sender = ReconnectingTransport(connect, "%s:%d" % address) if args.reconnect else connect()
+    quality = AdaptiveQualityController(args.resolution) if args.adaptive else None
+    pipeline = VideoPipeline(source, sender, fps=args.fps,
+                             report_interval=2.0, quality_controller=quality,
+                             encoder=create_encoder(args.encoder))
+
+    source.start()
+    timer = threading.Timer(args.duration, pipeline.stop)
+    timer.start()
+    started = monotonic()
+    try:
+        pipeline.run_forever()
+    finally:
+        timer.cancel()
+        pipeline.stop()
+        source.stop()
+        if args.reconnect:
+            sender.close()
+        else:
+            sender.sock.close()
+    elapsed = monotonic() - started
+    if sink is not None:
+        if args.transport == "udp":
+            sink.running = False
+        sink_thread.join(2.0)
+    frames, nbytes = (sink.frames, sink.bytes) if sink else (sender.frames, sender.bytes)
+
+    print("[Bench] %d frames in %.1f s: %.1f fps, %.1f KB/frame, %.0f KB/s" % (
+        frames, elapsed, frames / elapsed,
+        nbytes / 1024.0 / max(frames, 1), nbytes / 1024.0 / elapsed))
+    if args.transport == "udp" and sink is not None:
+        print("[Bench] %s" % sink.reassembler.describe())
+    if hasattr(sender, "describe"):
+        print("[Bench] %s" % sender.describe())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Camera sources for the video sender.
+#
+# Every source returns images in the layout of ALVideoDevice.getImageRemote():
+#
+#   [width, height, layers, color_space, timestamp_s, timestamp_us, data, ...]
+#
+# so the sender pipeline does not care whether frames come from Pepper, a
+# recorded video or a generator. The last two make it possible to measure
+# encode and send throughput on a plain Linux box without a robot.
+#
+# A capture profile picks resolution and color space together. "viewer" is
+# the original 640x480 BGR stream. "classifier" asks NAOqi for luminance
+# only at 320x240, which is about what expression models look at anyway:
+# a twelfth of the bytes to fetch from the camera, encode and send.
+import time
+
+import cv2
+import numpy as np
+
+from stream_clock import monotonic
+
+# ALVideoDevice resolution constants
+RESOLUTION_SIZES = {
+    0: (160, 120),   # kQQVGA
+    1: (320, 240),   # kQVGA
+    2: (640, 480),   # kVGA
+    3: (1280, 960),  # k4VGA
+}
+
+Y_COLOR_SPACE = 0     # kYuvColorSpace, the Y (luminance) plane only
+BGR_COLOR_SPACE = 13  # kBGRColorSpace
+COLOR_SPACE_LAYERS = {Y_COLOR_SPACE: 1, BGR_COLOR_SPACE: 3}
+
+# profile name -> (resolution, color_space)
+CAPTURE_PROFILES = {
+    "viewer": (2, BGR_COLOR_SPACE),    # 640x480 colour
+    "classifier": (1, Y_COLOR_SPACE),  # 320x240 grayscale
+}
+
+
+def make_image(frame, color_space, stamp=None):
+    """Wrap a numpy frame into a getImageRemote()-style list."""
+    if stamp is None:
+        stamp = time.time()
+    height, width = frame.shape[:2]
+    layers = frame.shape[2] if frame.ndim == 3 else 1
+    seconds = int(stamp)
+    micros = int((stamp - seconds) * 1000000)
+    return [width, height, layers, color_space, seconds, micros, frame.tobytes()]
+
+
+class CameraSource(object):
+    """Interface shared by all camera backends."""
+
+    layers = 3  # channels per pixel in the images returned
+
+    def start(self):
+        pass
+
+    def get_image(self):
+        """Return the next image in getImageRemote() layout, or None."""
+        raise NotImplementedError
+
+    def set_resolution(self, resolution):
+        raise NotImplementedError
+
+    def stop(self):
+        pass
+
+
+class NaoqiCameraSource(CameraSource):
+    """Pepper's camera through ALVideoDevice (the original remote path)."""
+
+    def __init__(self, video_proxy, name, resolution=2, color_space=BGR_COLOR_SPACE,
+                 fps=10, camera_index=0):
+        self.video_proxy = video_proxy
+        self.name = name
+        self.resolution = resolution
+        self.color_space = color_space
+        self.layers = COLOR_SPACE_LAYERS.get(color_space, 3)
+        self.fps = fps
+        self.camera_index = camera_index
+        self.capture_id = None
+
+    def start(self):
+        self.capture_id = self.video_proxy.subscribeCamera(
+            self.name, self.camera_index, self.resolution, self.color_space, self.fps)
+
+    def get_image(self):
+        return self.video_proxy.getImageRemote(self.capture_id)
+
+    def set_resolution(self, resolution):
+        self.video_proxy.setResolution(self.capture_id, resolution)
+        self.resolution = resolution
+
+    def stop(self):
+        if self.capture_id:
+            try:
+                self.video_proxy.unsubscribe(self.capture_id)
+            except Exception as e:
+                print("Warning: could not unsubscribe cleanly:", e)
+            self.capture_id = None
+
+
+class ReplayCameraSource(CameraSource):
+    """Frames from a recorded video file, at recorded speed or as fast as possible."""
+
+    def __init__(self, path, realtime=True, loop=True, resolution=None,
+                 color_space=BGR_COLOR_SPACE):
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.resolution = resolution
+        self.color_space = color_space
+        self.layers = COLOR_SPACE_LAYERS[color_space]
+        self.capture = None
+        self.period = 0.0
+        self.next_frame_at = None
+
+    def start(self):
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            raise IOError("Could not open video %s" % self.path)
+        fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.period = 1.0 / fps
+
+    def get_image(self):
+        ok, frame = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read()
+        if not ok:
+            return None
+
+        if self.realtime:
+            now = monotonic()
+            if self.next_frame_at is None:
+                self.next_frame_at = now
+            if self.next_frame_at > now:
+                time.sleep(self.next_frame_at - now)
+            self.next_frame_at = max(self.next_frame_at + self.period, now - self.period)
+
+        if self.resolution is not None:
+            frame = cv2.resize(frame, RESOLUTION_SIZES[self.resolution],
+                               interpolation=cv2.INTER_AREA)
+        if self.layers == 1:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return make_image(frame, self.color_space)
+
+    def set_resolution(self, resolution):
+        self.resolution = resolution
+
+    def stop(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+
+class SyntheticCameraSource(CameraSource):
+    """Generated frames: a smooth moving pattern with some sensor-like noise."""
+
+    def __init__(self, resolution=2, noise=8, color_space=BGR_COLOR_SPACE):
+        self.noise = noise
+        self.color_space = color_space
+        self.layers = COLOR_SPACE_LAYERS[color_space]
+        self.frame_index = 0
+        self.set_resolution(resolution)
+
+    def set_resolution(self, resolution):
+        self.resolution = resolution
+        width, height = RESOLUTION_SIZES[resolution]
+        # Build the pattern twice as wide so every frame is a cheap slice of it
+        x = np.linspace(0, 4 * np.pi, 2 * width)
+        y = np.linspace(0, 2 * np.pi, height)
+        base = 127 + 100 * np.sin(x)[None, :] * np.cos(y)[:, None]
+        pattern = np.empty((height, 2 * width, 3), np.uint8)
+        pattern[:, :, 0] = base
+        pattern[:, :, 1] = base[:, ::-1]
+        pattern[:, :, 2] = 255 - base
+        if self.layers == 1:
+            pattern = cv2.cvtColor(pattern, cv2.COLOR_BGR2GRAY)
+        self.pattern = pattern
+        self.noise_table = np.random.randint(
+            0, self.noise + 1, (4,) + pattern[:, :width].shape).astype(np.uint8)
+
+    def get_image(self):
+        width, height = RESOLUTION_SIZES[self.resolution]
+        offset = (self.frame_index * 4) % width
+        frame = self.pattern[:, offset:offset + width] + self.noise_table[self.frame_index % 4]
+        self.frame_index += 1
+        return make_image(frame, self.color_space)
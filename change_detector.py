@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Static-scene frame suppression for the video sender.
+#
+# During a session the participant mostly sits still, so many frames are
+# near-identical. ChangeDetector compares a heavily subsampled thumbnail of
+# the raw camera buffer (a strided view, no copy of the full frame) with
+# the thumbnail of the last frame that was sent, and only lets a frame
+# through when the mean absolute difference exceeds a threshold. A keyframe
+# is forced every keyframe_interval seconds so the laptop can tell a static
+# scene from a dead link.
+import numpy as np
+
+from stream_clock import monotonic
+
+
+class ChangeDetector(object):
+    def __init__(self, threshold=4.0, keyframe_interval=2.0, step=16):
+        self.threshold = threshold                  # mean abs diff, 0-255 scale
+        self.keyframe_interval = keyframe_interval  # seconds
+        self.step = step                            # subsampling stride in pixels
+        self.reference = None
+        self.last_sent = None
+        self.skipped = 0        # skipped since the last frame that was sent
+        self.total_skipped = 0
+        self.last_diff = 0.0
+
+    def thumbnail(self, image):
+        thumb = image[::self.step, ::self.step]
+        if thumb.ndim == 3:
+            thumb = thumb[:, :, 1]  # green channel tracks luminance closely
+        return thumb.astype(np.int16)
+
+    def check(self, image):
+        """Return (send, keyframe) for this frame and update the reference."""
+        now = monotonic()
+        thumb = self.thumbnail(image)
+
+        keyframe = (self.reference is None or thumb.shape != self.reference.shape or
+                    now - self.last_sent >= self.keyframe_interval)
+        if not keyframe:
+            self.last_diff = float(np.abs(thumb - self.reference).mean())
+            if self.last_diff < self.threshold:
+                self.skipped += 1
+                self.total_skipped += 1
+                return False, False
+
+        self.reference = thumb
+        self.last_sent = now
+        return True, keyframe
+
+    def reset(self):
+        """Send the next frame as a keyframe, e.g. after the link came back."""
+        self.reference = None
+
+    def take_skipped(self):
+        """Return how many frames were skipped before this one and reset."""
+        skipped = self.skipped
+        self.skipped = 0
+        return skipped
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Robot/laptop clock offset estimation, NTP style.
+#
+# The robot slips a small ping into the video stream every `interval`
+# seconds (a length-prefixed payload starting with CLOCK_MAGIC instead of
+# a frame). The laptop notes when it arrived (t2) and answers on the
+# emotion channel with a line
+#
+#     b"clock <id> <t1> <t2> <t3>\n"
+#
+# and the robot stamps the reply's arrival (t4). Each exchange gives
+#
+#     offset = ((t2 - t1) + (t3 - t4)) / 2     laptop clock minus robot clock
+#     delay  = (t4 - t1) - (t3 - t2)           network round trip
+#
+# Exchanges that sat in a queue have a long delay and a skewed offset, so
+# only samples close to the smallest delay in the window are kept, and
+# their median gives the current offset.
+#
+# Drift is too small to see in that window: 50 ppm moves the offset by
+# 1.6 ms over 32 s, less than the jitter of a single exchange. It is
+# fitted instead over a long baseline of `epochs` periods of `epoch`
+# seconds (10 minutes by default), using only the minimum-delay exchange
+# of each period, and is left at zero until three periods are in. Lost
+# pings or replies just mean fewer samples; a ping with no reply after
+# `timeout` seconds is counted as lost and forgotten.
+#
+# Each ping also carries the robot's current estimate, so the laptop can
+# put robot capture times on its own clock without running the filter.
+import collections
+import struct
+import threading
+import time
+
+from stream_clock import monotonic
+
+CLOCK_MAGIC = b"PPCK"
+
+# magic, ping id, t1, robot's offset estimate, estimate valid
+CLOCK_PING = struct.Struct(">4sIdd?")
+
+
+def is_ping(data):
+    return bytes(bytearray(data[:4])) == CLOCK_MAGIC
+
+
+def parse_ping(data):
+    """Return (ping_id, t1, offset or None) from a ping payload."""
+    _, ping_id, t1, offset, valid = CLOCK_PING.unpack(bytes(bytearray(data[:CLOCK_PING.size])))
+    return ping_id, t1, offset if valid else None
+
+
+def format_pong(ping_id, t1, t2, t3):
+    return ("clock %d %.6f %.6f %.6f\n" % (ping_id, t1, t2, t3)).encode("ascii")
+
+
+def parse_pong(line):
+    """Return (ping_id, t1, t2, t3) from a reply line, or None for any other line."""
+    fields = line.split()
+    if len(fields) != 5 or fields[0] != b"clock":
+        return None
+    try:
+        return int(fields[1]), float(fields[2]), float(fields[3]), float(fields[4])
+    except ValueError:
+        return None
+
+
+class ClockSync(object):
+    """Robot-side offset and drift estimator fed by ping/pong exchanges."""
+
+    def __init__(self, interval=1.0, window=32, timeout=2.0, slack=0.005,
+                 epoch=30.0, epochs=20):
+        self.interval = interval
+        self.timeout = timeout
+        self.slack = slack
+        self.epoch = epoch
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.samples = collections.deque(maxlen=window)
+        self.minima = collections.deque(maxlen=epochs)  # best (t, offset, delay) per epoch
+        self.drift = 0.0
+        self.next_id = 0
+        self.next_ping = 0.0
+        self.sent = 0
+        self.received = 0
+        self.lost = 0
+        self.fit = None  # (reference time, offset at reference, drift)
+
+    def due(self):
+        return monotonic() >= self.next_ping
+
+    def make_ping(self):
+        """Return the next ping payload for the video connection."""
+        now = time.time()
+        offset = self.offset(now)
+        with self.lock:
+            self.expire()
+            self.next_id = (self.next_id + 1) & 0xFFFFFFFF
+            self.pending[self.next_id] = (now, monotonic())
+            self.next_ping = monotonic() + self.interval
+            self.sent += 1
+            ping_id = self.next_id
+        return CLOCK_PING.pack(CLOCK_MAGIC, ping_id, now, offset or 0.0, offset is not None)
+
+    def expire(self):
+        deadline = monotonic() - self.timeout
+        for ping_id in [i for i, (_, sent) in self.pending.items() if sent < deadline]:
+            del self.pending[ping_id]
+            self.lost += 1
+
+    def handle_pong(self, ping_id, t1, t2, t3, t4=None):
+        """Add one exchange; returns False for unknown or expired pings."""
+        if t4 is None:
+            t4 = time.time()
+        with self.lock:
+            sent = self.pending.pop(ping_id, None)
+            if sent is None or abs(sent[0] - t1) > 1e-3:
+                return False
+            self.received += 1
+            offset = ((t2 - t1) + (t3 - t4)) / 2.0
+            delay = (t4 - t1) - (t3 - t2)
+            sample = ((t1 + t4) / 2.0, offset, delay)
+            self.samples.append(sample)
+            self.add_minimum(sample)
+            self.update()
+        return True
+
+    def handle_line(self, line, t4=None):
+        """Consume a reply line from the emotion channel; False if it is not one."""
+        pong = parse_pong(line)
+        if pong is None:
+            return False
+        self.handle_pong(*pong, t4=t4)
+        return True
+
+    def add_minimum(self, sample):
+        """Keep the minimum-delay sample of each epoch; refit drift when one closes."""
+        minima = self.minima
+        if minima and int(sample[0] // self.epoch) == int(minima[-1][0] // self.epoch):
+            if sample[2] < minima[-1][2]:
+                minima[-1] = sample
+            return
+        if len(minima) >= 3:
+            self.drift = self.fit_drift(list(minima))  # closed epochs only
+        minima.append(sample)
+
+    def fit_drift(self, minima):
+        n = float(len(minima))
+        mean_t = sum(t for t, _, _ in minima) / n
+        mean_o = sum(offset for _, offset, _ in minima) / n
+        var = sum((t - mean_t) ** 2 for t, _, _ in minima)
+        if not var:
+            return 0.0
+        return sum((t - mean_t) * (offset - mean_o) for t, offset, _ in minima) / var
+
+    def update(self):
+        best = min(delay for _, _, delay in self.samples)
+        limit = max(2.0 * best, best + self.slack)
+        ref = self.samples[-1][0]
+        drift = self.drift
+        # Median of the low-delay offsets, each carried to ref along the drift
+        offsets = sorted(offset + drift * (ref - t)
+                         for t, offset, delay in self.samples if delay <= limit)
+        self.fit = (ref, offsets[len(offsets) // 2], drift)
+
+    def offset(self, at=None):
+        """Laptop clock minus robot clock at robot time `at`, or None before the first reply."""
+        fit = self.fit
+        if fit is None:
+            return None
+        if at is None:
+            at = time.time()
+        ref, offset, drift = fit
+        return offset + drift * (at - ref)
+
+    def to_robot(self, laptop_ts):
+        """Convert a laptop timestamp to the robot clock."""
+        return laptop_ts - (self.offset() or 0.0)
+
+    def describe(self):
+        fit = self.fit
+        if fit is None:
+            return "clock offset unknown (%d pings, %d lost)" % (self.sent, self.lost)
+        delays = [delay for _, _, delay in self.samples]
+        return "clock offset %.1f ms drift %.1f ppm rtt %.1f ms (%d/%d replies, %d lost)" % (
+            1000.0 * self.offset(), 1e6 * fit[2], 1000.0 * min(delays),
+            self.received, self.sent, self.lost)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# Sliding-window smoothing of the emotion stream (Python 2.7, robot side).
+#
+# The laptop sends one label per frame, and a single misclassified frame
+# used to reset the "same emotion five times in a row" debounce of the
+# adaptive scripts. EmotionAggregator keeps a windowed state instead and
+# answers "which emotion is the participant showing" in constant time.
+# Each update is an emotion code (emotion_registry.py) with an optional
+# score vector in EMOTIONS order; a code alone counts as a one-hot vector.
+#
+#   ema       exponential moving average of the scores; the leader wins
+#   majority  most frequent label over the last `window` updates; the
+#             current emotion is only replaced by one that leads it by
+#             `hysteresis` votes
+#   dwell     the EMA leader has to stay ahead for `min_dwell` seconds
+#             before it becomes current
+#
+# All state lives in arrays allocated up front: a ring of the last
+# `window` score vectors and labels, their running sums and per-class
+# vote counts. An update touches one ring slot and a few length-8
+# vectors, so its cost does not depend on the window size. The running
+# sums are recomputed from the ring each time it wraps so float error
+# cannot build up. bench_aggregator.py measures the update rate.
+import threading
+
+import numpy as np
+
+from emotion_registry import EMOTIONS
+from stream_clock import monotonic
+
+MODES = ("ema", "majority", "dwell")
+
+
+class EmotionAggregator(object):
+    def __init__(self, mode="majority", window=15, alpha=0.2, hysteresis=2, min_dwell=0.5):
+        if mode not in MODES:
+            raise ValueError("Unknown mode %r, expected one of %s" % (mode, ", ".join(MODES)))
+        self.mode = mode
+        self.window = window
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.lock = threading.Lock()
+
+        n = len(EMOTIONS)
+        self.ring = np.zeros((window, n), np.float64)
+        self.ring_labels = np.zeros(window, np.intp)
+        self.sums = np.zeros(n, np.float64)
+        self.votes = np.zeros(n, np.int64)
+        self.ema = np.zeros(n, np.float64)
+        self.vector = np.zeros(n, np.float64)  # scratch for the incoming scores
+        self.pos = 0
+        self.filled = 0
+
+        self.current = None     # index of the current emotion
+        self.since = None       # monotonic() when it became current
+        self.candidate = None   # dwell mode: best class waiting out min_dwell
+        self.candidate_since = None
+        self.updates = 0
+        self.switches = 0
+
+    def update(self, emotion=None, scores=None, now=None):
+        """Add one classification; returns the current (smoothed) emotion code."""
+        if now is None:
+            now = monotonic()
+        with self.lock:
+            vector = self.vector
+            if scores is not None and len(scores) == len(EMOTIONS):
+                vector[:] = scores
+                best = int(vector.argmax())
+            else:
+                if emotion is None:
+                    return self.current
+                best = emotion
+                vector.fill(0.0)
+                vector[best] = 1.0
+
+            pos = self.pos
+            if self.filled == self.window:
+                self.sums -= self.ring[pos]
+                self.votes[self.ring_labels[pos]] -= 1
+            else:
+                self.filled += 1
+            self.ring[pos] = vector
+            self.ring_labels[pos] = best
+            self.sums += vector
+            self.votes[best] += 1
+            self.pos = (pos + 1) % self.window
+            if self.pos == 0:
+                self.sums[:] = self.ring.sum(axis=0)
+
+            if self.updates:
+                self.ema *= 1.0 - self.alpha
+                self.ema += self.alpha * vector
+            else:
+                self.ema[:] = vector
+            self.updates += 1
+            self.decide(best, now)
+            return self.current
+
+    def decide(self, best, now):
+        if self.mode == "ema":
+            leader = int(self.ema.argmax())
+        elif self.mode == "majority":
+            leader = int(self.votes.argmax())
+            if (self.current is not None and leader != self.current and
+                    self.votes[leader] - self.votes[self.current] < self.hysteresis):
+                leader = self.current
+        else:
+            best = int(self.ema.argmax())
+            if best != self.candidate:
+                self.candidate = best
+                self.candidate_since = now
+            leader = self.current
+            if self.current is None or now - self.candidate_since >= self.min_dwell:
+                leader = best
+        if leader != self.current:
+            if self.current is not None:
+                self.switches += 1
+            self.current = leader
+            self.since = now
+
+    def emotion(self):
+        """Current smoothed emotion code, or None before the first update."""
+        return self.current
+
+    def confidence(self):
+        """Mean score of the current emotion over the window (0..1)."""
+        with self.lock:
+            if self.current is None:
+                return 0.0
+            return float(self.sums[self.current]) / self.filled
+
+    def held_for(self, now=None):
+        """Seconds the current emotion has been current."""
+        if self.since is None:
+            return 0.0
+        return (now if now is not None else monotonic()) - self.since
+
+    def describe(self):
+        current = self.current
+        return "%s %s conf %.2f held %.1f s, %d updates, %d switches" % (
+            self.mode, EMOTIONS[current] if current is not None else None, self.confidence(), self.held_for(),
+            self.updates, self.switches)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+# Emotion label server for PEPPER_RECEIVE_PORT (Python 2.7, runs on the robot).
+#
+# The laptop keeps one connection open and writes one label line per
+# classified frame (see label_protocol.py and LabelChannel in
+# laptop_receiver.py), so a label no longer costs a TCP handshake and
+# teardown. A single select() loop serves any number of classifier
+# clients at once and buffers each stream until a full line is in, so a
+# label split across two reads is never cut in half. Fixed-size binary
+# emotion messages (label_protocol.EMOTION_MESSAGE) may be mixed in.
+#
+# Old connect-per-message clients still work: whatever they sent before
+# closing counts as a final line, newline or not. A binary message cut
+# short by the close is dropped and counted as truncated instead.
+#
+# Message rates are tracked per client host (a one-shot client shows up
+# as many short connections from the same host) and per open connection,
+# and printed every report_interval seconds.
+#
+# Admission control keeps a chatty classifier from flooding the robot.
+# Only lines with a key count as labels (by default label_protocol.
+# emotion_key, the emotion); clock replies and other lines without one are
+# never merged or shed. A run of labels with the same key within one read
+# is merged into its newest label, and a label repeating the host's last
+# admitted emotion less than merge_interval seconds later is merged away,
+# so a steady emotion costs at most one label per merge_interval however
+# fast it is classified. Each client host then has a token bucket of
+# `rate` labels per second, `burst` deep, shared by its connections so that
+# one-shot clients cannot dodge it; labels beyond its tokens are shed
+# oldest first, and an empty bucket sheds the whole read. A poll that
+# still yields more than max_pending labels sheds the oldest ones as well.
+# Accepted, merged and shed labels are counted per host.
+import collections
+import errno
+import select
+import socket
+
+from label_protocol import EMOTION_MAGIC, emotion_key, split_messages
+from stream_clock import monotonic
+
+MAX_LINE = 4096  # a client sending more than this without a newline is dropped
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = None
+
+    def take(self, wanted, now):
+        """Take up to wanted tokens; returns how many were granted."""
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        granted = min(wanted, int(self.tokens))
+        self.tokens -= granted
+        return granted
+
+
+class HostStats(object):
+    def __init__(self, bucket=None):
+        self.bucket = bucket
+        self.messages = 0
+        self.bytes = 0
+        self.connects = 0
+        self.open = 0
+        self.last_messages = 0
+        self.accepted = 0
+        self.merged = 0
+        self.shed = 0
+        self.truncated = 0
+        self.last_key = None  # key of the last label admitted from this host
+        self.last_admitted = None
+
+    def snapshot(self):
+        """Messages since the previous snapshot."""
+        messages = self.messages - self.last_messages
+        self.last_messages = self.messages
+        return messages
+
+
+class Client(object):
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.buffer = b""
+        self.messages = 0
+        self.last_messages = 0
+
+    def snapshot(self):
+        messages = self.messages - self.last_messages
+        self.last_messages = self.messages
+        return messages
+
+
+class EmotionChannel(object):
+    """select()-based server yielding label lines from persistent and one-shot clients."""
+
+    def __init__(self, port, host="", backlog=16, report_interval=30.0,
+                 rate=None, burst=10, key=emotion_key, max_pending=64,
+                 merge_interval=0.2):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(backlog)
+        self.server.setblocking(False)
+        self.port = self.server.getsockname()[1]
+        self.report_interval = report_interval
+        self.rate = rate
+        self.burst = burst
+        self.key = key
+        self.max_pending = max_pending
+        self.merge_interval = merge_interval
+        self.clients = {}  # socket -> Client
+        self.hosts = collections.OrderedDict()
+        self.last_report = monotonic()
+        self.closed = False
+
+    def messages(self, timeout=1.0):
+        """Yield the complete messages of each read, one list per client read, until close()."""
+        while not self.closed:
+            for lines in self.poll(timeout):
+                yield lines
+            now = monotonic()
+            if self.report_interval and now - self.last_report >= self.report_interval:
+                self.report(now - self.last_report)
+                self.last_report = now
+
+    def poll(self, timeout):
+        """Wait up to timeout for traffic; return a list of message batches."""
+        try:
+            readable = select.select([self.server] + list(self.clients), [], [], timeout)[0]
+        except (select.error, socket.error, ValueError):
+            if self.closed:
+                return []
+            raise
+        now = monotonic()
+        batches = []
+        for sock in readable:
+            if sock is self.server:
+                self.accept()
+                continue
+            client = self.clients[sock]
+            messages = self.read(client)
+            if messages:
+                batches.append((self.host(client.address), self.admit(client, messages, now)))
+        self.shed_overload(batches)
+        for stats, admitted in batches:
+            self.remember(stats, admitted, now)
+        return [[message for _, message in admitted] for _, admitted in batches if admitted]
+
+    def admit(self, client, messages, now):
+        """Merge repeated labels and apply the host's token bucket.
+
+        Returns (key, message) pairs in arrival order; key is None for
+        lines that are not labels.
+        """
+        if self.key is None:
+            return [(None, message) for message in messages]
+        stats = self.host(client.address)
+        admitted = []
+        last_label = None  # index in admitted of this read's newest label
+        for message in messages:
+            key = self.key(message)
+            if key is None:
+                admitted.append((key, message))
+                continue
+            if last_label is not None and admitted[last_label][0] == key:
+                admitted[last_label] = (key, message)
+                stats.merged += 1
+            elif (last_label is None and key == stats.last_key
+                  and now - stats.last_admitted < self.merge_interval):
+                stats.merged += 1
+            else:
+                last_label = len(admitted)
+                admitted.append((key, message))
+        labels = sum(1 for key, _ in admitted if key is not None)
+        shed = labels - stats.bucket.take(labels, now) if stats.bucket else 0
+        stats.accepted += labels - shed
+        if shed:
+            admitted = self.drop_oldest(admitted, shed, stats)
+        return admitted
+
+    def remember(self, stats, admitted, now):
+        """Note the host's newest label that made it through, to merge repeats against."""
+        for key, _ in reversed(admitted):
+            if key is not None:
+                stats.last_key = key
+                stats.last_admitted = now
+                return
+
+    def drop_oldest(self, admitted, count, stats):
+        """Drop the oldest count labels of admitted; other lines are kept."""
+        stats.shed += count
+        kept = []
+        for key, message in admitted:
+            if key is not None and count:
+                count -= 1
+                continue
+            kept.append((key, message))
+        return kept
+
+    def shed_overload(self, batches):
+        """Shed the oldest labels of a poll that yields more than max_pending."""
+        if not self.max_pending:
+            return
+        excess = sum(1 for _, admitted in batches
+                     for key, _ in admitted if key is not None) - self.max_pending
+        for i, (stats, admitted) in enumerate(batches):
+            if excess <= 0:
+                break
+            labels = sum(1 for key, _ in admitted if key is not None)
+            count = min(excess, labels)
+            stats.accepted -= count
+            batches[i] = (stats, self.drop_oldest(admitted, count, stats))
+            excess -= count
+
+    def accept(self):
+        try:
+            sock, address = self.server.accept()
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.clients[sock] = Client(sock, address)
+        stats = self.host(address)
+        stats.connects += 1
+        stats.open += 1
+
+    def read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            data = b""
+        stats = self.host(client.address)
+        if not data:
+            # EOF: a one-shot client's message may lack the trailing newline
+            rest = client.buffer.strip()
+            messages = [rest] if rest else []
+            if client.buffer.startswith(EMOTION_MAGIC):
+                messages = []  # split_messages() left a partial binary message
+                stats.truncated += 1
+            client.buffer = b""
+            self.drop(client)
+        else:
+            stats.bytes += len(data)
+            messages, client.buffer = split_messages(client.buffer + data)
+            if len(client.buffer) > MAX_LINE:
+                print("[Emotion Channel] %s:%d sent %d bytes without a newline, dropping it" % (
+                    client.address[0], client.address[1], len(client.buffer)))
+                self.drop(client)
+        client.messages += len(messages)
+        stats.messages += len(messages)
+        return messages
+
+    def drop(self, client):
+        del self.clients[client.sock]
+        client.sock.close()
+        self.host(client.address).open -= 1
+
+    def host(self, address):
+        stats = self.hosts.get(address[0])
+        if stats is None:
+            bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+            stats = self.hosts[address[0]] = HostStats(bucket)
+        return stats
+
+    def report(self, elapsed):
+        connections = collections.defaultdict(list)
+        for client in self.clients.values():
+            connections[client.address[0]].append(":%d %.1f msg/s" % (
+                client.address[1], client.snapshot() / elapsed))
+        for host, stats in self.hosts.items():
+            messages = stats.snapshot()
+            if not messages and not stats.open:
+                continue
+            open_part = "%d open" % stats.open
+            if connections[host]:
+                open_part += " (%s)" % ", ".join(connections[host])
+            print("[Emotion Channel] %s: %.1f msg/s, %s, %d connects, %d messages, "
+                  "%d accepted %d merged %d shed %d truncated" % (
+                      host, messages / elapsed, open_part, stats.connects, stats.messages,
+                      stats.accepted, stats.merged, stats.shed, stats.truncated))
+
+    def close(self):
+        self.closed = True
+        for client in list(self.clients.values()):
+            self.drop(client)
+        self.server.close()
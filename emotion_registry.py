@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Shared emotion vocabulary (robot and laptop, Python 2.7 and 3).
+#
+# Emotion names reach the robot from the laptop classifier, from
+# ALFaceCharacteristics and from older scripts, and they did not agree:
+# "surprise" in the speech tags, "surprised" in the animation scripts. A
+# name that missed a table silently fell back to neutral. Every name and
+# alias now maps to a small integer code, and the lookup tables (speech
+# tags, phrase tables, animation maps) are lists indexed by code, built
+# once with code_table().
+#
+# EMOTIONS is also the class order of score vectors on the wire.
+NEUTRAL, HAPPY, SAD, ANGRY, DISGUST, FEAR, SURPRISE, CONFUSED = range(8)
+
+EMOTIONS = ("neutral", "happy", "sad", "angry", "disgust", "fear", "surprise", "confused")
+
+ALIASES = {
+    "calm": NEUTRAL,
+    "happiness": HAPPY,
+    "joy": HAPPY,
+    "sadness": SAD,
+    "anger": ANGRY,
+    "disgusted": DISGUST,
+    "fearful": FEAR,
+    "scared": FEAR,
+    "surprised": SURPRISE,
+    "confusion": CONFUSED,
+}
+
+_CODES = dict((emotion, i) for i, emotion in enumerate(EMOTIONS))
+_CODES.update(ALIASES)
+_unknown = set()
+
+
+def code(emotion, default=NEUTRAL):
+    """Code of an emotion name or alias (any case, bytes or text); default if unknown."""
+    if isinstance(emotion, int):
+        return emotion if 0 <= emotion < len(EMOTIONS) else default
+    if isinstance(emotion, bytes):
+        emotion = emotion.decode("utf-8", "replace")
+    key = emotion.strip().lower()
+    result = _CODES.get(key)
+    if result is None:
+        if key not in _unknown:
+            _unknown.add(key)
+            print("[Emotion] Unknown emotion %r, using %s" % (
+                key, EMOTIONS[default] if default is not None else None))
+        return default
+    return result
+
+
+def name(emotion_code):
+    return EMOTIONS[emotion_code]
+
+
+def code_table(mapping, default=None):
+    """List indexed by code from a dict keyed by emotion names or aliases.
+
+    Codes the dict does not cover get `default`, or its neutral entry if
+    default is None.
+    """
+    table = [None] * len(EMOTIONS)
+    for key, value in mapping.items():
+        if key.lower() not in _CODES:
+            raise ValueError("Unknown emotion %r in lookup table" % key)
+        table[_CODES[key.lower()]] = value
+    fallback = default if default is not None else table[NEUTRAL]
+    return [fallback if value is None else value for value in table]
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# Face region-of-interest selection for the video sender.
+#
+# The laptop only classifies the participant's face, so in ROI mode the
+# sender encodes a padded crop around it instead of the full frame. A
+# detector runs every few frames (a Haar cascade on a small grayscale copy,
+# or the faces ALFaceDetection already publishes in ALMemory) and template
+# matching follows the face in between, which is much cheaper than running
+# the detector on every frame. When the frame size changes (the quality
+# controller steps the resolution) the face box and template are scaled
+# to the new size and the detector runs on the next frame.
+import math
+import os
+
+import cv2
+
+# Pepper top camera field of view (radians)
+CAMERA_HFOV = math.radians(56.3)
+CAMERA_VFOV = math.radians(43.7)
+
+_CASCADE_NAME = "haarcascade_frontalface_default.xml"
+_CASCADE_DIRS = [
+    "/usr/share/opencv/haarcascades",
+    "/usr/share/OpenCV/haarcascades",
+    "/usr/local/share/OpenCV/haarcascades",
+]
+
+
+def find_face_cascade():
+    dirs = list(_CASCADE_DIRS)
+    if hasattr(cv2, "data"):
+        dirs.insert(0, cv2.data.haarcascades)
+    for directory in dirs:
+        path = os.path.join(directory, _CASCADE_NAME)
+        if os.path.exists(path):
+            return path
+    raise IOError("Could not find %s, pass cascade_path explicitly" % _CASCADE_NAME)
+
+
+def to_gray(image):
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+class HaarFaceDetector(object):
+    """OpenCV Haar cascade run on a downscaled grayscale copy of the frame."""
+
+    def __init__(self, cascade_path=None, scale=0.25):
+        self.cascade = cv2.CascadeClassifier(cascade_path or find_face_cascade())
+        self.scale = scale
+
+    def detect(self, image):
+        gray = to_gray(image)
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale,
+                           interpolation=cv2.INTER_AREA)
+        faces = self.cascade.detectMultiScale(small, 1.2, 4)
+        if len(faces) == 0:
+            return None
+        # Largest face is the participant sitting in front of Pepper
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        inv = 1.0 / self.scale
+        return int(x * inv), int(y * inv), int(w * inv), int(h * inv)
+
+
+class NaoqiFaceDetector(object):
+    """Reads the FaceDetected event that ALFaceDetection keeps in ALMemory.
+
+    Face positions there are camera angles; they are converted to pixels
+    with the top camera field of view. Pass the ALFaceDetection proxy and
+    the name it was subscribed with to have close() unsubscribe.
+    """
+
+    def __init__(self, memory_proxy, face_detection=None, subscriber=None):
+        self.memory = memory_proxy
+        self.face_detection = face_detection
+        self.subscriber = subscriber
+        self.last_stamp = None
+
+    def close(self):
+        if self.face_detection is not None:
+            self.face_detection.unsubscribe(self.subscriber)
+            self.face_detection = None
+
+    def detect(self, image):
+        height, width = image.shape[:2]
+        value = self.memory.getData("FaceDetected")
+        if not value or len(value) < 2 or not value[1]:
+            return None
+        stamp = value[0]
+        if stamp == self.last_stamp:
+            return None
+        self.last_stamp = stamp
+
+        best = None
+        for face in value[1][:-1]:  # last entry is Time_Filtered_Reco_Info
+            shape = face[0]
+            alpha, beta, size_x, size_y = shape[1], shape[2], shape[3], shape[4]
+            w = size_x / CAMERA_HFOV * width
+            h = size_y / CAMERA_VFOV * height
+            cx = (0.5 - alpha / CAMERA_HFOV) * width
+            cy = (0.5 + beta / CAMERA_VFOV) * height
+            box = (int(cx - w / 2), int(cy - h / 2), int(w), int(h))
+            if best is None or box[2] * box[3] > best[2] * best[3]:
+                best = box
+        return best
+
+
+class FaceRoiTracker(object):
+    """Returns a padded face box for each frame, or None when no face is known."""
+
+    def __init__(self, detector, detect_every=5, padding=0.3, search_margin=0.5,
+                 min_match=0.5, max_misses=10):
+        self.detector = detector
+        self.detect_every = detect_every
+        self.padding = padding
+        self.search_margin = search_margin
+        self.min_match = min_match
+        self.max_misses = max_misses
+
+        self.box = None
+        self.template = None
+        self.shape = None  # frame size the box and template refer to
+        self.frames_since_detect = detect_every
+        self.misses = 0
+
+    def detect(self, gray, image):
+        box = self.detector.detect(image)
+        self.frames_since_detect = 0
+        if box is None:
+            return None
+        box = clip_box(box, gray.shape[1], gray.shape[0])
+        if box[2] < 8 or box[3] < 8:
+            return None
+        x, y, w, h = box
+        self.template = gray[y:y + h, x:x + w].copy()
+        return box
+
+    def track(self, gray):
+        """Follow the last face with template matching in a window around it."""
+        x, y, w, h = self.box
+        mx = int(w * self.search_margin)
+        my = int(h * self.search_margin)
+        sx, sy, sw, sh = clip_box((x - mx, y - my, w + 2 * mx, h + 2 * my),
+                                  gray.shape[1], gray.shape[0])
+        if sw < w or sh < h:
+            return None
+        window = gray[sy:sy + sh, sx:sx + sw]
+        scores = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, best, _, (bx, by) = cv2.minMaxLoc(scores)
+        if best < self.min_match:
+            return None
+        return sx + bx, sy + by, w, h
+
+    def rescale(self, shape):
+        """Carry the face box and template over to a new frame size."""
+        fx = float(shape[1]) / self.shape[1]
+        fy = float(shape[0]) / self.shape[0]
+        x, y, w, h = self.box
+        box = clip_box((int(x * fx), int(y * fy), int(w * fx), int(h * fy)), shape[1], shape[0])
+        if box[2] < 8 or box[3] < 8 or self.template is None:
+            self.box = None
+            self.template = None
+        else:
+            self.box = box
+            self.template = cv2.resize(self.template, (box[2], box[3]),
+                                       interpolation=cv2.INTER_AREA)
+        self.frames_since_detect = self.detect_every  # confirm with the detector
+
+    def locate(self, image):
+        gray = to_gray(image)
+        if gray.shape != self.shape:
+            if self.box is not None:
+                self.rescale(gray.shape)
+            self.shape = gray.shape
+        box = None
+        self.frames_since_detect += 1
+        if self.box is None or self.frames_since_detect >= self.detect_every:
+            box = self.detect(gray, image)
+        if box is None and self.box is not None and self.template is not None:
+            box = self.track(gray)
+
+        if box is None:
+            self.misses += 1
+            if self.misses > self.max_misses:
+                self.box = None
+                self.template = None
+        else:
+            self.misses = 0
+            self.box = box
+
+        if self.box is None:
+            return None
+        return self.padded(self.box, image.shape[1], image.shape[0])
+
+    def close(self):
+        close = getattr(self.detector, "close", None)
+        if close is not None:
+            close()
+
+    def padded(self, box, width, height):
+        x, y, w, h = box
+        px = int(w * self.padding)
+        py = int(h * self.padding)
+        return clip_box((x - px, y - py, w + 2 * px, h + 2 * py), width, height)
+
+
+def clip_box(box, width, height):
+    x, y, w, h = box
+    x0 = max(0, x)
+    y0 = max(0, y)
+    x1 = min(width, x + w)
+    y1 = min(height, y + h)
+    return x0, y0, max(0, x1 - x0), max(0, y1 - y0)
+
+
+def create_roi_tracker(face_detector, pepper_ip, pepper_port, subscriber):
+    """Build a FaceRoiTracker using the "haar" or "naoqi" face detector."""
+    if face_detector == "naoqi":
+        from naoqi import ALProxy
+        face_detection = ALProxy("ALFaceDetection", pepper_ip, pepper_port)
+        face_detection.subscribe(subscriber)
+        detector = NaoqiFaceDetector(ALProxy("ALMemory", pepper_ip, pepper_port),
+                                     face_detection, subscriber)
+    else:
+        detector = HaarFaceDetector()
+    return FaceRoiTracker(detector)
@@ -5,6 +5,20 @@ import threading
 import random
 import traceback
 
+from emotion_registry import NEUTRAL, code, code_table, name
+
+# ExpressionProperties order of ALFaceCharacteristics, as emotion codes
+FACE_EMOTIONS = [code(emotion) for emotion in ("neutral", "happy", "surprised", "angry", "sad")]
+
+# (pitchShift, speed) per emotion code
+VOICE_PARAMETERS = code_table({
+    "neutral": (1.0, 1.0),
+    "happy": (1.5, 1.0),
+    "angry": (0.7, 1.0),
+    "sad": (1.0, 0.7),
+    "surprise": (1.0, 1.2),
+})
+
 class PepperDynamicPitchSpeaker(object):
     def __init__(self, robot_ip, port=9559):
         self.robot_ip = robot_ip
@@ -25,12 +39,13 @@ class PepperDynamicPitchSpeaker(object):
         self.emotion_update_interval = 5.0  # seconds between updates
         self.lock = threading.Lock()
 
-        self.animations = {
+        # Indexed by emotion code
+        self.animations = code_table({
             "happy": ["^start(animations/Moods/Positive/Pepper/Kisses)"],
             # "sad": ["^start(animations/Stand/Gestures/Frustration_1)"],
             # "angry": ["^start(animations/Stand/Gestures/Angry_1)"],
-            # "surprised": ["^start(animations/Stand/Gestures/Surprised_1)"],
-        }
+            # "surprise": ["^start(animations/Stand/Gestures/Surprised_1)"],
+        }, default=[])
 
     def connect_and_init_services(self):
         """Connect to Pepper and initialize services if not connected."""
@@ -116,11 +131,11 @@ class PepperDynamicPitchSpeaker(object):
                 if not ids:
                     print("[DEBUG] No people detected.")
                     with self.lock:
-                        self.current_emotion = "neutral"  # use neutral instead of None
+                        self.current_emotion = NEUTRAL  # use neutral instead of None
                 elif len(ids) > 1:
                     print("[DEBUG] Multiple people detected. Skipping emotion detection.")
                     with self.lock:
-                        self.current_emotion = "neutral"
+                        self.current_emotion = NEUTRAL
                 else:
                     person_id = ids[0]
                     now = time.time()
@@ -132,22 +147,21 @@ class PepperDynamicPitchSpeaker(object):
                             "PeoplePerception/Person/%s/ExpressionProperties" % str(person_id)
                         )
                         print("[DEBUG] Expression properties: %s" % str(props))
-                        emotions = ["neutral", "happy", "surprised", "angry", "sad"]
-                        if not props or len(props) != len(emotions):
+                        if not props or len(props) != len(FACE_EMOTIONS):
                             print("[WARN] Expression properties length mismatch or empty, using default neutral values.")
                             props = [1.0, 0.0, 0.0, 0.0, 0.0]
 
-                        emotion_scores = dict(zip(emotions, props))
-                        detected_emotion = max(emotion_scores, key=emotion_scores.get)
-                        print("[DEBUG] Detected emotion: %s" % detected_emotion)
+                        best = max(range(len(props)), key=props.__getitem__)
+                        detected_emotion = FACE_EMOTIONS[best]
+                        print("[DEBUG] Detected emotion: %s" % name(detected_emotion))
 
                         with self.lock:
                             if self.current_emotion != detected_emotion:
                                 self.current_emotion = detected_emotion
                                 self.last_emotion_update = now
-                                print("[DEBUG] Emotion updated to: %s" % detected_emotion)
+                                print("[DEBUG] Emotion updated to: %s" % name(detected_emotion))
                             else:
-                                print("[DEBUG] Emotion unchanged: %s" % detected_emotion)
+                                print("[DEBUG] Emotion unchanged: %s" % name(detected_emotion))
                 time.sleep(1)
             except Exception as e:
                 print("Emotion detection error: %s" % str(e))
@@ -168,18 +182,9 @@ class PepperDynamicPitchSpeaker(object):
             with self.lock:
                 emotion = self.current_emotion
             if emotion is None:
-                emotion = "neutral"  # replace None with neutral here too
-
-            pitch = 1.0
-            speed = 1.0
-            if emotion == "happy":
-                pitch = 1.5
-            elif emotion == "angry":
-                pitch = 0.7
-            elif emotion == "sad":
-                speed = 0.7
-            elif emotion == "surprised":
-                speed = 1.2
+                emotion = NEUTRAL  # replace None with neutral here too
+
+            pitch, speed = VOICE_PARAMETERS[emotion]
 
             try:
                 self.tts.setParameter("pitchShift", pitch)
@@ -190,10 +195,10 @@ class PepperDynamicPitchSpeaker(object):
                 traceback.print_exc()
 
             animation = ""
-            if emotion in self.animations:
+            if self.animations[emotion]:
                 animation = random.choice(self.animations[emotion])
             animated_sentence = "%s %s" % (animation, sentence.strip())
-            print("Saying with emotion '%s': %s" % (emotion, animated_sentence))
+            print("Saying with emotion '%s': %s" % (name(emotion), animated_sentence))
             try:
                 self.animated_speech.say(animated_sentence)
             except Exception as e:
@@ -3,6 +3,20 @@ import time
 import qi
 from naoqi import ALProxy
 
+from emotion_registry import code, code_table
+
+# What Pepper says after "You look ", per emotion code
+SPOKEN_EMOTIONS = code_table({
+    "neutral": "neutral",
+    "happy": "happy",
+    "sad": "sad",
+    "angry": "angry",
+    "disgust": "disgusted",
+    "fear": "scared",
+    "surprise": "surprised",
+    "confused": "confused",
+})
+
 class PepperEmotionRecognizer(object):
     def __init__(self, robot_ip="192.168.0.102", port=9559, confidence_threshold=0.3):
         self.robot_ip = robot_ip
@@ -23,16 +37,17 @@ class PepperEmotionRecognizer(object):
         self.memory = ALProxy("ALMemory", self.robot_ip, self.port)
         self.tts = ALProxy("ALTextToSpeech", self.robot_ip, self.port)
 
-        # Thresholds for emotions
+        # Thresholds for emotions, indexed by emotion code
         self.confidence = confidence_threshold
-        self.thresh = {
+        self.thresh = code_table({
             "neutral": self.confidence + 0.15,
             "happy": self.confidence,
-            "surprised": self.confidence + 0.05,
+            "surprise": self.confidence + 0.05,
             "angry": self.confidence + 0.2,
             "sad": self.confidence + 0.15
-        }
-        self.emotions = ["neutral", "happy", "surprised", "angry", "sad"]
+        })
+        # ExpressionProperties order of ALFaceCharacteristics, as emotion codes
+        self.emotions = [code(emotion) for emotion in ("neutral", "happy", "surprised", "angry", "sad")]
 
     def wake_up(self):
         print("[INFO] Waking up Pepper...")
@@ -101,8 +116,8 @@ class PepperEmotionRecognizer(object):
         return self.emotions[recognized.index(max(recognized))]
 
     def say_emotion(self, emotion):
-        if emotion:
-            message = "You look " + emotion
+        if emotion is not None:
+            message = "You look " + SPOKEN_EMOTIONS[emotion]
         else:
             message = "I don't know."
         print("[SAYING] " + message)
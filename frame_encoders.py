@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Frame encoder backends for the video sender.
+#
+# Each encoder turns a BGR camera frame (or ROI crop) into a payload plus
+# the pixel_format / codec / scale header fields the laptop needs to
+# decode it (see frame_header.py). Which one is cheapest overall depends on
+# Pepper's CPU and the WiFi at hand; bench_encoders.py measures all of
+# them on the same frames.
+#
+#   jpeg  OpenCV JPEG at an adjustable quality (the original sender)
+#   png   lossless PNG, compression level 0-9
+#   webp  OpenCV WebP at an adjustable quality
+#   zlib  raw BGR pixels, deflated
+#   gray  grayscale, shrunk by an integer factor, raw or deflated
+import cv2
+
+from frame_header import (CODEC_JPEG, CODEC_PNG, CODEC_RAW, CODEC_WEBP, CODEC_ZLIB,
+                          PIXEL_BGR, PIXEL_GRAY, encode_image)
+
+
+class FrameEncoder(object):
+    """Base class: encode(image) -> (payload, header fields)."""
+
+    name = None
+    codec = None
+    pixel_format = PIXEL_BGR
+    scale = 1
+
+    def __init__(self, quality=None):
+        self.quality = quality
+
+    def set_quality(self, quality):
+        """Follow the adaptive quality controller; ignored by lossless encoders."""
+
+    def prepare(self, image):
+        return image
+
+    def encode(self, image):
+        image = self.prepare(image)
+        pixel_format = PIXEL_GRAY if image.ndim == 2 else self.pixel_format
+        payload = encode_image(image, self.codec, self.quality)
+        return payload, {"pixel_format": pixel_format, "codec": self.codec,
+                         "scale": self.scale}
+
+    @property
+    def legacy_compatible(self):
+        """True if a receiver that expects bare JPEG frames can decode the output."""
+        return self.codec == CODEC_JPEG and self.pixel_format == PIXEL_BGR and self.scale == 1
+
+
+class JpegEncoder(FrameEncoder):
+    name = "jpeg"
+    codec = CODEC_JPEG
+
+    def __init__(self, quality=95):  # cv2.imencode's default
+        FrameEncoder.__init__(self, quality)
+
+    def set_quality(self, quality):
+        self.quality = quality
+
+
+class WebpEncoder(JpegEncoder):
+    name = "webp"
+    codec = CODEC_WEBP
+
+    def __init__(self, quality=80):
+        JpegEncoder.__init__(self, quality)
+
+
+class PngEncoder(FrameEncoder):
+    name = "png"
+    codec = CODEC_PNG
+
+    def __init__(self, compression=1):
+        FrameEncoder.__init__(self, compression)
+
+
+class ZlibEncoder(FrameEncoder):
+    name = "zlib"
+    codec = CODEC_ZLIB
+
+    def __init__(self, level=1):
+        FrameEncoder.__init__(self, level)
+
+
+class GrayEncoder(FrameEncoder):
+    name = "gray"
+    pixel_format = PIXEL_GRAY
+
+    def __init__(self, scale=2, compress=False, level=1):
+        FrameEncoder.__init__(self, level)
+        self.scale = scale
+        self.codec = CODEC_ZLIB if compress else CODEC_RAW
+
+    def prepare(self, image):
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.scale > 1:
+            height, width = image.shape[:2]
+            image = cv2.resize(image, (width // self.scale, height // self.scale),
+                               interpolation=cv2.INTER_AREA)
+        return image
+
+
+ENCODERS = {
+    "jpeg": JpegEncoder,
+    "png": PngEncoder,
+    "webp": WebpEncoder,
+    "zlib": ZlibEncoder,
+    "gray": GrayEncoder,
+}
+
+
+def create_encoder(name, **options):
+    """Build an encoder by name (see ENCODERS)."""
+    if name not in ENCODERS:
+        raise ValueError("Unknown encoder %r, expected one of %s" % (
+            name, ", ".join(sorted(ENCODERS))))
+    return ENCODERS[name](**options)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Binary frame format shared by the robot senders and the laptop receivers.
+#
+# The stream stays ">I length + payload" on the wire. In extended mode the
+# payload starts with the fixed header below instead of the JPEG SOI marker
+# (0xFFD8), so a receiver can tell both kinds of frame apart by the magic.
+#
+#   magic         4s  b"PPFH"
+#   version       B
+#   flags         B   FLAG_* bits
+#   pixel_format  B   PIXEL_* layout of the decoded image
+#   codec         B   CODEC_* encoding of the payload
+#   seq           I   frame sequence number
+#   capture_us    Q   capture time in microseconds (NAOqi image[4]/image[5])
+#   frame_w       H   size of the full camera frame
+#   frame_h       H
+#   roi_x         H   region of the full frame carried in the payload
+#   roi_y         H
+#   roi_w         H
+#   roi_h         H
+#   skipped       H   unchanged frames suppressed since the previous sent frame
+#   scale         B   payload is the region shrunk by this factor (1 = full size)
+#
+# Everything is big-endian with fixed field sizes, so Python 2.7 on the
+# robot and Python 3 on the laptop agree on the layout.
+import collections
+import struct
+import zlib
+
+import cv2
+import numpy as np
+
+MAGIC = b"PPFH"
+VERSION = 4
+
+FLAG_ROI = 0x01       # payload is a crop of the full frame
+FLAG_KEYFRAME = 0x02  # forced periodic frame sent although the scene is static
+
+PIXEL_BGR = 1
+PIXEL_RGB = 2
+PIXEL_GRAY = 3
+PIXEL_CHANNELS = {PIXEL_BGR: 3, PIXEL_RGB: 3, PIXEL_GRAY: 1}
+
+CODEC_RAW = 0   # uncompressed pixels, roi_h x roi_w x channels (divided by scale)
+CODEC_JPEG = 1
+CODEC_PNG = 2
+CODEC_WEBP = 3
+CODEC_ZLIB = 4  # CODEC_RAW pixels, deflated
+CODEC_NAMES = {CODEC_RAW: "raw", CODEC_JPEG: "jpeg", CODEC_PNG: "png",
+               CODEC_WEBP: "webp", CODEC_ZLIB: "zlib"}
+
+HEADER = struct.Struct(">4sBBBBIQHHHHHHHB")
+LENGTH = struct.Struct(">I")
+
+FrameHeader = collections.namedtuple(
+    "FrameHeader",
+    "version flags pixel_format codec seq capture_ts "
+    "frame_w frame_h roi_x roi_y roi_w roi_h skipped scale")
+
+
+def _header_fields(seq, frame_w, frame_h, roi, skipped, keyframe, capture_ts,
+                   pixel_format, codec, scale):
+    flags = 0
+    if keyframe:
+        flags |= FLAG_KEYFRAME
+    if roi is None:
+        roi = (0, 0, frame_w, frame_h)
+    else:
+        flags |= FLAG_ROI
+    x, y, w, h = roi
+    return (MAGIC, VERSION, flags, pixel_format, codec, seq & 0xFFFFFFFF,
+            int(capture_ts * 1000000), frame_w, frame_h, x, y, w, h, min(skipped, 0xFFFF),
+            scale)
+
+
+def pack_header(seq, frame_w, frame_h, roi=None, skipped=0, keyframe=False,
+                capture_ts=0.0, pixel_format=PIXEL_BGR, codec=CODEC_JPEG, scale=1):
+    return HEADER.pack(*_header_fields(seq, frame_w, frame_h, roi, skipped, keyframe,
+                                       capture_ts, pixel_format, codec, scale))
+
+
+def pack_header_into(buffer, offset, seq, frame_w, frame_h, roi=None, skipped=0,
+                     keyframe=False, capture_ts=0.0, pixel_format=PIXEL_BGR,
+                     codec=CODEC_JPEG, scale=1):
+    """Like pack_header(), but writes into a preallocated buffer."""
+    HEADER.pack_into(buffer, offset,
+                     *_header_fields(seq, frame_w, frame_h, roi, skipped, keyframe,
+                                     capture_ts, pixel_format, codec, scale))
+
+
+def parse_frame(data):
+    """Split a received payload into (FrameHeader or None, image bytes).
+
+    Legacy frames (plain JPEG) come back with a None header.
+    """
+    if len(data) < HEADER.size or bytes(bytearray(data[:4])) != MAGIC:
+        return None, data
+    fields = HEADER.unpack_from(data)
+    if fields[1] != VERSION:
+        raise ValueError("Unsupported frame header version %d" % fields[1])
+    fields = list(fields[1:])
+    fields[5] = fields[5] / 1000000.0  # capture_us -> seconds
+    return FrameHeader(*fields), data[HEADER.size:]
+
+
+# cv2.imencode() extension and quality parameter of the image codecs;
+# "quality" is the PNG compression level (0-9) for PNG
+IMAGE_CODECS = {
+    CODEC_JPEG: (".jpg", cv2.IMWRITE_JPEG_QUALITY),
+    CODEC_PNG: (".png", cv2.IMWRITE_PNG_COMPRESSION),
+    CODEC_WEBP: (".webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+def encode_image(image, codec=CODEC_JPEG, quality=90):
+    """Encode an image for the payload; returns a 1-D uint8 buffer."""
+    if codec == CODEC_RAW:
+        return np.ascontiguousarray(image).reshape(-1)
+    if codec == CODEC_ZLIB:
+        packed = zlib.compress(np.ascontiguousarray(image).tobytes(), quality)
+        return np.frombuffer(packed, np.uint8)
+    if codec in IMAGE_CODECS:
+        ext, param = IMAGE_CODECS[codec]
+        result, buf = cv2.imencode(ext, image, [param, quality])
+        if not result:
+            raise ValueError("%s encoding failed" % CODEC_NAMES[codec])
+        return buf.reshape(-1)
+    raise ValueError("Unknown codec %d" % codec)
+
+
+def decode_image(header, payload):
+    """Turn a payload back into an image array (BGR, RGB or single channel)."""
+    if header is not None and header.codec == CODEC_ZLIB:
+        payload = zlib.decompress(payload)
+    buf = np.frombuffer(payload, np.uint8)
+    if header is None or header.codec in IMAGE_CODECS:
+        flags = cv2.IMREAD_COLOR
+        if header is not None and header.pixel_format == PIXEL_GRAY:
+            flags = cv2.IMREAD_GRAYSCALE
+        image = cv2.imdecode(buf, flags)
+        if image is None:
+            raise ValueError("Could not decode %s payload" % CODEC_NAMES[
+                header.codec if header is not None else CODEC_JPEG])
+        return image
+    if header.codec in (CODEC_RAW, CODEC_ZLIB):
+        channels = PIXEL_CHANNELS[header.pixel_format]
+        shape = (header.roi_h // header.scale, header.roi_w // header.scale)
+        if channels > 1:
+            shape += (channels,)
+        return buf.reshape(shape)
+    raise ValueError("Unknown codec %d" % header.codec)
+
+
+def decode_frame(data):
+    """Parse and decode one received payload; returns (FrameHeader or None, image)."""
+    header, payload = parse_frame(data)
+    return header, decode_image(header, payload)
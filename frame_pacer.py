@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Deadline-based frame pacing.
+#
+# Sleeping a fixed 1/fps after each frame adds the capture and encode time
+# on top of the period, so the stream runs well below the configured fps.
+# FramePacer instead keeps an absolute schedule of deadlines on a monotonic
+# clock and only sleeps for what is left of the current period. When the
+# caller falls behind, the deadlines it already missed are skipped rather
+# than served back to back, so a slow frame never causes a burst.
+import threading
+import time
+
+from stream_clock import monotonic
+
+
+class FramePacer(object):
+    def __init__(self, fps):
+        self.lock = threading.Lock()
+        self.period = 1.0 / fps
+        self.next_deadline = None
+        self.reset_stats()
+
+    def set_fps(self, fps):
+        with self.lock:
+            self.period = 1.0 / fps
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.missed = 0
+        self.jitter_sum = 0.0
+        self.jitter_max = 0.0
+        self.window_start = monotonic()
+
+    def wait(self):
+        """Sleep until the next deadline and return the time it fired at."""
+        now = monotonic()
+        if self.next_deadline is None:
+            self.next_deadline = now
+            self.window_start = now
+        period = self.period
+
+        if now > self.next_deadline + period:
+            # We overran one or more whole periods: drop those slots.
+            skipped = int((now - self.next_deadline) / period)
+            self.next_deadline += skipped * period
+            with self.lock:
+                self.missed += skipped
+
+        delay = self.next_deadline - now
+        if delay > 0:
+            time.sleep(delay)
+            now = monotonic()
+
+        jitter = abs(now - self.next_deadline)
+        with self.lock:
+            self.ticks += 1
+            self.jitter_sum += jitter
+            if jitter > self.jitter_max:
+                self.jitter_max = jitter
+        self.next_deadline += period
+        return now
+
+    def snapshot(self):
+        """Return (achieved fps, mean jitter s, max jitter s, missed) and reset."""
+        with self.lock:
+            elapsed = monotonic() - self.window_start
+            rate = self.ticks / elapsed if elapsed > 0 else 0.0
+            mean_jitter = self.jitter_sum / self.ticks if self.ticks else 0.0
+            result = (rate, mean_jitter, self.jitter_max, self.missed)
+            self.reset_stats()
+        return result
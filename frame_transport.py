@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+# Frame transport for the LAPTOP_PORT video stream.
+#
+# Every frame goes out as one write: the ">I" length prefix, the optional
+# extended header and the encoded payload are handed to sendmsg() as a
+# scatter-gather list, so the payload is sent straight from the encoder's
+# buffer without a tobytes() copy. The prefix is packed into a buffer that
+# is allocated once. Python 2.7 has no socket.sendmsg(); there the pieces
+# are copied into one reusable bytearray, which still costs a single
+# syscall per frame instead of two.
+#
+# The socket is switched to TCP_NODELAY so a frame is never held back by
+# Nagle's algorithm waiting for the ACK of the previous one, and the send
+# buffer is kept small so frames cannot pile up in the kernel.
+#
+# NonBlockingFrameSender never waits for the socket at all. It keeps one
+# frame in flight (partly written, it has to be finished to keep the
+# stream intact) and at most one frame waiting behind it; a newer frame
+# replaces the waiting one, which is counted as dropped. pump() writes
+# whatever the socket accepts, polling for writability with select() for
+# no longer than it is told to, so a slow laptop or WiFi link costs stale
+# frames instead of a stalled sender thread. The time the socket spent
+# full is added up as `blocked`. A half-open link (laptop gone without a
+# FIN or RST) never raises a socket error; it just stops taking bytes, so
+# a socket that accepts nothing for stall_timeout seconds while a frame is
+# in flight raises ETIMEDOUT, and ReconnectingTransport reconnects.
+#
+# DatagramSender is the UDP alternative with the same send_frame() API. A
+# frame (extended header + payload, no length prefix) is cut into
+# datagrams of at most `mtu` bytes, each led by a FRAGMENT header naming
+# the frame and the fragment's place in it. A lost datagram then costs
+# only its own frame instead of stalling every later one behind a TCP
+# retransmission. FrameReassembler puts frames back together on the
+# laptop, newest first: a frame still missing pieces when a newer one
+# completes, or after `deadline` seconds, is dropped, and so is a frame
+# whose fragments disagree on how many pieces it has.
+#
+# ReconnectingTransport wraps any of the senders and rebuilds it when the
+# link fails (laptop restart, WiFi blip), retrying with jittered
+# exponential backoff. Only the socket is replaced; the camera
+# subscription and NAOqi proxies of the caller stay as they are. While it
+# is down, frames are dropped and `connected` is False so the pipeline can
+# stop capturing.
+import collections
+import errno
+import random
+import select
+import socket
+import struct
+import time
+
+from frame_header import HEADER, LENGTH, pack_header, pack_header_into
+from stream_clock import monotonic
+
+FRAGMENT_MAGIC = b"PPFD"
+
+# magic, frame id, fragment index, fragment count
+FRAGMENT = struct.Struct(">4sIHH")
+
+# Keeps IP + UDP + FRAGMENT headers and the fragment inside a 1500 byte MTU
+DEFAULT_MTU = 1400
+
+DEFAULT_SEND_BUFFER = 128 * 1024
+
+
+def configure_socket(sock, send_buffer=DEFAULT_SEND_BUFFER):
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if send_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+
+
+class FrameSender(object):
+    def __init__(self, sock, send_buffer=DEFAULT_SEND_BUFFER):
+        self.sock = sock
+        configure_socket(sock, send_buffer)
+        self.prefix = bytearray(LENGTH.size + HEADER.size)
+        self.prefix_view = memoryview(self.prefix)
+        self.use_sendmsg = hasattr(sock, "sendmsg")
+        self.scratch = bytearray(0)
+        self.frames = 0
+        self.bytes = 0
+
+    def send_frame(self, payload, header=None):
+        """Send one length-prefixed frame.
+
+        payload is any contiguous byte buffer (bytes, a 1-D uint8 array from
+        cv2.imencode, ...). header, if given, is a dict of pack_header()
+        arguments and makes this an extended frame.
+        """
+        payload = memoryview(payload)
+        size = len(payload) * payload.itemsize
+        prefix_size = LENGTH.size
+        if header is not None:
+            pack_header_into(self.prefix, LENGTH.size, **header)
+            prefix_size += HEADER.size
+        LENGTH.pack_into(self.prefix, 0, prefix_size - LENGTH.size + size)
+
+        if self.use_sendmsg:
+            self.sendmsg_all([self.prefix_view[:prefix_size], payload])
+        else:
+            total = prefix_size + size
+            if len(self.scratch) < total:
+                self.scratch = bytearray(total)
+            self.scratch[:prefix_size] = self.prefix_view[:prefix_size]
+            self.scratch[prefix_size:total] = payload
+            self.sock.sendall(memoryview(self.scratch)[:total])
+
+        self.frames += 1
+        self.bytes += prefix_size + size
+
+    def sendmsg_all(self, buffers):
+        while buffers:
+            sent = self.sock.sendmsg(buffers)
+            while sent:
+                first = len(buffers[0])
+                if sent >= first:
+                    sent -= first
+                    buffers.pop(0)
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
+            while buffers and not len(buffers[0]):
+                buffers.pop(0)
+
+
+class NonBlockingFrameSender(object):
+    """FrameSender that never blocks: one frame in flight, the newest one waiting."""
+
+    def __init__(self, sock, send_buffer=DEFAULT_SEND_BUFFER, stall_timeout=5.0):
+        self.sock = sock
+        configure_socket(sock, send_buffer)
+        sock.setblocking(False)
+        self.stall_timeout = stall_timeout
+        self.use_sendmsg = hasattr(sock, "sendmsg")
+        self.current = None     # [buffers, tag, size, started]
+        self.pending = None     # (buffers, tag, size)
+        self.completed = collections.deque()
+        self.stalled_since = None
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.blocked = 0.0
+
+    def send_frame(self, payload, header=None, tag=None):
+        """Queue a frame behind the one in flight and write what fits right away.
+
+        A frame still waiting from an earlier call is replaced. tag comes
+        back from take_sent() once the frame is completely written.
+        """
+        payload = memoryview(payload)
+        data = pack_header(**header) if header is not None else b""
+        size = len(data) + len(payload) * payload.itemsize
+        prefix = LENGTH.pack(size) + data
+        if self.use_sendmsg:
+            buffers = [memoryview(prefix), payload]
+        else:
+            buffers = [memoryview(prefix + payload.tobytes())]
+        if self.pending is not None:
+            self.dropped += 1
+        self.pending = (buffers, tag, LENGTH.size + size)
+        self.pump()
+
+    @property
+    def backlog(self):
+        return self.current is not None or self.pending is not None
+
+    def pump(self, timeout=0.0):
+        """Write until idle or `timeout` seconds pass; True once nothing is left to send."""
+        deadline = monotonic() + timeout
+        while True:
+            if self.current is None:
+                if self.pending is None:
+                    return True
+                buffers, tag, size = self.pending
+                self.pending = None
+                self.current = [buffers, tag, size, monotonic()]
+            if self.write():
+                continue
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            select.select([], [self.sock], [], remaining)
+
+    def write(self):
+        """Send from the frame in flight; False if the socket is full."""
+        buffers = self.current[0]
+        while buffers:
+            try:
+                if self.use_sendmsg:
+                    sent = self.sock.sendmsg(buffers)
+                else:
+                    sent = self.sock.send(buffers[0])
+            except socket.error as e:
+                if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+                now = monotonic()
+                if self.stalled_since is None:
+                    self.stalled_since = now
+                elif self.stall_timeout and now - self.stalled_since > self.stall_timeout:
+                    raise socket.error(errno.ETIMEDOUT, "no bytes written for %.1f s" % (
+                        now - self.stalled_since))
+                return False
+            if self.stalled_since is not None:
+                self.blocked += monotonic() - self.stalled_since
+                self.stalled_since = None
+            while sent:
+                first = len(buffers[0])
+                if sent >= first:
+                    sent -= first
+                    buffers.pop(0)
+                else:
+                    buffers[0] = buffers[0][sent:]
+                    sent = 0
+            while buffers and not len(buffers[0]):
+                buffers.pop(0)
+
+        _, tag, size, started = self.current
+        self.current = None
+        self.frames += 1
+        self.bytes += size
+        self.completed.append((tag, size, monotonic() - started, time.time()))
+        return True
+
+    def take_sent(self):
+        """Return [(tag, bytes, seconds on the wire, wall time done)] since the last call."""
+        sent = []
+        while self.completed:
+            sent.append(self.completed.popleft())
+        return sent
+
+    def describe(self):
+        blocked = self.blocked
+        if self.stalled_since is not None:
+            blocked += monotonic() - self.stalled_since
+        return "wire sent=%d dropped=%d blocked=%.1f s" % (self.frames, self.dropped, blocked)
+
+
+class DatagramSender(object):
+    """send_frame() over UDP: one frame, several datagrams, no retransmission."""
+
+    def __init__(self, sock, address, mtu=DEFAULT_MTU, send_buffer=DEFAULT_SEND_BUFFER):
+        self.sock = sock
+        self.address = address
+        self.mtu = mtu
+        if send_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+        self.datagram = bytearray(FRAGMENT.size + mtu)
+        self.datagram_view = memoryview(self.datagram)
+        self.frame_id = 0
+        self.frames = 0
+        self.datagrams = 0
+        self.bytes = 0
+
+    def send_frame(self, payload, header=None):
+        data = memoryview(payload).tobytes()
+        if header is not None:
+            data = pack_header(**header) + data
+        self.frame_id = (self.frame_id + 1) & 0xFFFFFFFF
+        count = max(1, (len(data) + self.mtu - 1) // self.mtu)
+        if count > 0xFFFF:
+            raise ValueError("Frame of %d bytes is too large for UDP" % len(data))
+
+        for index in range(count):
+            chunk = data[index * self.mtu:(index + 1) * self.mtu]
+            FRAGMENT.pack_into(self.datagram, 0, FRAGMENT_MAGIC, self.frame_id, index, count)
+            end = FRAGMENT.size + len(chunk)
+            self.datagram[FRAGMENT.size:end] = chunk
+            self.sock.sendto(self.datagram_view[:end], self.address)
+            self.bytes += end
+        self.datagrams += count
+        self.frames += 1
+
+
+class FrameReassembler(object):
+    """Rebuilds frames from DatagramSender datagrams of one sender."""
+
+    def __init__(self, deadline=0.2):
+        self.deadline = deadline
+        self.partial = {}       # frame id -> [first seen, count, {index: chunk}]
+        self.newest = None      # id of the newest completed frame
+        self.first_id = None
+        self.last_id = None
+        self.frames_seen = 0
+        self.completed = 0
+        self.incomplete = 0
+        self.fragments = 0
+        self.missing_fragments = 0
+        self.late = 0
+        self.malformed = 0
+
+    def is_older(self, frame_id, than):
+        """Serial-number comparison, so the 32-bit frame id may wrap."""
+        return ((frame_id - than) & 0xFFFFFFFF) >= 0x80000000
+
+    def add(self, datagram, now=None):
+        """Feed one datagram; returns the frame bytes once it is complete."""
+        if now is None:
+            now = time.time()
+        self.expire(now)
+        if len(datagram) < FRAGMENT.size:
+            self.malformed += 1
+            return None
+        magic, frame_id, index, count = FRAGMENT.unpack_from(datagram)
+        if magic != FRAGMENT_MAGIC or index >= count:
+            self.malformed += 1
+            return None
+        if self.newest is not None and not self.is_older(self.newest, frame_id):
+            self.late += 1
+            return None
+
+        self.fragments += 1
+        entry = self.partial.get(frame_id)
+        if entry is None:
+            entry = self.partial[frame_id] = [now, count, {}]
+            self.frames_seen += 1
+            if self.first_id is None:
+                self.first_id = frame_id
+            if self.last_id is None or self.is_older(self.last_id, frame_id):
+                self.last_id = frame_id
+        elif entry[1] != count:
+            # A stale or corrupt datagram under this frame id: the frame can't be trusted
+            self.malformed += 1
+            self.drop(frame_id)
+            return None
+        chunks = entry[2]
+        if index in chunks:
+            self.late += 1
+            return None
+        chunks[index] = bytes(datagram[FRAGMENT.size:])
+        if len(chunks) < count:
+            return None
+
+        del self.partial[frame_id]
+        for older in [i for i in self.partial if self.is_older(i, frame_id)]:
+            self.drop(older)
+        self.newest = frame_id
+        self.completed += 1
+        return b"".join(chunks[i] for i in range(count))
+
+    def drop(self, frame_id):
+        _, count, chunks = self.partial.pop(frame_id)
+        self.incomplete += 1
+        self.missing_fragments += count - len(chunks)
+
+    def expire(self, now):
+        for frame_id in [i for i, entry in self.partial.items()
+                         if now - entry[0] > self.deadline]:
+            self.drop(frame_id)
+
+    def never_seen(self):
+        """Frames of which not a single datagram arrived."""
+        if self.first_id is None:
+            return 0
+        return ((self.last_id - self.first_id) & 0xFFFFFFFF) + 1 - self.frames_seen
+
+    def describe(self):
+        received = self.fragments + self.missing_fragments
+        loss = 100.0 * self.missing_fragments / received if received else 0.0
+        return "udp %d complete, %d incomplete, %d never seen, %.1f%% fragments lost, %d late" % (
+            self.completed, self.incomplete, self.never_seen(), loss, self.late)
+
+
+def connect_tcp(address, timeout=2.0):
+    """Connected, blocking TCP socket; gives up after `timeout` seconds."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(address)
+    except Exception:
+        sock.close()
+        raise
+    sock.settimeout(None)
+    return sock
+
+
+class ReconnectingTransport(object):
+    """A sender from connect() that is rebuilt with backoff whenever the link fails."""
+
+    def __init__(self, connect, name="laptop", min_delay=0.5, max_delay=10.0, jitter=0.5):
+        self.connect = connect  # () -> sender; raises socket.error when unreachable
+        self.name = name
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.sender = None
+        self.failures = 0       # consecutive failed attempts
+        self.retry_at = 0.0
+        self.down_since = None
+        self.completed = collections.deque()
+        self.connects = 0
+        self.disconnects = 0
+        self.downtime = 0.0
+        self.dropped = 0
+        self.frames = 0
+        self.bytes = 0
+
+    @property
+    def connected(self):
+        return self.sender is not None
+
+    def ensure_connected(self):
+        if self.sender is not None:
+            return True
+        now = monotonic()
+        if now < self.retry_at:
+            return False
+        try:
+            self.sender = self.connect()
+        except (socket.error, OSError) as e:
+            self.failures += 1
+            delay = min(self.max_delay, self.min_delay * 2 ** (self.failures - 1))
+            delay *= 1.0 + self.jitter * (2.0 * random.random() - 1.0)
+            self.retry_at = now + delay
+            if self.failures == 1 or delay >= self.max_delay / 2.0:
+                print("[Video Sender] Cannot reach %s (%s), retrying in %.1f s" % (
+                    self.name, e, delay))
+            return False
+        if self.down_since is not None:
+            self.downtime += now - self.down_since
+            self.down_since = None
+        self.failures = 0
+        self.connects += 1
+        print("[Video Sender] Connected to %s (connect #%d)" % (self.name, self.connects))
+        return True
+
+    def lost(self, error):
+        print("[Video Sender] Lost %s: %s" % (self.name, error))
+        try:
+            self.sender.sock.close()
+        except (socket.error, OSError):
+            pass
+        self.sender = None
+        self.disconnects += 1
+        self.down_since = monotonic()
+        self.retry_at = self.down_since + self.min_delay * random.random()
+
+    def send_frame(self, payload, header=None, tag=None):
+        if not self.ensure_connected():
+            self.dropped += 1
+            return
+        started = monotonic()
+        try:
+            if hasattr(self.sender, "pump"):
+                self.sender.send_frame(payload, header, tag)
+                return
+            self.sender.send_frame(payload, header)
+        except (socket.error, OSError) as e:
+            self.lost(e)
+            self.dropped += 1
+            return
+        self.completed.append((tag, len(memoryview(payload)), monotonic() - started, time.time()))
+
+    def pump(self, timeout=0.0):
+        """Drive the current sender, or wait out the backoff; True when idle and connected."""
+        if not self.ensure_connected():
+            time.sleep(max(0.0, min(timeout, self.retry_at - monotonic())))
+            return False
+        if not hasattr(self.sender, "pump"):
+            return True
+        try:
+            return self.sender.pump(timeout)
+        except (socket.error, OSError) as e:
+            self.lost(e)
+            return False
+
+    def take_sent(self):
+        sent = []
+        while self.completed:
+            sent.append(self.completed.popleft())
+        if self.sender is not None and hasattr(self.sender, "take_sent"):
+            sent.extend(self.sender.take_sent())
+        self.frames += len(sent)
+        self.bytes += sum(size for _, size, _, _ in sent)
+        return sent
+
+    def close(self):
+        if self.sender is not None:
+            self.sender.sock.close()
+            self.sender = None
+
+    def describe(self):
+        downtime = self.downtime
+        if self.down_since is not None:
+            downtime += monotonic() - self.down_since
+        parts = ["link %s connects=%d drops=%d down=%.1f s lost frames=%d" % (
+            "up" if self.sender is not None else "DOWN", self.connects,
+            self.disconnects, downtime, self.dropped)]
+        if self.sender is not None and hasattr(self.sender, "describe"):
+            parts.append(self.sender.describe())
+        return " | ".join(parts)
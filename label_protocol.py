@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Label return path for pepper_streamer.py.
+#
+# Frames are sent without waiting for their label, so several frames can
+# be in flight at once. The laptop answers each frame with one line
+#
+#     b"<seq> <label>\n"
+#
+# naming the sequence number from the frame header. Labels may come back
+# in any order; the robot applies a label only if it is newer than the
+# last one it applied.
+#
+# The port-6000 emotion channel uses the same line with two more fields,
+# the frame's capture time and the laptop's classification time, for
+# latency tracing (see latency_histogram.py):
+#
+#     b"<seq> <label> <capture_ts> <classified_ts>\n"
+#
+# A classifier that produces class scores may append them as one more
+# field, in EMOTIONS order, for the robot's emotion aggregator:
+#
+#     b"<seq> <label> <capture_ts> <classified_ts> p=0.02,0.91,...\n"
+#
+# A bare b"<label>" from an older laptop script is still accepted.
+#
+# Instead of a text line the laptop may send a fixed-size binary
+# EMOTION_MESSAGE: an emotion code from emotion_registry.py, the
+# classifier's confidence, the frame's sequence number and the laptop's
+# classification time. It starts with EMOTION_MAGIC, which no text line
+# can start with, so both forms can share one connection; split_messages()
+# cuts a receive buffer into either kind and parse_message() reads both.
+import struct
+import threading
+
+from emotion_registry import EMOTIONS, code, name
+from stream_clock import monotonic
+
+SCORES_PREFIX = b"p="
+
+EMOTION_MAGIC = b"\xa5E"  # 0xa5 never starts a UTF-8 character
+EMOTION_VERSION = 1
+
+# magic, version, emotion code, confidence, frame seq, classification time
+EMOTION_MESSAGE = struct.Struct(">2sBBfId")
+
+
+def split_result(result):
+    """Return (label, scores) from a classifier result: a label or a score vector."""
+    if isinstance(result, (bytes, type(u""))):
+        return result, None
+    scores = [float(score) for score in result]
+    return EMOTIONS[scores.index(max(scores))], scores
+
+
+def format_label(seq, label, capture_ts=None, classified_ts=None, scores=None):
+    if not isinstance(label, bytes):
+        label = label.encode("utf-8")
+    stamps = ""
+    if capture_ts is not None:
+        stamps = " %.6f %.6f" % (capture_ts, classified_ts or 0.0)
+    if scores is not None:
+        stamps += " p=" + ",".join("%.3f" % score for score in scores)
+    return ("%d " % seq).encode("ascii") + label + stamps.encode("ascii") + b"\n"
+
+
+def parse_scores(line):
+    """Return the score vector of a label line as a list of floats, or None."""
+    for field in line.split():
+        if field.startswith(SCORES_PREFIX):
+            try:
+                return [float(score) for score in field[len(SCORES_PREFIX):].split(b",")]
+            except ValueError:
+                return None
+    return None
+
+
+def parse_timed_label(line):
+    """Return (seq, label, capture_ts, classified_ts); missing fields are None."""
+    line = line.strip()
+    fields = [field for field in line.split() if not field.startswith(SCORES_PREFIX)]
+    try:
+        seq = int(fields[0])
+    except (ValueError, IndexError):
+        return None, line.decode("utf-8", "replace"), None, None
+    label = fields[1].decode("utf-8") if len(fields) > 1 else u""
+    try:
+        capture_ts = float(fields[2]) if len(fields) > 2 else None
+        classified_ts = float(fields[3]) if len(fields) > 3 else None
+    except ValueError:
+        capture_ts = classified_ts = None
+    return seq, label, capture_ts, classified_ts
+
+
+def parse_label(line):
+    """Return (seq, label) from one line, or (None, label) for an untagged line."""
+    return parse_timed_label(line)[:2]
+
+
+def pack_emotion(emotion_code, confidence, seq, classified_ts):
+    return EMOTION_MESSAGE.pack(EMOTION_MAGIC, EMOTION_VERSION, emotion_code, confidence,
+                                seq & 0xFFFFFFFF, classified_ts)
+
+
+def split_messages(buffer):
+    """Cut complete messages off a receive buffer; returns (messages, rest).
+
+    Binary emotion messages are returned whole, text lines stripped and
+    without their newline.
+    """
+    messages = []
+    start = 0
+    while start < len(buffer):
+        if buffer[start:start + len(EMOTION_MAGIC)] == EMOTION_MAGIC:
+            end = start + EMOTION_MESSAGE.size
+            if end > len(buffer):
+                break
+            messages.append(buffer[start:end])
+            start = end
+            continue
+        newline = buffer.find(b"\n", start)
+        if newline < 0:
+            break
+        line = buffer[start:newline].strip()
+        if line:
+            messages.append(line)
+        start = newline + 1
+    return messages, buffer[start:]
+
+
+def emotion_key(message):
+    """Emotion code of a label message, or None for any other line (for admission control)."""
+    if message[:len(EMOTION_MAGIC)] == EMOTION_MAGIC and len(message) == EMOTION_MESSAGE.size:
+        return EMOTION_MESSAGE.unpack(message)[2]
+    fields = [field for field in message.split() if not field.startswith(SCORES_PREFIX)]
+    if len(fields) == 1:
+        return code(fields[0])
+    if len(fields) >= 2 and fields[0].isdigit():
+        return code(fields[1])
+    return None
+
+
+class EmotionMessage(object):
+    __slots__ = ("seq", "code", "confidence", "capture_ts", "classified_ts", "scores")
+
+    def __init__(self, seq, emotion_code, confidence=None, capture_ts=None,
+                 classified_ts=None, scores=None):
+        self.seq = seq
+        self.code = emotion_code
+        self.confidence = confidence
+        self.capture_ts = capture_ts
+        self.classified_ts = classified_ts
+        self.scores = scores
+
+    @property
+    def name(self):
+        return name(self.code)
+
+
+def parse_message(message):
+    """Parse a binary emotion message or a text label line into an EmotionMessage."""
+    if message[:len(EMOTION_MAGIC)] == EMOTION_MAGIC and len(message) == EMOTION_MESSAGE.size:
+        _, _, emotion_code, confidence, seq, classified_ts = EMOTION_MESSAGE.unpack(message)
+        return EmotionMessage(seq, code(emotion_code), confidence, None, classified_ts)
+    seq, label, capture_ts, classified_ts = parse_timed_label(message)
+    scores = parse_scores(message)
+    confidence = max(scores) if scores else None
+    return EmotionMessage(seq, code(label), confidence, capture_ts, classified_ts, scores)
+
+
+class LineReader(object):
+    """Buffered newline-delimited reads from a blocking socket."""
+
+    def __init__(self, sock, bufsize=4096):
+        self.sock = sock
+        self.bufsize = bufsize
+        self.buffer = b""
+
+    def readline(self):
+        """Return the next line without its newline, or None when the peer closed."""
+        while b"\n" not in self.buffer:
+            data = self.sock.recv(self.bufsize)
+            if not data:
+                return None
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return line
+
+
+class InFlightWindow(object):
+    """Limits how many frames may be waiting for a label.
+
+    A frame whose label never arrives gives its slot back after timeout
+    seconds, so a lost reply cannot stall the sender for good.
+    """
+
+    def __init__(self, size=4, timeout=2.0):
+        self.size = size
+        self.timeout = timeout
+        self.cond = threading.Condition()
+        self.pending = {}
+        self.expired = 0
+
+    def acquire(self, seq):
+        with self.cond:
+            while True:
+                self.expire()
+                if len(self.pending) < self.size:
+                    break
+                self.cond.wait(self.timeout / 4.0)
+            self.pending[seq] = monotonic()
+
+    def release(self, seq):
+        """Mark seq as answered; returns the round-trip time or None if unknown."""
+        with self.cond:
+            sent_at = self.pending.pop(seq, None)
+            self.cond.notify()
+        if sent_at is None:
+            return None
+        return monotonic() - sent_at
+
+    def expire(self):
+        deadline = monotonic() - self.timeout
+        for seq in [s for s, t in self.pending.items() if t < deadline]:
+            del self.pending[seq]
+            self.expired += 1
+
+    def depth(self):
+        with self.cond:
+            return len(self.pending)
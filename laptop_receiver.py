@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+# Reference laptop-side receiver for the LAPTOP_PORT video stream (Python 3).
+#
+# Accepts any number of robot streams on LAPTOP_PORT, decodes frames on a
+# thread pool, runs a pluggable classifier and sends each label back to the
+# robot's PEPPER_RECEIVE_PORT. Each stream only ever keeps the newest
+# undecoded frame: if frames arrive faster than they can be classified the
+# older ones are dropped instead of building a backlog.
+#
+# With --udp the same port also takes the datagram transport
+# (frame_transport.DatagramSender); each robot address becomes a stream
+# whose frames are reassembled before they join the same path.
+#
+# Labels go out newline-terminated over one persistent connection per
+# robot. Frames with an extended header are answered with their sequence
+# number, capture time and classification time (label_protocol.py), so the
+# robot can trace the frame's latency; plain JPEG frames get a bare label.
+# Clock pings from the robot (clock_sync.py) are answered on the same label
+# channel, and the robot's offset estimate they carry puts capture times on
+# the laptop clock for the end-to-end figure.
+# Older robot scripts close the connection after every message; the
+# channel notices the close and reconnects for the next label, so it also
+# works (at one connection per label) with those.
+#
+#   python3 laptop_receiver.py --classifier my_model:EmotionClassifier
+#
+# A classifier is any class with a classify(image) -> label method, where
+# image is the decoded BGR (or grayscale) numpy array. It may return a
+# score vector in label_protocol.EMOTIONS order instead of a label; the
+# best class is sent as the label and the scores go along for the robot's
+# emotion aggregator. Classifiers that also have classify_batch(images)
+# -> labels can be fed micro-batches from all streams at once with
+# --batch-size (see micro_batcher.py). Since each stream has at most one
+# frame being classified, a batch holds at most one frame per robot; on a
+# CPU this only beats per-frame calls from about 20 robots on (see
+# bench_batching.py), so batching is off by default.
+#
+# With --binary-labels, extended frames are answered with the fixed-size
+# binary emotion message (emotion code, confidence, seq, classification
+# time) instead of a text line; the robot accepts both.
+import argparse
+import asyncio
+import importlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from clock_sync import format_pong, is_ping, parse_ping
+from frame_header import LENGTH, decode_frame
+from frame_transport import FrameReassembler
+from emotion_registry import code
+from label_protocol import format_label, pack_emotion, split_result
+from micro_batcher import MicroBatcher
+
+LAPTOP_PORT = 5000
+PEPPER_RECEIVE_PORT = 6000
+UDP_IDLE_TIMEOUT = 5.0  # seconds without datagrams before a UDP stream is closed
+
+
+class NeutralClassifier(object):
+    """Placeholder that always answers neutral; replace with the real model."""
+
+    def classify(self, image):
+        return "neutral"
+
+
+def load_classifier(spec):
+    """Instantiate a classifier from a "module:ClassName" string."""
+    module_name, _, class_name = spec.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name or "Classifier")()
+
+
+class StreamStats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.window_start = time.monotonic()
+        self.frames = 0
+        self.dropped = 0
+        self.decode_time = 0.0
+        self.classify_time = 0.0
+        self.turnaround = 0.0       # frame received -> label sent, laptop clock only
+        self.latency = 0.0          # capture_ts -> label sent, across hosts
+        self.latency_frames = 0
+        self.latency_max = 0.0
+
+    def describe(self):
+        elapsed = time.monotonic() - self.window_start
+        frames = max(self.frames, 1)
+        text = "%.1f fps, drop=%d, decode %.1f ms, classify %.1f ms, turnaround %.1f ms" % (
+            self.frames / elapsed, self.dropped, 1000.0 * self.decode_time / frames,
+            1000.0 * self.classify_time / frames, 1000.0 * self.turnaround / frames)
+        if self.latency_frames:
+            text += ", end-to-end %.0f ms (max %.0f)" % (
+                1000.0 * self.latency / self.latency_frames, 1000.0 * self.latency_max)
+        return text
+
+
+class LabelChannel(object):
+    """Persistent, reconnecting connection to one robot's emotion port."""
+
+    def __init__(self, host, port, retry_delay=1.0):
+        self.host = host
+        self.port = port
+        self.retry_delay = retry_delay
+        self.reader = None
+        self.writer = None
+        self.retry_at = 0.0
+        self.connects = 0
+        self.sent = 0
+        self.failed = 0
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.connects += 1
+        asyncio.ensure_future(self.watch(self.reader, self.writer))
+
+    async def watch(self, reader, writer):
+        """Drop the connection as soon as the robot closes its side."""
+        try:
+            while await reader.read(1024):
+                pass
+        except (ConnectionError, OSError):
+            pass
+        if self.writer is writer:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    async def send(self, message):
+        """Send bytes, or the result of calling message right before the write."""
+        async with self.lock:
+            for _ in range(2):
+                if self.writer is None:
+                    if time.monotonic() < self.retry_at:
+                        break
+                    try:
+                        await self.connect()
+                    except (ConnectionError, OSError) as e:
+                        print("[Labels] Cannot reach %s:%d: %s" % (self.host, self.port, e))
+                        self.retry_at = time.monotonic() + self.retry_delay
+                        break
+                try:
+                    self.writer.write(message() if callable(message) else message)
+                    await self.writer.drain()
+                    self.sent += 1
+                    return True
+                except (ConnectionError, OSError):
+                    self.close()
+            self.failed += 1
+            return False
+
+
+class RobotStream(object):
+    def __init__(self, receiver, peer, reassembler=None):
+        self.receiver = receiver
+        self.name = "%s:%d" % (peer[0], peer[1])
+        self.channel = receiver.label_channel(peer[0])
+        self.reassembler = reassembler
+        self.stats = StreamStats()
+        self.pending = None
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.clock_offset = 0.0     # laptop minus robot, as estimated by the robot
+        self.last_data = time.monotonic()
+
+    def push(self, data):
+        """Take one complete frame (or clock ping) off the wire."""
+        self.last_data = time.monotonic()
+        if is_ping(data):
+            self.answer_ping(data, time.time())
+            return
+        if self.pending is not None:
+            self.stats.dropped += 1
+        self.pending = (data, time.monotonic(), time.time())
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    async def read_frames(self, reader, writer):
+        try:
+            while True:
+                prefix = await reader.readexactly(LENGTH.size)
+                self.push(await reader.readexactly(LENGTH.unpack(prefix)[0]))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            self.close()
+            writer.close()
+
+    def answer_ping(self, data, received):
+        ping_id, sent, offset = parse_ping(data)
+        if offset is not None:
+            self.clock_offset = offset
+        asyncio.ensure_future(self.channel.send(
+            lambda: format_pong(ping_id, sent, received, time.time())))
+
+    async def process_frames(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            if self.pending is None:
+                if self.closed:
+                    return
+                continue
+            data, received, received_wall = self.pending
+            self.pending = None
+
+            started = time.monotonic()
+            try:
+                header, image = await loop.run_in_executor(self.receiver.pool, decode_frame, data)
+            except ValueError as e:
+                print("[Receiver] %s: bad frame: %s" % (self.name, e))
+                continue
+            decoded = time.monotonic()
+            try:
+                label, scores = split_result(await self.receiver.classify(image))
+            except Exception as e:  # one bad frame must not stop this robot's stream
+                print("[Receiver] %s: classifier error: %s" % (self.name, e))
+                continue
+            if isinstance(label, bytes):
+                label = label.decode("utf-8")
+            classified = time.monotonic()
+            if header is not None and self.receiver.binary_labels:
+                message = pack_emotion(code(label), max(scores) if scores else 1.0,
+                                       header.seq, time.time())
+            elif header is not None:
+                message = format_label(header.seq, label, header.capture_ts, time.time(), scores)
+            else:
+                message = label.encode("utf-8") + b"\n"
+            await self.channel.send(message)
+
+            stats = self.stats
+            stats.frames += 1
+            stats.decode_time += decoded - started
+            stats.classify_time += classified - decoded
+            stats.turnaround += time.monotonic() - received
+            if header is not None and header.capture_ts:
+                latency = (received_wall + (time.monotonic() - received)
+                           - header.capture_ts - self.clock_offset)
+                stats.latency += latency
+                stats.latency_frames += 1
+                stats.latency_max = max(stats.latency_max, latency)
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver):
+        self.receiver = receiver
+
+    def datagram_received(self, data, addr):
+        self.receiver.datagram_received(data, addr)
+
+
+class FrameReceiver(object):
+    def __init__(self, classifier, robot_port=PEPPER_RECEIVE_PORT, workers=4,
+                 report_interval=5.0, batch_size=1, batch_wait=0.002, udp_deadline=0.2,
+                 binary_labels=False):
+        self.classifier = classifier
+        self.binary_labels = binary_labels
+        self.udp_deadline = udp_deadline
+        self.udp_streams = {}
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.batcher = None
+        self.robot_port = robot_port
+        self.report_interval = report_interval
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(workers)
+        self.streams = set()
+        self.channels = {}
+
+    async def classify(self, image):
+        if self.batcher is not None:
+            return await self.batcher.submit(image)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool, self.classifier.classify, image)
+
+    def label_channel(self, host):
+        if host not in self.channels:
+            self.channels[host] = LabelChannel(host, self.robot_port)
+        return self.channels[host]
+
+    async def handle(self, reader, writer):
+        stream = RobotStream(self, writer.get_extra_info("peername"))
+        self.streams.add(stream)
+        print("[Receiver] Stream from %s" % stream.name)
+        try:
+            await asyncio.gather(stream.read_frames(reader, writer), stream.process_frames())
+        finally:
+            self.streams.discard(stream)
+            print("[Receiver] Stream from %s closed" % stream.name)
+
+    def datagram_received(self, data, addr):
+        stream = self.udp_streams.get(addr)
+        if stream is None:
+            stream = RobotStream(self, addr, FrameReassembler(self.udp_deadline))
+            self.udp_streams[addr] = stream
+            asyncio.ensure_future(self.run_datagram_stream(addr, stream))
+        frame = stream.reassembler.add(data)
+        if frame is not None:
+            stream.push(frame)
+
+    async def run_datagram_stream(self, addr, stream):
+        self.streams.add(stream)
+        print("[Receiver] UDP stream from %s" % stream.name)
+        try:
+            await stream.process_frames()
+        finally:
+            self.streams.discard(stream)
+            del self.udp_streams[addr]
+            print("[Receiver] UDP stream from %s closed: %s" % (
+                stream.name, stream.reassembler.describe()))
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            for stream in list(self.streams):
+                print("[Receiver] %s: %s, labels sent=%d failed=%d connects=%d" % (
+                    stream.name, stream.stats.describe(), stream.channel.sent,
+                    stream.channel.failed, stream.channel.connects))
+                if stream.reassembler:
+                    print("[Receiver] %s: %s" % (stream.name, stream.reassembler.describe()))
+                    if time.monotonic() - stream.last_data > UDP_IDLE_TIMEOUT:
+                        stream.close()
+                stream.stats.reset()
+            if self.batcher is not None:
+                print("[Receiver] Batching: %s" % self.batcher.stats.describe())
+                self.batcher.stats.reset()
+
+    async def serve(self, host="0.0.0.0", port=LAPTOP_PORT, udp=False):
+        if self.batch_size > 1:
+            self.batcher = MicroBatcher(self.classifier, self.pool, self.batch_size,
+                                        self.batch_wait, concurrency=self.workers)
+            self.batcher.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print("[Receiver] Listening on %s:%d" % (host, port))
+        if udp:
+            loop = asyncio.get_event_loop()
+            await loop.create_datagram_endpoint(
+                lambda: DatagramProtocol(self), local_addr=(host, port))
+            print("[Receiver] Listening for UDP frames on %s:%d" % (host, port))
+        asyncio.ensure_future(self.report())
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Laptop-side Pepper video receiver")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=LAPTOP_PORT)
+    parser.add_argument("--robot-port", type=int, default=PEPPER_RECEIVE_PORT,
+                        help="emotion port on the robot")
+    parser.add_argument("--workers", type=int, default=4, help="decode/classify threads")
+    parser.add_argument("--classifier", help="module:Class, default answers neutral")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="classify up to this many frames per call (1 = no batching); "
+                             "pays off with many robots only")
+    parser.add_argument("--batch-wait", type=float, default=0.002,
+                        help="longest a frame waits for its batch to fill, seconds")
+    parser.add_argument("--udp", action="store_true",
+                        help="also accept the UDP datagram transport on --port")
+    parser.add_argument("--udp-deadline", type=float, default=0.2,
+                        help="seconds to wait for the rest of a fragmented frame")
+    parser.add_argument("--binary-labels", action="store_true",
+                        help="answer with binary emotion messages instead of text lines")
+    parser.add_argument("--report-interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    classifier = load_classifier(args.classifier) if args.classifier else NeutralClassifier()
+    receiver = FrameReceiver(classifier, args.robot_port, args.workers, args.report_interval,
+                             args.batch_size, args.batch_wait, args.udp_deadline,
+                             args.binary_labels)
+    try:
+        asyncio.run(receiver.serve(args.host, args.port, args.udp))
+    except KeyboardInterrupt:
+        print("Interrupted by user, exiting...")
+
+
+if __name__ == "__main__":
+    main()
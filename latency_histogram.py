@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# Glass-to-voice latency tracing on the robot.
+#
+# Every frame carries its NAOqi capture time and sequence number in the
+# frame header, and the laptop echoes both back with the emotion label
+# together with the time it classified the frame. LatencyTracker joins
+# that with the encode and send times the pipeline noted for the same
+# sequence number and with the moment speech starts, and files each hop
+# into a fixed-bucket histogram:
+#
+#   capture -> encode -> send -> classify -> receive -> speech
+#
+# send->classify and classify->receive compare robot and laptop clocks;
+# pass a clock_sync.ClockSync to correct them with the measured offset, or
+# set a fixed clock_offset (laptop minus robot, seconds).
+#
+# Histograms are printed by dump(), and on SIGUSR1 once install_signal()
+# has been called from the main thread:
+#
+#   kill -USR1 <pid of the robot script>
+import bisect
+import collections
+import signal
+import sys
+import threading
+import time
+
+# Upper bucket edges in milliseconds; anything slower lands in the overflow bucket
+BUCKETS_MS = (5, 10, 20, 50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000)
+
+STAGES = (
+    "capture->encode",
+    "encode->send",
+    "send->classify",
+    "classify->receive",
+    "receive->speech",
+    "capture->receive",
+    "capture->speech",
+)
+
+
+class LatencyHistogram(object):
+    def __init__(self, name, buckets=BUCKETS_MS):
+        self.name = name
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        ms = 1000.0 * seconds
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, fraction):
+        """Upper edge of the bucket holding the given fraction of samples, in ms."""
+        target = fraction * self.count
+        seen = 0
+        for edge, count in zip(self.buckets, self.counts):
+            seen += count
+            if count and seen >= target:
+                return edge
+        return self.max
+
+    def format(self):
+        if not self.count:
+            return "%-18s no samples" % self.name
+        cells = ["<=%g:%d" % (edge, count)
+                 for edge, count in zip(self.buckets, self.counts) if count]
+        if self.counts[-1]:
+            cells.append(">%g:%d" % (self.buckets[-1], self.counts[-1]))
+        return "%-18s n=%d mean %.0f p50<=%g p90<=%g p99<=%g max %.0f ms | %s" % (
+            self.name, self.count, self.total / self.count, self.percentile(0.5),
+            self.percentile(0.9), self.percentile(0.99), self.max, " ".join(cells))
+
+
+class LatencyTracker(object):
+    """Collects per-hop latencies of frames whose labels came back."""
+
+    def __init__(self, max_pending=256, clock_offset=0.0, clock=None):
+        self.max_pending = max_pending
+        self.clock_offset = clock_offset
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.histograms = collections.OrderedDict(
+            (stage, LatencyHistogram(stage)) for stage in STAGES)
+
+    def record(self, stage, seconds):
+        with self.lock:
+            self.histograms[stage].record(seconds)
+
+    def frame_sent(self, seq, capture_ts, encoded_ts, sent_ts):
+        """Called by the video pipeline once a frame is on the wire."""
+        with self.lock:
+            self.pending[seq] = (capture_ts, encoded_ts, sent_ts)
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+
+    def label_received(self, seq, capture_ts=None, classified_ts=None, received_ts=None):
+        """Record the hops up to label arrival; returns a trace for speech_started()."""
+        if received_ts is None:
+            received_ts = time.time()
+        with self.lock:
+            sent = self.pending.pop(seq, None) if seq is not None else None
+        if sent is not None:
+            capture_ts = capture_ts or sent[0]
+            self.record("capture->encode", sent[1] - sent[0])
+            self.record("encode->send", sent[2] - sent[1])
+        if not capture_ts:
+            return None
+        if classified_ts:
+            offset = self.clock.offset(received_ts) if self.clock else None
+            if offset is None:
+                offset = self.clock_offset
+            classified_local = classified_ts - offset
+            if sent is not None:
+                self.record("send->classify", classified_local - sent[2])
+            self.record("classify->receive", received_ts - classified_local)
+        self.record("capture->receive", received_ts - capture_ts)
+        return (capture_ts, received_ts)
+
+    def speech_started(self, trace, started_ts=None):
+        if trace is None:
+            return
+        if started_ts is None:
+            started_ts = time.time()
+        capture_ts, received_ts = trace
+        self.record("receive->speech", started_ts - received_ts)
+        self.record("capture->speech", started_ts - capture_ts)
+
+    def dump(self, out=None):
+        out = out or sys.stdout
+        with self.lock:
+            lines = [histogram.format() for histogram in self.histograms.values()]
+        if self.clock:
+            out.write("[Latency] %s\n" % self.clock.describe())
+        else:
+            out.write("[Latency] clock offset %.1f ms\n" % (1000.0 * self.clock_offset))
+        for line in lines:
+            out.write("[Latency] %s\n" % line)
+        out.flush()
+
+    def install_signal(self, signum=getattr(signal, "SIGUSR1", None)):
+        """Dump the histograms whenever the process receives signum."""
+        if signum is not None:
+            signal.signal(signum, lambda *args: self.dump())
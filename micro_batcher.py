@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Micro-batching in front of the classifier (laptop side, Python 3).
+#
+# Streams submit decoded frames one by one and await their label. The
+# batcher collects frames until it has max_batch of them or the oldest has
+# waited max_wait seconds, then runs one classify_batch() call on the
+# worker pool. With several robots streaming, or a burst after a WiFi
+# stall, this replaces many small inferences by a few vectorized ones.
+#
+# At most `concurrency` batches run at once, and a new batch only starts
+# collecting once one of them has finished. Frames arriving while every
+# worker is busy therefore pile up and go out together: batches grow with
+# the load instead of every frame paying the full max_wait.
+#
+# A batch classifier has classify_batch(images) -> labels. Classifiers that
+# only have classify(image) are wrapped and run frame by frame.
+import asyncio
+import time
+
+
+def classify_batch_fn(classifier):
+    """Return a callable mapping a list of images to a list of labels."""
+    if hasattr(classifier, "classify_batch"):
+        return classifier.classify_batch
+    return lambda images: [classifier.classify(image) for image in images]
+
+
+class BatchStats(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.batches = 0
+        self.frames = 0
+        self.max_size = 0
+        self.wait_time = 0.0        # submit -> batch start, summed over frames
+        self.infer_time = 0.0       # summed over batches
+
+    def record(self, size, wait_time, infer_time):
+        self.batches += 1
+        self.frames += size
+        self.max_size = max(self.max_size, size)
+        self.wait_time += wait_time
+        self.infer_time += infer_time
+
+    def describe(self):
+        if not self.batches:
+            return "no batches"
+        return "%d batches, size %.1f avg %d max, wait %.1f ms, infer %.1f ms/batch %.2f ms/frame" % (
+            self.batches, float(self.frames) / self.batches, self.max_size,
+            1000.0 * self.wait_time / self.frames, 1000.0 * self.infer_time / self.batches,
+            1000.0 * self.infer_time / self.frames)
+
+
+class MicroBatcher(object):
+    def __init__(self, classifier, pool=None, max_batch=8, max_wait=0.002, concurrency=1):
+        self.classify_batch = classify_batch_fn(classifier)
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.concurrency = concurrency
+        self.queue = asyncio.Queue()
+        self.stats = BatchStats()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def submit(self, image):
+        """Queue one image and wait for its label."""
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((image, future, time.monotonic()))
+        return await future
+
+    async def collect(self):
+        """Wait for the first frame, then fill the batch until it is full or due."""
+        loop = asyncio.get_event_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        slots = asyncio.Semaphore(self.concurrency)
+        while True:
+            await slots.acquire()
+            batch = await self.collect()
+            asyncio.ensure_future(self.infer(batch, slots))
+
+    async def infer(self, batch, slots):
+        loop = asyncio.get_event_loop()
+        started = time.monotonic()
+        images = [image for image, _, _ in batch]
+        try:
+            labels = await loop.run_in_executor(self.pool, self.classify_batch, images)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            slots.release()
+        finished = time.monotonic()
+        if len(labels) != len(batch):
+            error = ValueError("classify_batch returned %d labels for %d frames" % (
+                len(labels), len(batch)))
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        self.stats.record(len(batch), sum(started - queued for _, _, queued in batch),
+                          finished - started)
+        for (_, future, _), label in zip(batch, labels):
+            if not future.done():
+                future.set_result(label)
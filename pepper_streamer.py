@@ -3,10 +3,14 @@ import socket
 import naoqi
 from naoqi import ALProxy
 import numpy as np
-import cv2
+import threading
 import time
-import struct
-import pickle
+
+from camera_source import CAPTURE_PROFILES
+from frame_header import CODEC_JPEG, CODEC_RAW, PIXEL_BGR, PIXEL_GRAY, encode_image
+from frame_pacer import FramePacer
+from frame_transport import FrameSender
+from label_protocol import InFlightWindow, LineReader, parse_label
 
 PEPPER_IP = "192.168.1.100"  # Replace with Pepper's IP
 PEPPER_PORT = 9559
@@ -17,8 +21,11 @@ SERVER_PORT = 9999
 video_proxy = ALProxy("ALVideoDevice", PEPPER_IP, PEPPER_PORT)
 mem_proxy = ALProxy("ALMemory", PEPPER_IP, PEPPER_PORT)
 
-resolution = 2  # 640x480
-color_space = 11  # RGB
+capture_profile = "viewer"  # "viewer": 640x480 BGR, "classifier": 320x240 luminance only
+resolution, color_space = CAPTURE_PROFILES[capture_profile]
+stream_codec = CODEC_JPEG  # or CODEC_RAW to send the uncompressed camera buffer
+fps = 10
+window_size = 4  # frames allowed in flight before we wait for labels
 
 # Subscribe to camera
 capture_name = "EmotionFeed"
@@ -28,34 +35,75 @@ capture_id = video_proxy.subscribeCamera(capture_name, 0, resolution, color_spac
 # Connect to emotion server
 client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 client_socket.connect((SERVER_IP, SERVER_PORT))
+sender = FrameSender(client_socket)
+window = InFlightWindow(window_size)
+seq = 0
+
+
+def label_reader():
+    """Apply labels as they arrive, skipping any older than the last one applied."""
+    reader = LineReader(client_socket)
+    latest_seq = 0
+    stale = 0
+    try:
+        while True:
+            line = reader.readline()
+            if line is None:
+                print("[Labels] Server closed the connection")
+                break
+            label_seq, label = parse_label(line)
+            if label_seq is None:
+                continue
+            rtt = window.release(label_seq)
+            if label_seq <= latest_seq:
+                stale += 1
+                continue
+            latest_seq = label_seq
+            if rtt is not None:
+                print("Received Emotion: %s (frame %d, %.0f ms, %d stale dropped)" % (
+                    label, label_seq, 1000.0 * rtt, stale))
+            else:
+                print("Received Emotion: %s (frame %d)" % (label, label_seq))
+
+            # Update ALMemory (for your adaptive storytelling)
+            mem_proxy.insertData("DetectedEmotion", label)
+    except Exception as e:
+        print("[Labels] Error:", e)
+
+
+reader_thread = threading.Thread(target=label_reader)
+reader_thread.setDaemon(True)
+reader_thread.start()
 
 try:
-    while True:
+    pacer = FramePacer(fps)
+    while reader_thread.is_alive():
+        pacer.wait()
+
         # Capture frame
         nao_image = video_proxy.getImageRemote(capture_id)
 
         width = nao_image[0]
         height = nao_image[1]
+        layers = nao_image[2]
         array = nao_image[6]
+        capture_ts = nao_image[4] + nao_image[5] * 1e-6
 
-        frame = np.frombuffer(array, dtype=np.uint8).reshape((height, width, 3))
-        bgr_frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-
-        # Serialize image
-        data = pickle.dumps(bgr_frame)
-        size = struct.pack("L", len(data))  # For Python 3.10+, use "Q" instead of "L"
-
-        # Send to PC
-        client_socket.sendall(size + data)
-
-        # Receive emotion label
-        label = client_socket.recv(1024)
-        print("Received Emotion:", label)
-
-        # Update ALMemory (for your adaptive storytelling)
-        mem_proxy.insertData("DetectedEmotion", label)
+        if stream_codec == CODEC_RAW:
+            payload = array  # camera bytes straight from NAOqi, no conversion
+        else:
+            shape = (height, width, layers) if layers > 1 else (height, width)
+            frame = np.frombuffer(array, dtype=np.uint8).reshape(shape)
+            payload = encode_image(frame, stream_codec)
 
-        time.sleep(0.1)
+        # Send to PC as a typed binary frame (see frame_header.py); the
+        # label comes back later on the reader thread
+        seq += 1
+        window.acquire(seq)
+        sender.send_frame(payload, {
+            "seq": seq, "frame_w": width, "frame_h": height, "capture_ts": capture_ts,
+            "pixel_format": PIXEL_BGR if layers > 1 else PIXEL_GRAY, "codec": stream_codec,
+        })
 
 except Exception as e:
     print("[ERROR]", e)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# Closed-loop JPEG quality / capture resolution control for the video stream.
+#
+# The send stage reports how many bytes each frame had and how long
+# the send took. Once per window the controller compares the measured
+# bandwidth and send latency with the configured budget and moves one
+# step down (lower quality first, then a smaller resolution) when over
+# budget, or one step up when there has been clear headroom for several
+# windows in a row. The dead band between the two thresholds and the
+# required run of good windows keep the settings from flapping.
+#
+# It starts at the quality of the fixed-quality stream (95, cv2's default)
+# so an unloaded link looks the same as without it. A resolution step
+# moves the quality only one step the other way, not to the opposite end
+# of its range: after dropping to a smaller resolution the quality climbs
+# back step by step as headroom allows, and after moving up it comes down
+# the same way, instead of swinging between the extremes.
+import threading
+
+from stream_clock import monotonic
+
+# ALVideoDevice resolutions, smallest first
+RESOLUTIONS = [0, 1, 2]  # kQQVGA 160x120, kQVGA 320x240, kVGA 640x480
+
+
+class AdaptiveQualityController(object):
+    def __init__(self, resolution=2, target_bandwidth=400 * 1024, latency_budget=0.1,
+                 quality=95, min_quality=30, max_quality=95, quality_step=10,
+                 window=1.0, headroom=0.6, upgrade_after=3):
+        self.lock = threading.Lock()
+        self.target_bandwidth = target_bandwidth  # bytes per second
+        self.latency_budget = latency_budget      # seconds per frame send
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.quality_step = quality_step
+        self.window = window
+        self.headroom = headroom
+        self.upgrade_after = upgrade_after
+
+        self.quality = quality
+        self.resolution = resolution
+        self.max_resolution = resolution
+        self.good_windows = 0
+        self.changes = 0
+
+        self.window_start = monotonic()
+        self.window_bytes = 0
+        self.window_frames = 0
+        self.window_send_time = 0.0
+        self.bandwidth = 0.0
+        self.latency = 0.0
+
+    def observe(self, nbytes, send_time):
+        """Record one sent frame; re-evaluate the settings once per window."""
+        with self.lock:
+            self.window_bytes += nbytes
+            self.window_frames += 1
+            self.window_send_time += send_time
+            now = monotonic()
+            elapsed = now - self.window_start
+            if elapsed >= self.window:
+                self.evaluate(elapsed)
+                self.window_start = now
+                self.window_bytes = 0
+                self.window_frames = 0
+                self.window_send_time = 0.0
+
+    def evaluate(self, elapsed):
+        self.bandwidth = self.window_bytes / elapsed
+        self.latency = self.window_send_time / self.window_frames
+
+        over = self.bandwidth > self.target_bandwidth or self.latency > self.latency_budget
+        under = (self.bandwidth < self.headroom * self.target_bandwidth and
+                 self.latency < self.headroom * self.latency_budget)
+
+        if over:
+            self.good_windows = 0
+            self.degrade()
+        elif under:
+            self.good_windows += 1
+            if self.good_windows >= self.upgrade_after:
+                self.good_windows = 0
+                self.upgrade()
+        else:
+            self.good_windows = 0
+
+    def degrade(self):
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, self.quality - self.quality_step)
+        elif self.resolution > RESOLUTIONS[0]:
+            self.resolution -= 1
+            self.quality = min(self.max_quality, self.quality + self.quality_step)
+        else:
+            return
+        self.changes += 1
+        print("[Quality] Over budget (%.0f KB/s, %.0f ms): quality=%d resolution=%d" % (
+            self.bandwidth / 1024.0, 1000.0 * self.latency, self.quality, self.resolution))
+
+    def upgrade(self):
+        if self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + self.quality_step)
+        elif self.resolution < self.max_resolution:
+            self.resolution += 1
+            self.quality = max(self.min_quality, self.quality - self.quality_step)
+        else:
+            return
+        self.changes += 1
+        print("[Quality] Headroom (%.0f KB/s, %.0f ms): quality=%d resolution=%d" % (
+            self.bandwidth / 1024.0, 1000.0 * self.latency, self.quality, self.resolution))
+
+    def settings(self):
+        """Return (jpeg quality, ALVideoDevice resolution) to use for the next frame."""
+        with self.lock:
+            return self.quality, self.resolution
+
+    def describe(self):
+        with self.lock:
+            return "q=%d res=%d %.0f KB/s %.0f ms" % (
+                self.quality, self.resolution, self.bandwidth / 1024.0, 1000.0 * self.latency)
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+# Session recording and replay.
+#
+# A session is a directory of segments. Each segment is a pair of files:
+#
+#   segment-00000.dat  record payloads, appended back to back
+#   segment-00000.idx  one fixed-size INDEX entry per record
+#
+# Records are camera frames (stored JPEG or raw, with the NAOqi
+# image[4]/image[5] capture time), received emotion messages exactly as
+# they came in (text line or binary, so seq, timestamps and scores are
+# kept) and speech decisions. Sessions recorded in the same second get a
+# -2, -3, ... suffix. SessionRecorder does all encoding and file I/O on a background
+# thread; the capture and receiver threads only enqueue references, and
+# frames and events are dropped (and counted) rather than blocking when
+# the writer falls behind.
+# SessionReader memory-maps the segments so replay reads payloads straight
+# from the page cache.
+#
+# Command line:
+#   python session_recorder.py info sessions/20250101-120000
+#   python session_recorder.py emotions sessions/20250101-120000 --port 6000 --speed 4
+import argparse
+import errno
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+
+try:
+    import queue
+except ImportError:  # Python 2.7
+    import Queue as queue
+
+import cv2
+import numpy as np
+
+from camera_source import CameraSource, make_image
+from frame_header import CODEC_JPEG, CODEC_RAW, encode_image
+from label_protocol import parse_message
+from stream_clock import monotonic
+
+KIND_FRAME = 1
+KIND_EMOTION = 2
+KIND_SPEECH = 3
+KIND_NAMES = {KIND_FRAME: "frame", KIND_EMOTION: "emotion", KIND_SPEECH: "speech"}
+
+# kind, codec, layers, pad, color_space, width, height,
+# timestamp (local time.time()), capture_ts (NAOqi clock), offset, length
+INDEX = struct.Struct("<BBBxHHHddQI")
+
+SEGMENT_SIZE = 256 * 1024 * 1024
+
+
+class Record(object):
+    __slots__ = ("kind", "codec", "layers", "color_space", "width", "height",
+                 "timestamp", "capture_ts", "data")
+
+    def __init__(self, kind, codec, layers, color_space, width, height,
+                 timestamp, capture_ts, data):
+        self.kind = kind
+        self.codec = codec
+        self.layers = layers
+        self.color_space = color_space
+        self.width = width
+        self.height = height
+        self.timestamp = timestamp
+        self.capture_ts = capture_ts
+        self.data = data
+
+    def image(self):
+        """Decode a frame record into a numpy image."""
+        buf = np.frombuffer(self.data, np.uint8)
+        if self.codec == CODEC_JPEG:
+            flags = cv2.IMREAD_GRAYSCALE if self.layers == 1 else cv2.IMREAD_COLOR
+            return cv2.imdecode(buf, flags)
+        shape = (self.height, self.width)
+        if self.layers > 1:
+            shape += (self.layers,)
+        return buf.reshape(shape)
+
+    def text(self):
+        return bytes(self.data).decode("utf-8")
+
+
+def create_session_dir(root):
+    """Create and return a new directory under root named after the current time."""
+    try:
+        os.makedirs(root)
+    except OSError:
+        if not os.path.isdir(root):
+            raise
+    base = os.path.join(root, time.strftime("%Y%m%d-%H%M%S"))
+    path = base
+    attempt = 1
+    while True:
+        try:
+            os.mkdir(path)
+            return path
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        attempt += 1
+        path = "%s-%d" % (base, attempt)
+
+
+class SessionRecorder(object):
+    def __init__(self, root="sessions", codec=CODEC_JPEG, quality=80,
+                 segment_size=SEGMENT_SIZE, queue_size=64, flush_interval=1.0):
+        self.path = create_session_dir(root)
+        self.codec = codec
+        self.quality = quality
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(queue_size)
+
+        self.segment = -1
+        self.data_file = None
+        self.index_file = None
+        self.offset = 0
+        self.records = 0
+        self.dropped_frames = 0
+        self.dropped_events = 0
+
+        self.thread = threading.Thread(target=self.writer_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        print("[Recorder] Recording session to %s" % self.path)
+
+    # --- Producer side (called from the capture/receiver threads) -------
+
+    def record_frame(self, image):
+        """Queue a getImageRemote()-style image; never blocks."""
+        capture_ts = image[4] + image[5] * 1e-6
+        try:
+            self.queue.put_nowait((KIND_FRAME, time.time(), capture_ts, image))
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def record_emotion(self, message):
+        """Queue a received emotion message (text line or binary); never blocks."""
+        self.put_event((KIND_EMOTION, time.time(), 0.0, message))
+
+    def record_speech(self, sentence_index, emotion, text):
+        """Queue a speech decision; never blocks."""
+        decision = {"sentence": sentence_index, "emotion": emotion, "text": text}
+        self.put_event((KIND_SPEECH, time.time(), 0.0, decision))
+
+    def put_event(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped_events += 1
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join(5.0)
+
+    # --- Writer thread ----------------------------------------------------
+
+    def open_segment(self):
+        self.close_segment()
+        self.segment += 1
+        base = os.path.join(self.path, "segment-%05d" % self.segment)
+        self.data_file = open(base + ".dat", "wb")
+        self.index_file = open(base + ".idx", "wb")
+        self.offset = 0
+
+    def close_segment(self):
+        if self.data_file is not None:
+            self.data_file.close()
+            self.index_file.close()
+            self.data_file = None
+            self.index_file = None
+
+    def write(self, kind, timestamp, capture_ts, item):
+        codec, layers, color_space, width, height = CODEC_RAW, 0, 0, 0, 0
+        if kind == KIND_FRAME:
+            width, height, layers, color_space = item[0], item[1], item[2], item[3]
+            data = item[6]
+            if self.codec == CODEC_JPEG:
+                shape = (height, width, layers) if layers > 1 else (height, width)
+                frame = np.frombuffer(data, np.uint8).reshape(shape)
+                data = encode_image(frame, CODEC_JPEG, self.quality)
+                codec = CODEC_JPEG
+        elif kind == KIND_SPEECH:
+            data = json.dumps(item).encode("utf-8")
+        else:
+            data = item if isinstance(item, bytes) else item.encode("utf-8")
+
+        view = memoryview(data)
+        length = len(view) * view.itemsize
+        if self.data_file is None or self.offset + length > self.segment_size:
+            self.open_segment()
+        self.data_file.write(data)
+        self.index_file.write(INDEX.pack(kind, codec, layers, color_space, width, height,
+                                         timestamp, capture_ts, self.offset, length))
+        self.offset += length
+        self.records += 1
+
+    def writer_loop(self):
+        last_flush = monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                try:
+                    self.write(*item)
+                except Exception as e:
+                    print("[Recorder] Write error:", e)
+            now = monotonic()
+            if self.data_file is not None and now - last_flush >= self.flush_interval:
+                self.data_file.flush()
+                self.index_file.flush()
+                last_flush = now
+        self.close_segment()
+        print("[Recorder] Closed %s: %d records, %d frames and %d events dropped" % (
+            self.path, self.records, self.dropped_frames, self.dropped_events))
+
+
+class SessionReader(object):
+    """Memory-mapped read access to a recorded session, in time order."""
+
+    def __init__(self, path):
+        self.path = path
+        self.maps = []
+        self.files = []
+        self.records = []
+        segment = 0
+        while True:
+            base = os.path.join(path, "segment-%05d" % segment)
+            if not os.path.exists(base + ".idx"):
+                break
+            self.load_segment(base)
+            segment += 1
+        self.records.sort(key=lambda r: r.timestamp)
+
+    def load_segment(self, base):
+        with open(base + ".idx", "rb") as f:
+            index = f.read()
+        data_file = open(base + ".dat", "rb")
+        size = os.fstat(data_file.fileno()).st_size
+        if size == 0:
+            data_file.close()
+            return
+        mapped = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.files.append(data_file)
+        self.maps.append(mapped)
+        try:
+            view = memoryview(mapped)
+        except TypeError:  # Python 2.7 mmap has no buffer interface; slices copy
+            view = mapped
+
+        # A crash can leave a partial last entry or payload; ignore it
+        for pos in range(0, len(index) - INDEX.size + 1, INDEX.size):
+            (kind, codec, layers, color_space, width, height,
+             timestamp, capture_ts, offset, length) = INDEX.unpack_from(index, pos)
+            if offset + length > size:
+                break
+            self.records.append(Record(kind, codec, layers, color_space, width, height,
+                                       timestamp, capture_ts, view[offset:offset + length]))
+
+    def frames(self):
+        return [r for r in self.records if r.kind == KIND_FRAME]
+
+    def events(self):
+        return [r for r in self.records if r.kind != KIND_FRAME]
+
+
+class ReplayClock(object):
+    """Maps recorded timestamps onto the local clock at a given speed (0 = no waiting)."""
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.origin = None
+
+    def wait_until(self, timestamp):
+        if not self.speed:
+            return
+        now = monotonic()
+        if self.origin is None:
+            self.origin = (timestamp, now)
+            return
+        target = self.origin[1] + (timestamp - self.origin[0]) / self.speed
+        if target > now:
+            time.sleep(target - now)
+
+
+class RecordingCameraSource(CameraSource):
+    """Feeds the frames of a recorded session to the sender pipeline."""
+
+    def __init__(self, reader, speed=1.0, loop=False):
+        self.frames = reader.frames()
+        if self.frames:
+            self.layers = self.frames[0].layers
+        self.speed = speed
+        self.loop = loop
+        self.position = 0
+        self.clock = ReplayClock(speed)
+
+    def get_image(self):
+        if self.position >= len(self.frames):
+            if not self.loop or not self.frames:
+                return None
+            self.position = 0
+            self.clock = ReplayClock(self.speed)
+        record = self.frames[self.position]
+        self.position += 1
+        self.clock.wait_until(record.timestamp)
+        return make_image(record.image(), record.color_space, record.capture_ts)
+
+    def set_resolution(self, resolution):
+        pass  # recorded frames keep their size
+
+
+def replay_emotions(reader, host="127.0.0.1", port=6000, speed=1.0):
+    """Send recorded emotion labels to an emotion_receiver, one connection each."""
+    clock = ReplayClock(speed)
+    sent = 0
+    for record in reader.events():
+        if record.kind != KIND_EMOTION:
+            continue
+        clock.wait_until(record.timestamp)
+        sock = socket.create_connection((host, port))
+        try:
+            sock.sendall(bytes(record.data))
+        finally:
+            sock.close()
+        sent += 1
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay a recorded session")
+    sub = parser.add_subparsers(dest="command")
+    info = sub.add_parser("info", help="summarise a session")
+    info.add_argument("session")
+    emotions = sub.add_parser("emotions", help="replay emotion labels to a receiver")
+    emotions.add_argument("session")
+    emotions.add_argument("--host", default="127.0.0.1")
+    emotions.add_argument("--port", type=int, default=6000)
+    emotions.add_argument("--speed", type=float, default=1.0,
+                          help="replay speed factor, 0 for as fast as possible")
+    args = parser.parse_args()
+
+    reader = SessionReader(args.session)
+    if args.command == "emotions":
+        sent = replay_emotions(reader, args.host, args.port, args.speed)
+        print("[Replay] Sent %d emotion labels" % sent)
+        return
+
+    counts = {}
+    for record in reader.records:
+        counts[record.kind] = counts.get(record.kind, 0) + 1
+    duration = 0.0
+    if reader.records:
+        duration = reader.records[-1].timestamp - reader.records[0].timestamp
+    print("%s: %.1f s, %s" % (args.session, duration, ", ".join(
+        "%d %s" % (n, KIND_NAMES.get(kind, kind)) for kind, n in sorted(counts.items()))))
+    for record in reader.events():
+        if record.kind == KIND_SPEECH:
+            print("  %.3f speech  %s" % (record.timestamp, record.text()))
+        else:
+            message = parse_message(bytes(record.data))
+            print("  %.3f emotion %s seq=%s classified=%s" % (
+                record.timestamp, message.name, message.seq, message.classified_ts))
+
+
+if __name__ == "__main__":
+    main()
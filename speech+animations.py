@@ -4,6 +4,20 @@ import time
 import threading
 import traceback
 
+from emotion_registry import EMOTIONS, NEUTRAL, code, code_table, name
+
+# ExpressionProperties order of ALFaceCharacteristics, as emotion codes
+FACE_EMOTIONS = [code(emotion) for emotion in ("neutral", "happy", "surprised", "angry", "sad")]
+
+# (pitchShift, voice tag) per emotion code
+SPEECH_PARAMETERS = code_table({
+    "neutral": (1.0, "\\RST\\"),
+    "happy": (1.5, "\\VCT=120\\"),
+    "angry": (0.5, "\\VCT=80\\"),
+    "sad": (0.75, "\\VCT=100\\"),
+    "surprise": (1.1, "\\VCT=110\\"),
+})
+
 class PepperDynamicPitchSpeaker(object):
     def __init__(self, robot_ip, port=9559):
         self.robot_ip = robot_ip  # IP address of the Pepper robot
@@ -25,11 +39,11 @@ class PepperDynamicPitchSpeaker(object):
 
         self.last_animation_time = 0  # Timestamp of the last animation trigger
         self.animation_cooldown = 5.5  # Minimum time in seconds between two animations
-        self.animation_index = {emotion: 0 for emotion in ["happy", "sad", "angry", "surprised", "neutral"]}
+        self.animation_index = [0] * len(EMOTIONS)
         # Tracks which animation to play next for each emotion (used to cycle animations)
 
-        # Emotion-specific animation list
-        self.animations = {
+        # Emotion-specific animation list, indexed by emotion code
+        self.animations = code_table({
             "happy": [
                 "^start(animations/Stand/Gestures/Happy_1)",
                 "^start(animations/Stand/Gestures/WideOpenBothHands_1)",
@@ -46,7 +60,7 @@ class PepperDynamicPitchSpeaker(object):
                 "^start(animations/Stand/Gestures/CircleBothArmsLeaningFront_1)",
                 "^start(animations/Stand/Gestures/GoToStance_SpaceAndTime_LeanRight)"
             ],
-            "surprised": [
+            "surprise": [
                 "^start(animations/Stand/Gestures/LittleArmsBump_1)",
                 "^start(animations/Stand/Gestures/StrongBothArmsUpAndDown_LeanLeft_1)",
                 "^start(animations/Stand/Gestures/BothArmsUpAndDown_HeadShake_1)"
@@ -54,7 +68,7 @@ class PepperDynamicPitchSpeaker(object):
             "neutral": [
                 "^start(animations/Stand/Gestures/Chill_1)"
             ]
-        }
+        }, default=[])
 
     def connect_and_init_services(self):
         self.session = qi.Session()  # Create a new NAOqi session object
@@ -74,7 +88,7 @@ class PepperDynamicPitchSpeaker(object):
                 if not ids or len(ids) != 1:
                     # Set to neutral if no one OR multiple people are detected
                     with self.lock:
-                        self.current_emotion = "neutral"
+                        self.current_emotion = NEUTRAL
                 else:
                     person_id = ids[0]  # Only one person detected, proceed
                     now = time.time()
@@ -85,13 +99,12 @@ class PepperDynamicPitchSpeaker(object):
                         props = self.memory.getData("PeoplePerception/Person/%s/ExpressionProperties" % str(person_id))
                         # Get emotion probabilities from memory
 
-                        emotions = ["neutral", "happy", "surprised", "angry", "sad"]
-                        if not props or len(props) != len(emotions):
+                        if not props or len(props) != len(FACE_EMOTIONS):
                             props = [1.0, 0.0, 0.0, 0.0, 0.0]  # Fallback to neutral if invalid
 
-                        scores = dict(zip(emotions, props))  # Map emotions to their scores
+                        best = max(range(len(props)), key=props.__getitem__)  # Highest score
                         with self.lock:
-                            self.current_emotion = max(scores, key=scores.get)  # Set highest scoring emotion
+                            self.current_emotion = FACE_EMOTIONS[best]  # Set highest scoring emotion
                             self.last_emotion_update = now  # Update timestamp
                 time.sleep(1)  # Wait before next loop
             except Exception:
@@ -105,18 +118,12 @@ class PepperDynamicPitchSpeaker(object):
                 continue  # Skip empty sentences or if program is stopping
 
             with self.lock:
-                emotion = self.current_emotion or "neutral"  # Use current detected emotion, default to neutral
+                emotion = self.current_emotion
+            if emotion is None:
+                emotion = NEUTRAL  # Use current detected emotion, default to neutral
 
             # Set voice pitch and VCT modifier based on emotion
-            pitch, vct = 1.0, "\\RST\\"
-            if emotion == "happy":
-                pitch, vct = 1.5, "\\VCT=120\\"
-            elif emotion == "angry":
-                pitch, vct = 0.5, "\\VCT=80\\"
-            elif emotion == "sad":
-                pitch, vct = 0.75, "\\VCT=100\\"
-            elif emotion == "surprised":
-                pitch, vct = 1.1, "\\VCT=110\\"
+            pitch, vct = SPEECH_PARAMETERS[emotion]
 
             try:
                 self.tts.setParameter("pitchShift", pitch)  # Apply pitch change
@@ -127,19 +134,19 @@ class PepperDynamicPitchSpeaker(object):
             # Trigger animation if cooldown has passed and emotion is valid
             now = time.time()
             animation = ""
-            if emotion in self.animations and (now - self.last_animation_time >= self.animation_cooldown):
+            if self.animations[emotion] and (now - self.last_animation_time >= self.animation_cooldown):
                 anim_list = self.animations[emotion]
                 index = self.animation_index[emotion] % len(anim_list)  # Get next animation index cyclically
                 animation = anim_list[index]  # Pick animation
                 self.animation_index[emotion] += 1  # Update index for next round
                 self.last_animation_time = now  # Reset cooldown timer
-                print("[DEBUG] Playing animation for emotion: %s" % emotion)
+                print("[DEBUG] Playing animation for emotion: %s" % name(emotion))
             else:
                 print("[DEBUG] Skipping animation: cooldown not met or invalid emotion.")
 
             # Combine animation trigger, voice pitch command, and sentence
             animated_sentence = "%s %s %s" % (animation, vct, sentence.strip())
-            print("Saying with emotion '%s': %s" % (emotion, animated_sentence))
+            print("Saying with emotion '%s': %s" % (name(emotion), animated_sentence))
             try:
                 self.animated_speech.say(animated_sentence)  # Speak the sentence with animation
             except Exception:
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Latest-wins hand-off between the emotion channel and the storyteller
+# (Python 2.7, runs on the robot).
+#
+# The network loop only calls EmotionState.update() for every label and
+# goes straight back to reading. The storyteller thread takes labels with
+# labels(); a label that arrives while it is still busy with a sentence
+# overwrites the previous one, so after a long sentence it sees the
+# current emotion once instead of working through every stale label that
+# piled up meanwhile. Each Label says how many labels were folded into it
+# (the queue depth the old accept loop would have had) and how long the
+# emotion has been repeated.
+#
+# AsyncSpeech speaks through NAOqi's post.say() so the sentence runs as a
+# task that cancel() can stop, and records how old the emotion was when
+# speech started. ready_to_speak() is the storyteller's speak-or-wait
+# decision, shared by the robot scripts and bench_receiver.py.
+import threading
+
+from emotion_registry import name
+from stream_clock import monotonic
+
+
+class Label(object):
+    __slots__ = ("emotion", "trace", "run", "count", "received_at")
+
+    def __init__(self, emotion, trace, run, count, received_at):
+        self.emotion = emotion
+        self.trace = trace              # LatencyTracker trace of the newest label
+        self.run = run                  # labels in a row with this emotion so far
+        self.count = count              # labels coalesced into this one
+        self.received_at = received_at  # monotonic() arrival of the newest label
+
+    @property
+    def run_started(self):
+        """True if this emotion's run began with the coalesced labels (a new emotion)."""
+        return self.run <= self.count
+
+
+class EmotionState(object):
+    """Latest emotion label, shared by the network loop and the storyteller."""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.emotion = None
+        self.trace = None
+        self.run = 0
+        self.pending = 0
+        self.received_at = None
+        self.closed = False
+        self.updates = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    def update(self, emotion, trace=None):
+        """Called by the network loop for every label; never blocks on speech."""
+        with self.cond:
+            if emotion == self.emotion:
+                self.run += 1
+            else:
+                self.emotion = emotion
+                self.run = 1
+            if self.pending:
+                self.coalesced += 1
+            self.pending += 1
+            self.max_depth = max(self.max_depth, self.pending)
+            self.trace = trace
+            self.received_at = monotonic()
+            self.updates += 1
+            self.cond.notify()
+
+    def reset_run(self):
+        """Start counting repetitions afresh, e.g. after a sentence was spoken."""
+        with self.cond:
+            self.run = 0
+
+    def take(self, timeout=None):
+        """Wait for a label not taken yet; returns a Label, or None on timeout or close()."""
+        with self.cond:
+            if not self.pending and not self.closed:
+                self.cond.wait(timeout)
+            if not self.pending:
+                return None
+            label = Label(self.emotion, self.trace, self.run, self.pending, self.received_at)
+            self.pending = 0
+            return label
+
+    def labels(self):
+        """Yield the newest label each time one arrives, until close()."""
+        while not self.closed:
+            label = self.take(1.0)
+            if label is not None:
+                yield label
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+def ready_to_speak(label, now, last_spoken, min_delay, repeats=None):
+    """Speak-or-wait decision for a label taken at time.time() `now`.
+
+    At least min_delay seconds must have passed since the last sentence.
+    With repeats set (the adaptive scripts), the emotion must also be new
+    or have come in `repeats` times in a row.
+    """
+    if now - last_spoken < min_delay:
+        return False
+    return repeats is None or label.run_started or label.run >= repeats
+
+
+class AsyncSpeech(object):
+    """Speaks through post.say() so a running sentence can be cancelled."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = None  # (proxy, task id) while a sentence is running
+        self.spoken = 0
+        self.cancelled = 0
+        self.total_staleness = 0.0
+        self.max_staleness = 0.0
+
+    def say(self, label, proxy, *args):
+        """Speak args with proxy (ALTextToSpeech or ALAnimatedSpeech); blocks until done."""
+        staleness = monotonic() - label.received_at if label is not None else 0.0
+        self.spoken += 1
+        self.total_staleness += staleness
+        self.max_staleness = max(self.max_staleness, staleness)
+        if label is not None:
+            print("[Speech] %s label was %.0f ms old, %d coalesced (mean %.0f ms, max %.0f ms)" % (
+                name(label.emotion), 1000.0 * staleness, label.count - 1,
+                1000.0 * self.total_staleness / self.spoken, 1000.0 * self.max_staleness))
+
+        task = proxy.post.say(*args)
+        with self.lock:
+            self.current = (proxy, task)
+        try:
+            proxy.wait(task, 0)
+        finally:
+            with self.lock:
+                self.current = None
+
+    def cancel(self):
+        """Stop the sentence being spoken, if any."""
+        with self.lock:
+            current = self.current
+        if current is not None:
+            proxy, task = current
+            proxy.stop(task)
+            self.cancelled += 1
+
+    def describe(self, state=None):
+        text = "spoken=%d cancelled=%d staleness mean %.0f ms max %.0f ms" % (
+            self.spoken, self.cancelled,
+            1000.0 * self.total_staleness / self.spoken if self.spoken else 0.0,
+            1000.0 * self.max_staleness)
+        if state is not None:
+            text += ", %d labels, %d coalesced, max depth %d" % (
+                state.updates, state.coalesced, state.max_depth)
+        return text
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Monotonic clock for the streaming code.
+#
+# Python 2.7 on the robot has no time.monotonic(), and time.time() jumps
+# whenever NAOqi or the user changes the system clock, which breaks any
+# interval or deadline computed from it. On Linux we read CLOCK_MONOTONIC
+# through ctypes; elsewhere we fall back to time.time().
+import ctypes
+import ctypes.util
+import time
+
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def _load_clock_gettime():
+    for name in ("rt", "c"):
+        path = ctypes.util.find_library(name)
+        if not path:
+            continue
+        try:
+            lib = ctypes.CDLL(path, use_errno=True)
+            clock_gettime = lib.clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+        return clock_gettime
+    return None
+
+
+if hasattr(time, "monotonic"):
+    monotonic = time.monotonic
+else:
+    _clock_gettime = _load_clock_gettime()
+
+    if _clock_gettime is not None:
+        def monotonic():
+            ts = _timespec()
+            if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, "clock_gettime failed")
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+    else:
+        monotonic = time.time
@@ -1,12 +1,14 @@
 from naoqi import ALProxy
 import socket
 import time
-import struct
 import cv2
 import numpy as np
 import threading
 import sys
 
+from frame_pacer import FramePacer
+from frame_transport import FrameSender
+
 # === Pepper Configuration ===
 PEPPER_IP = "192.168.0.102"
 PEPPER_PORT = 9559
@@ -77,7 +79,10 @@ try:
     sock.connect((LAPTOP_IP, LAPTOP_PORT))
     print "[Video Sender] Connected to laptop at", LAPTOP_IP, LAPTOP_PORT
 
+    sender = FrameSender(sock)
+    pacer = FramePacer(fps)
     while True:
+        pacer.wait()
         image = video_proxy.getImageRemote(capture_id)
         if image is None:
             print "[Video Sender] No image received"
@@ -98,13 +103,8 @@ try:
             print "[Video Sender] Failed to encode frame"
             continue
 
-        jpg_bytes = jpg.tostring()
-
-        # Send JPEG size header and frame
-        sock.sendall(struct.pack(">I", len(jpg_bytes)))
-        sock.sendall(jpg_bytes)
-
-        time.sleep(1.0 / fps)
+        # Send length header and frame in one write
+        sender.send_frame(jpg.reshape(-1))
 
 except KeyboardInterrupt:
     print "Interrupted by user, exiting..."
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+# Pipelined video sender (Python 2.7, runs against NAOqi on the robot).
+#
+# Capture, encode and send run in their own threads, connected by small
+# drop-oldest queues. A slow getImageRemote() call or a stalled WiFi link
+# only delays its own stage; the other stages keep working on the newest
+# frame instead of waiting in line behind it.
+#
+# With a latency tracker attached, every frame header carries the NAOqi
+# capture time and the tracker is told when each frame was encoded and
+# sent, so echoed labels can be traced back hop by hop. With a clock_sync
+# the send thread also slips clock pings in between frames.
+#
+# With a non-blocking transport (frame_transport.NonBlockingFrameSender)
+# the send thread only hands frames over and pumps the socket; send stats,
+# the latency tracker and the quality controller then see the time each
+# frame actually spent on the wire, and frames the socket could not take
+# in time are replaced by newer ones.
+#
+# A transport with a `connected` flag (frame_transport.ReconnectingTransport)
+# pauses capture while the link is down; the camera stays subscribed, and
+# the first frame after a reconnect is sent as a keyframe.
+import collections
+import threading
+import time
+
+import numpy as np
+
+from frame_encoders import JpegEncoder
+from frame_pacer import FramePacer
+from stream_clock import monotonic
+
+
+class DropOldestQueue(object):
+    """Bounded FIFO that discards the oldest item when full instead of blocking."""
+
+    def __init__(self, maxsize=2):
+        self.maxsize = maxsize
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """Return the oldest item, or None on timeout or after close()."""
+        with self.cond:
+            if not self.items and not self.closed:
+                self.cond.wait(timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def depth(self):
+        with self.cond:
+            return len(self.items)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class StageStats(object):
+    """Per-stage counters: frames processed and time spent working."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.count = 0
+        self.busy = 0.0
+        self.last_count = 0
+        self.last_busy = 0.0
+
+    def record(self, duration):
+        with self.lock:
+            self.count += 1
+            self.busy += duration
+
+    def snapshot(self):
+        """Return (frames, busy seconds) since the previous snapshot."""
+        with self.lock:
+            frames = self.count - self.last_count
+            busy = self.busy - self.last_busy
+            self.last_count = self.count
+            self.last_busy = self.busy
+        return frames, busy
+
+
+class Frame(object):
+    __slots__ = ("seq", "image", "captured_at", "capture_ts", "encoded_at",
+                 "payload", "header", "skipped", "keyframe")
+
+    def __init__(self, seq, image, captured_at, capture_ts=0.0):
+        self.seq = seq
+        self.image = image
+        self.captured_at = captured_at
+        self.capture_ts = capture_ts
+        self.encoded_at = None
+        self.payload = None
+        self.header = None
+        self.skipped = 0
+        self.keyframe = False
+
+
+class VideoPipeline(object):
+    """Capture -> encode -> send, each stage on its own worker thread."""
+
+    def __init__(self, source, transport, fps=10, queue_size=2,
+                 report_interval=5.0, quality_controller=None, roi_tracker=None,
+                 change_detector=None, recorder=None, latency_tracker=None,
+                 clock_sync=None, encoder=None, poll_interval=0.01):
+        self.source = source
+        self.transport = transport
+        self.pump = getattr(transport, "pump", None)
+        self.poll_interval = poll_interval
+        self.encoder = encoder or JpegEncoder()
+        self.quality_controller = quality_controller
+        self.roi_tracker = roi_tracker
+        self.change_detector = change_detector
+        self.recorder = recorder
+        self.latency_tracker = latency_tracker
+        self.clock_sync = clock_sync
+        self.extended_header = (roi_tracker is not None or change_detector is not None
+                                or latency_tracker is not None
+                                or not self.encoder.legacy_compatible
+                                or getattr(source, "layers", 3) == 1)
+        self.resolution = quality_controller.resolution if quality_controller else None
+        self.pacer = FramePacer(fps)
+        self.report_interval = report_interval
+
+        self.encode_queue = DropOldestQueue(queue_size)
+        self.send_queue = DropOldestQueue(queue_size)
+        self.stats = {
+            "capture": StageStats("capture"),
+            "encode": StageStats("encode"),
+            "send": StageStats("send"),
+        }
+
+        self.running = False
+        self.error = None
+        self.threads = []
+        self.seq = 0
+
+    # --- Stages ---------------------------------------------------------
+
+    def apply_resolution(self):
+        resolution = self.quality_controller.settings()[1]
+        if resolution != self.resolution:
+            self.source.set_resolution(resolution)
+            self.resolution = resolution
+
+    def capture(self):
+        if self.quality_controller:
+            self.apply_resolution()
+        image = self.source.get_image()
+        if image is None:
+            print("[Video Sender] No image received")
+            time.sleep(0.1)
+            return None
+        if self.recorder:
+            self.recorder.record_frame(image)
+
+        width = image[0]
+        height = image[1]
+        layers = image[2]
+        array = image[6]
+
+        np_arr = np.frombuffer(array, np.uint8)
+        if layers == 1:
+            img = np_arr.reshape((height, width))  # Y-only capture profile
+        else:
+            img = np_arr.reshape((height, width, layers))
+
+        self.seq += 1
+        frame = Frame(self.seq, img, time.time(), image[4] + image[5] * 1e-6)
+        if self.change_detector:
+            send, keyframe = self.change_detector.check(img)
+            if not send:
+                return None
+            frame.skipped = self.change_detector.take_skipped()
+            frame.keyframe = keyframe
+        return frame
+
+    def encode(self, frame):
+        image = frame.image
+        roi = None
+        if self.roi_tracker:
+            roi = self.roi_tracker.locate(image)
+            if roi is not None:
+                x, y, w, h = roi
+                image = image[y:y + h, x:x + w]
+
+        if self.quality_controller:
+            self.encoder.set_quality(self.quality_controller.settings()[0])
+        try:
+            payload, fields = self.encoder.encode(image)
+        except ValueError as e:
+            print("[Video Sender] Failed to encode frame:", e)
+            return None
+
+        if self.extended_header:
+            height, width = frame.image.shape[:2]
+            frame.header = {
+                "seq": frame.seq, "frame_w": width, "frame_h": height, "roi": roi,
+                "skipped": frame.skipped, "keyframe": frame.keyframe,
+                "capture_ts": frame.capture_ts,
+            }
+            frame.header.update(fields)
+        frame.encoded_at = time.time()
+        frame.payload = payload  # view of the encoder output, no copy
+        frame.image = None
+        return frame
+
+    def send(self, frame):
+        self.transport.send_frame(frame.payload, frame.header)
+        self.sent(frame, time.time())
+
+    def sent(self, frame, sent_ts):
+        if self.latency_tracker:
+            self.latency_tracker.frame_sent(frame.seq, frame.capture_ts,
+                                            frame.encoded_at, sent_ts)
+
+    def finish_sends(self, stats):
+        """Account for the frames a non-blocking transport has finished writing."""
+        for frame, _, duration, sent_ts in self.transport.take_sent():
+            if frame is None:
+                continue  # clock ping
+            stats.record(duration)
+            self.sent(frame, sent_ts)
+            if self.quality_controller:
+                self.quality_controller.observe(len(frame.payload), duration)
+
+    # --- Workers --------------------------------------------------------
+
+    def link_up(self):
+        return getattr(self.transport, "connected", True)
+
+    def capture_loop(self):
+        stats = self.stats["capture"]
+        paused = False
+        while self.running:
+            started = self.pacer.wait()
+            if not self.link_up():
+                paused = True
+                continue
+            if paused:
+                paused = False
+                if self.change_detector:
+                    self.change_detector.reset()
+            frame = self.capture()
+            if frame is None:
+                continue
+            stats.record(monotonic() - started)
+            self.encode_queue.put(frame)
+
+    def encode_loop(self):
+        stats = self.stats["encode"]
+        while self.running:
+            frame = self.encode_queue.get(timeout=0.5)
+            if frame is None:
+                continue
+            started = monotonic()
+            frame = self.encode(frame)
+            if frame is None:
+                continue
+            stats.record(monotonic() - started)
+            self.send_queue.put(frame)
+
+    def send_loop(self):
+        stats = self.stats["send"]
+        while self.running:
+            idle = True
+            if self.pump is not None:
+                idle = self.pump(self.poll_interval)
+                self.finish_sends(stats)
+            if idle and self.clock_sync and self.clock_sync.due():
+                self.transport.send_frame(self.clock_sync.make_ping())
+            frame = self.send_queue.get(timeout=0.5 if idle else 0)
+            if frame is None:
+                continue
+            if self.pump is not None:
+                self.transport.send_frame(frame.payload, frame.header, tag=frame)
+                continue
+            started = monotonic()
+            self.send(frame)
+            duration = monotonic() - started
+            stats.record(duration)
+            if self.quality_controller:
+                self.quality_controller.observe(len(frame.payload), duration)
+
+    def guarded(self, loop):
+        try:
+            loop()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+            self.running = False
+            self.encode_queue.close()
+            self.send_queue.close()
+
+    # --- Control --------------------------------------------------------
+
+    def start(self):
+        self.running = True
+        for loop in (self.capture_loop, self.encode_loop, self.send_loop):
+            thread = threading.Thread(target=self.guarded, args=(loop,))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        self.encode_queue.close()
+        self.send_queue.close()
+        for thread in self.threads:
+            thread.join(1.0)
+
+    def report(self, elapsed):
+        parts = []
+        queues = {"encode": self.encode_queue, "send": self.send_queue}
+        for name in ("capture", "encode", "send"):
+            frames, busy = self.stats[name].snapshot()
+            rate = frames / elapsed if elapsed > 0 else 0.0
+            avg_ms = 1000.0 * busy / frames if frames else 0.0
+            part = "%s %.1f fps (%.1f ms)" % (name, rate, avg_ms)
+            if name in queues:
+                queue = queues[name]
+                part += " q=%d/%d drop=%d" % (queue.depth(), queue.maxsize, queue.dropped)
+            parts.append(part)
+        rate, mean_jitter, max_jitter, missed = self.pacer.snapshot()
+        parts.append("paced %.1f fps jitter %.1f/%.1f ms missed=%d" % (
+            rate, 1000.0 * mean_jitter, 1000.0 * max_jitter, missed))
+        if self.quality_controller:
+            parts.append(self.quality_controller.describe())
+        if self.change_detector:
+            parts.append("static skipped=%d diff=%.1f" % (
+                self.change_detector.total_skipped, self.change_detector.last_diff))
+        if hasattr(self.transport, "describe"):
+            parts.append(self.transport.describe())
+        if self.clock_sync:
+            parts.append(self.clock_sync.describe())
+        print("[Video Pipeline] " + " | ".join(parts))
+
+    def run_forever(self):
+        """Block the calling thread, printing stage stats; re-raise worker errors."""
+        self.start()
+        last_report = monotonic()
+        while self.running:
+            time.sleep(0.2)
+            now = monotonic()
+            if now - last_report >= self.report_interval:
+                self.report(now - last_report)
+                last_report = now
+        if self.error is not None:
+            raise self.error